@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""Measure the RS256 verification path with tokens from the local Auth0 stand-in
+
+Usage:
+    python benchmarks/auth.py [--requests 2000]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    sys.path.insert(0, ROOT)
+    from src.auth.local_auth0 import LocalAuth0
+
+    auth0 = LocalAuth0.generate()
+    tmp = tempfile.mkdtemp()
+    os.environ.update(
+        DATABASE_URL="sqlite://",
+        AUTH0_JWKS_URL=f"file://{auth0.write_jwks(os.path.join(tmp, 'jwks.json'))}",
+        AUTH0_ISSUER=auth0.issuer,
+        RATELIMIT_ENABLED="false",
+    )
+    from src.api import create_app
+    from src.auth.auth import verify_decode_jwt
+    from src.database.persistence import db
+
+    app = create_app("production")
+    token = auth0.mint("latte")
+    with app.app_context():
+        db.create_all()
+        start = time.perf_counter()
+        for _ in range(args.requests):
+            verify_decode_jwt(token, "latte")
+        verify = (time.perf_counter() - start) / args.requests
+
+    # A missing id still runs the whole auth path before the 404
+    headers = {"Authorization": f"Bearer {token}"}
+    with app.test_client() as client:
+        start = time.perf_counter()
+        for _ in range(args.requests):
+            client.delete("/api/latte/999999", headers=headers)
+        request = (time.perf_counter() - start) / args.requests
+
+    print(f"verify_decode_jwt:        {verify * 1e6:8.1f} us")
+    print(f"DELETE /api/latte/<id>:   {request * 1e6:8.1f} us")
+
+
+if __name__ == "__main__":
+    main()
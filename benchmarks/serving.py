@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""Compare the gunicorn profiles of gunicorn.conf.py on the public endpoints
+
+Usage:
+    python benchmarks/serving.py [--profiles sync gthread] [--clients 16] [--duration 10]
+
+Each profile serves a seeded SQLite database, then keep-alive clients hit
+GET /api/latte, /api/latte/<id>, /api/project and /api/project/<id> in turn.
+"""
+import argparse
+import http.client
+import importlib.util
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PATHS = ["/api/latte", "/api/latte/1", "/api/project", "/api/project/1"]
+
+
+def seed(database_url, rows):
+    """Create the tables and fill them with sample rows"""
+    os.environ["DATABASE_URL"] = database_url
+    sys.path.insert(0, ROOT)
+    from src.api import create_app
+    from src.database.latte import Latte
+    from src.database.persistence import db
+    from src.database.project import Project
+
+    app = create_app("production")
+    with app.app_context():
+        db.create_all()
+        for i in range(rows):
+            ingredients = [{"color": "brown", "name": "espresso", "parts": 1 + i % 3}]
+            db.session.add(Latte(title=f"latte {i}", ingredients=json.dumps(ingredients)))
+            db.session.add(
+                Project(
+                    title=f"project {i}",
+                    meta=json.dumps(["flask", "benchmark"]),
+                    description="benchmark project " * 8,
+                    image="https://cdn.example.com/image.png",
+                    git_repo="https://github.com/example/repo",
+                    demo_link="https://example.com",
+                )
+            )
+        db.session.commit()
+
+
+def start_server(profile, port, database_url, workers):
+    env = dict(
+        os.environ,
+        GUNICORN_PROFILE=profile,
+        FLASK_CONFIG="production",
+        DATABASE_URL=database_url,
+        RATELIMIT_ENABLED="false",
+    )
+    if workers:
+        env["GUNICORN_WORKERS"] = str(workers)
+    server = subprocess.Popen(
+        ["gunicorn", "-c", "gunicorn.conf.py", "--bind", f"127.0.0.1:{port}", "wsgi:app"],
+        cwd=ROOT,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    for _ in range(100):
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/")
+            conn.getresponse().read()
+            return server
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError(f"gunicorn did not start with the {profile} profile")
+
+
+def load(port, clients, duration):
+    """Run keep-alive clients for duration seconds
+    Returns:
+        (latencies in seconds, number of non 200 or dropped requests)
+    """
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def client(offset):
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+        mine, failed, i = [], 0, offset
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            try:
+                conn.request("GET", PATHS[i % len(PATHS)])
+                res = conn.getresponse()
+                res.read()
+                if res.status != 200:
+                    failed += 1
+            except (OSError, http.client.HTTPException):
+                # Recycled workers (max_requests) drop their keep-alive connections
+                failed += 1
+                conn.close()
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+            mine.append(time.perf_counter() - start)
+            i += 1
+        with lock:
+            latencies.extend(mine)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--profiles", nargs="+", default=["sync", "gthread", "gevent"])
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--rows", type=int, default=50)
+    parser.add_argument("--workers", type=int, help="override the profile's worker count")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database_url = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        seed(database_url, args.rows)
+
+        print(f"{'profile':<10}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'errors':>8}")
+        for profile in args.profiles:
+            if profile == "gevent" and importlib.util.find_spec("gevent") is None:
+                print(f"{profile:<10}  skipped, gevent is not installed")
+                continue
+            server = start_server(profile, args.port, database_url, args.workers)
+            try:
+                latencies, errors = load(args.port, args.clients, args.duration)
+            finally:
+                server.terminate()
+                server.wait()
+            latencies.sort()
+            p50 = statistics.median(latencies) * 1000
+            p99 = latencies[int(len(latencies) * 0.99) - 1] * 1000
+            rate = len(latencies) / args.duration
+            print(f"{profile:<10}{rate:>10.0f}{p50:>10.1f}{p99:>10.1f}{errors:>8}")
+
+
+if __name__ == "__main__":
+    main()
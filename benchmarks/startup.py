@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""Measure cold start of the app factory, as paid by every worker
+
+Usage:
+    python benchmarks/startup.py [--runs 5] [--top 15]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SNIPPET = "from src.api import create_app; create_app('testing')"
+# Modules that only the CLI or an authenticated request should pay for
+LAZY_MODULES = ("alembic", "flask_migrate", "jose", "Crypto", "redis")
+
+
+def run(*args):
+    env = dict(os.environ, DATABASE_URL=os.getenv("DATABASE_URL", "sqlite://"))
+    return subprocess.run(
+        [sys.executable, *args], cwd=ROOT, env=env, capture_output=True, text=True, check=True
+    )
+
+
+def cold_start():
+    """Seconds to import and build the app in a fresh interpreter"""
+    code = f"import time; t = time.perf_counter(); {SNIPPET}; print(time.perf_counter() - t)"
+    return float(run("-c", code).stdout)
+
+
+def loaded_modules():
+    out = run("-c", f"import sys; {SNIPPET}; print('\\n'.join(sys.modules))")
+    return set(out.stdout.split())
+
+
+def import_times(top):
+    """Slowest modules by cumulative import time, from -X importtime"""
+    out = run("-X", "importtime", "-c", SNIPPET)
+    rows = []
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        rows.append((int(cumulative), name.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    times = [cold_start() for _ in range(args.runs)]
+    print(f"cold start: median {statistics.median(times) * 1000:.1f} ms over {args.runs} runs")
+    eager = sorted(m for m in loaded_modules() if m.split(".")[0] in LAZY_MODULES)
+    print(f"eagerly imported lazy modules: {', '.join(eager) or 'none'}")
+    print("slowest imports (cumulative us):")
+    for cumulative, name in import_times(args.top):
+        print(f"{cumulative:>10}  {name}")
+
+
+if __name__ == "__main__":
+    main()
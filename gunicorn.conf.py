@@ -0,0 +1,57 @@
+"""Gunicorn settings, picked up automatically from the working directory
+
+GUNICORN_PROFILE selects the worker class:
+    sync     one request per process, safest for CPU bound work (default)
+    gthread  a few threads per process, good for I/O on the database and Auth0
+    gevent   cooperative greenlets, needs `pip install gevent psycogreen`
+Every value below can be overridden with the matching GUNICORN_* variable.
+"""
+import multiprocessing
+import os
+
+cpus = multiprocessing.cpu_count()
+profile = os.getenv("GUNICORN_PROFILE", "sync")
+
+PROFILES = {
+    "sync": {"worker_class": "sync", "workers": cpus * 2 + 1, "threads": 1},
+    "gthread": {"worker_class": "gthread", "workers": cpus + 1, "threads": 4},
+    "gevent": {"worker_class": "gevent", "workers": cpus, "threads": 1},
+}
+if profile not in PROFILES:
+    raise RuntimeError(f"GUNICORN_PROFILE must be one of {', '.join(PROFILES)}, not {profile}")
+
+
+def setting(name, default, cast=int):
+    return cast(os.getenv(f"GUNICORN_{name.upper()}", default))
+
+
+worker_class = PROFILES[profile]["worker_class"]
+# Heroku sizes dynos through WEB_CONCURRENCY
+workers = setting("workers", os.getenv("WEB_CONCURRENCY", PROFILES[profile]["workers"]))
+threads = setting("threads", PROFILES[profile]["threads"])
+worker_connections = setting("worker_connections", 1000)
+
+timeout = setting("timeout", 30)
+graceful_timeout = setting("graceful_timeout", 30)
+keepalive = setting("keepalive", 5)
+
+# Recycle workers to bound memory growth, jitter keeps them from restarting together
+max_requests = setting("max_requests", 2000)
+max_requests_jitter = setting("max_requests_jitter", 200)
+
+# Import the app once in the master and fork it into the workers
+preload_app = setting("preload", "false", lambda v: v.lower() == "true")
+
+
+def post_fork(server, worker):
+    """Workers must not share the database connections or keys of the master"""
+    from src.auth.auth import reset_jwks_cache
+    from src.helpers.logs import after_fork
+
+    reset_jwks_cache()
+    after_fork()
+    if preload_app:
+        from src.database.persistence import dispose_engine
+        from wsgi import app
+
+        dispose_engine(app)
@@ -19,14 +19,17 @@ def setenv(variable: str, default: str) -> None:
 
 setenv("APPLICATION_CONFIG", "development")
 
-config_json_filename = os.getenv("APPLICATION_CONFIG") + ".json"
-with open(os.path.join("config", config_json_filename)) as f:
-    config = json.load(f)
+# Nested invocations (e.g. from the Procfile) inherit the environment already
+if os.getenv("APPLICATION_CONFIG_LOADED") != os.getenv("APPLICATION_CONFIG"):
+    config_json_filename = os.getenv("APPLICATION_CONFIG") + ".json"
+    with open(os.path.join("config", config_json_filename)) as f:
+        config = json.load(f)
 
-config = dict((i["name"], i["value"]) for i in config)
+    config = dict((i["name"], i["value"]) for i in config)
 
-for key, value in config.items():
-    setenv(key, value)
+    for key, value in config.items():
+        setenv(key, value)
+    os.environ["APPLICATION_CONFIG_LOADED"] = os.environ["APPLICATION_CONFIG"]
 
 
 @click.group()
@@ -50,6 +53,171 @@ def flask(subcommand):
         p.wait()
 
 
+def progress(table: str, done: int, total: int) -> None:
+    """Report bulk export/import progress on stderr"""
+    suffix = f"/{total}" if total is not None else ""
+    click.echo(f"{table}: {done}{suffix} rows", err=True)
+
+
+BULK_OPTIONS = [
+    click.option("--dir", "directory", default="exports", type=click.Path(file_okay=False)),
+    click.option("--format", "fmt", default="ndjson", type=click.Choice(["ndjson", "csv"])),
+    click.option("--table", "tables", multiple=True, type=click.Choice(["latte", "project"])),
+    click.option("--chunk-size", default=1000, show_default=True),
+    click.option("--resume", is_flag=True, help="Continue from the last checkpoint"),
+]
+
+
+def bulk_options(f):
+    """Options shared by the export and import commands"""
+    for option in reversed(BULK_OPTIONS):
+        f = option(f)
+    return f
+
+
+def bulk_run(action, directory, fmt, tables, chunk_size, resume):
+    """Run an export/import action for every requested table"""
+    from src.api import create_app
+    from src.database.bulk import TABLES
+    from src.database.persistence import db
+
+    app = create_app(os.environ["FLASK_CONFIG"])
+    with app.app_context():
+        for name in tables or TABLES:
+            path = os.path.join(directory, f"{name}.{fmt}")
+            rows = action(
+                db.engine,
+                TABLES[name],
+                path,
+                fmt=fmt,
+                chunk_size=chunk_size,
+                resume=resume,
+                progress=progress,
+            )
+            click.echo(f"{name}: {rows} rows {path}")
+
+
+@cli.command()
+@bulk_options
+def export(directory, fmt, tables, chunk_size, resume):
+    """Stream tables to NDJSON/CSV files"""
+    from src.database.bulk import export_table
+
+    os.makedirs(directory, exist_ok=True)
+    bulk_run(export_table, directory, fmt, tables, chunk_size, resume)
+
+
+@cli.command("import")
+@bulk_options
+def import_(directory, fmt, tables, chunk_size, resume):
+    """Load tables from NDJSON/CSV files written by export"""
+    from src.database.bulk import import_table
+
+    bulk_run(import_table, directory, fmt, tables, chunk_size, resume)
+
+
+@cli.command()
+def worker():
+    """Run the background tasks queued in the database"""
+    from src.api import create_app
+    from src.helpers.tasks import tasks
+
+    create_app(os.environ["FLASK_CONFIG"])
+    if tasks.backend != "database":
+        raise click.UsageError("worker needs TASKS_BACKEND=database")
+    try:
+        tasks.run_worker()
+    except KeyboardInterrupt:
+        pass
+
+
+@cli.command()
+@click.option("--max-minutes", type=float, help="Stop after this long, e.g. at the end of off-peak")
+def purge(max_minutes):
+    """Delete the tombstones older than TOMBSTONE_RETENTION, in small batches"""
+    import time
+
+    from src.api import create_app
+    from src.database.bulk import TABLES
+    from src.database.persistence import db
+    from src.database.tombstone import purge as purge_table
+
+    app = create_app(os.environ["FLASK_CONFIG"])
+    deadline = time.time() + max_minutes * 60 if max_minutes else None
+    with app.app_context():
+        for name, table in TABLES.items():
+            rows = purge_table(
+                db.engine,
+                table,
+                time.time() - app.config["TOMBSTONE_RETENTION"],
+                batch_size=app.config["PURGE_BATCH_SIZE"],
+                pause=app.config["PURGE_PAUSE"],
+                deadline=deadline,
+                progress=lambda table, done: click.echo(f"{table}: {done} rows", err=True),
+            )
+            click.echo(f"{name}: {rows} tombstones purged")
+
+
+@cli.command("rebuild-stats")
+def rebuild_stats():
+    """Recompute the counters behind /api/stats from the tables"""
+    from src.api import create_app
+    from src.database.persistence import db
+    from src.database.stats import rebuild
+
+    app = create_app(os.environ["FLASK_CONFIG"])
+    with app.app_context():
+        click.echo(f"{rebuild(db.engine)} counters")
+
+
+@cli.command("static-export")
+@click.option("--dir", "directory", type=click.Path(file_okay=False), help="STATIC_EXPORT_DIR")
+@click.option("--full", is_flag=True, help="Render everything, not only what changed")
+def static_export_(directory, full):
+    """Render the public GET endpoints to static JSON files"""
+    from src.api import create_app
+    from src.helpers.static import static_export
+
+    app = create_app(os.environ["FLASK_CONFIG"])
+    if directory:
+        app.config["STATIC_EXPORT_DIR"] = directory
+        static_export.init_app(app)
+    if not static_export.enabled:
+        raise click.UsageError("static-export needs --dir or STATIC_EXPORT_DIR")
+    with app.app_context():
+        for name, files in static_export.build(full=full).items():
+            click.echo(f"{name}: {files} resources rendered or removed")
+
+
+@cli.command("migrate-online")
+@click.argument("name", required=False)
+@click.option("--dry-run", is_flag=True, help="Report the locks and estimated times only")
+def migrate_online(name, dry_run):
+    """Run an online migration, or list them without a name"""
+    from src.api import create_app
+    from src.database.online import MIGRATIONS
+    from src.database.persistence import db
+
+    if name is None:
+        for name in MIGRATIONS:
+            click.echo(name)
+        return
+    if name not in MIGRATIONS:
+        raise click.UsageError(f"No online migration named {name}")
+
+    app = create_app(os.environ["FLASK_CONFIG"])
+    with app.app_context():
+        migration = MIGRATIONS[name]
+        if dry_run:
+            for step in migration.plan(db.engine):
+                click.echo(
+                    "{step}. {action}: {rows} rows, {lock} lock blocking {blocks} "
+                    "for ~{lock_seconds}s, ~{seconds}s in total".format(**step)
+                )
+            return
+        migration.run(db.engine, report=lambda message: click.echo(message, err=True))
+
+
 cli.add_command(flask)
 
 if __name__ == "__main__":
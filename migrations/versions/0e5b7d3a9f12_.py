@@ -0,0 +1,29 @@
+"""newest tombstone purged from each table, for the changes cursors
+
+Revision ID: 0e5b7d3a9f12
+Revises: 1a7c3e9d5b28
+Create Date: 2026-10-19 21:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0e5b7d3a9f12'
+down_revision = '1a7c3e9d5b28'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('tombstone_horizon',
+    sa.Column('table_name', sa.String(length=64), nullable=False),
+    sa.Column('updated_at', sa.Float(), nullable=False),
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('table_name')
+    )
+
+
+def downgrade():
+    op.drop_table('tombstone_horizon')
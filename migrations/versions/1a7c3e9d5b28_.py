@@ -0,0 +1,95 @@
+"""counters behind /api/stats
+
+Revision ID: 1a7c3e9d5b28
+Revises: 6d2f8a9c1b47
+Create Date: 2026-10-19 19:05:00.000000
+
+"""
+import json
+from collections import Counter
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1a7c3e9d5b28'
+down_revision = '6d2f8a9c1b47'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 1000
+
+
+def upgrade():
+    stat = op.create_table('stat',
+    sa.Column('owner', sa.String(length=128), nullable=False),
+    sa.Column('kind', sa.String(length=20), nullable=False),
+    sa.Column('name', sa.String(length=80), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('owner', 'kind', 'name')
+    )
+    backfill(op.get_bind(), stat)
+
+
+def backfill(conn, stat):
+    """Count the live rows, one batch at a time"""
+    counts = Counter()
+    for name, column, keys in [
+        ('latte', 'ingredients', ingredient_names),
+        ('project', 'meta', tags),
+    ]:
+        table = sa.table(
+            name,
+            sa.column('id', sa.Integer),
+            sa.column('owner', sa.String),
+            sa.column('deleted_at', sa.Float),
+            sa.column(column, sa.String),
+        )
+        last_id = 0
+        while True:
+            rows = conn.execute(
+                sa.select([table.c.id, table.c.owner, table.c[column]])
+                .where(table.c.id > last_id)
+                .where(table.c.deleted_at.is_(None))
+                .order_by(table.c.id)
+                .limit(BATCH_SIZE)
+            ).fetchall()
+            if not rows:
+                break
+            for _, owner, blob in rows:
+                counts[(owner, f'{name}s', '')] += 1
+                counts.update((owner, kind, key) for kind, key in keys(blob))
+            last_id = rows[-1][0]
+    rows = [
+        {'owner': owner, 'kind': kind, 'name': key, 'count': count}
+        for (owner, kind, key), count in counts.items()
+    ]
+    if rows:
+        conn.execute(stat.insert(), rows)
+
+
+def load(blob):
+    try:
+        items = json.loads(blob) if blob else []
+    except (TypeError, ValueError):
+        return []
+    return items if isinstance(items, list) else []
+
+
+def ingredient_names(blob):
+    # Same rules as src.database.stats.latte_keys, frozen for this revision
+    items = load(blob)
+    if not all(isinstance(item, dict) for item in items):
+        return set()
+    names = {item.get('name') for item in items}
+    return {('ingredient', name[:80]) for name in names if isinstance(name, str) and name}
+
+
+def tags(blob):
+    # Same rules as src.database.stats.project_keys
+    return {('tag', item[:80]) for item in load(blob) if isinstance(item, str)}
+
+
+def downgrade():
+    op.drop_table('stat')
@@ -0,0 +1,35 @@
+"""background task queue
+
+Revision ID: 2b7e5f0c9d31
+Revises: 9c1d2e7a4b50
+Create Date: 2026-10-19 13:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2b7e5f0c9d31'
+down_revision = '9c1d2e7a4b50'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('task',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=80), nullable=False),
+    sa.Column('args', sa.Text(), nullable=False),
+    sa.Column('status', sa.String(length=10), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('run_at', sa.Float(), nullable=False),
+    sa.Column('last_error', sa.String(length=300), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_task_status_run_at', 'task', ['status', 'run_at'])
+
+
+def downgrade():
+    op.drop_index('ix_task_status_run_at', table_name='task')
+    op.drop_table('task')
@@ -0,0 +1,51 @@
+"""soft deletes with tombstones
+
+Revision ID: 3f6a2d8c5e14
+Revises: 7c4d9b2e1a83
+Create Date: 2026-10-19 14:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f6a2d8c5e14'
+down_revision = '7c4d9b2e1a83'
+branch_labels = None
+depends_on = None
+
+TABLES = ['latte', 'project']
+
+
+def upgrade():
+    live, dead = sa.text('deleted_at IS NULL'), sa.text('deleted_at IS NOT NULL')
+    for table in TABLES:
+        # A constant default fills the existing rows without a rewrite, then it goes
+        op.add_column(
+            table, sa.Column('updated_at', sa.Float(), nullable=False, server_default='0')
+        )
+        op.alter_column(table, 'updated_at', server_default=None)
+        op.add_column(table, sa.Column('deleted_at', sa.Float(), nullable=True))
+        op.create_index(f'ix_{table}_updated_at_id', table, ['updated_at', 'id'])
+        op.create_index(
+            f'ix_{table}_deleted_at', table, ['deleted_at'],
+            postgresql_where=dead, sqlite_where=dead,
+        )
+        # Titles only need to be unique among the live rows
+        op.create_index(
+            f'uq_{table}_title', table, ['title'], unique=True,
+            postgresql_where=live, sqlite_where=live,
+        )
+        op.drop_constraint(f'{table}_title_key', table, type_='unique')
+
+
+def downgrade():
+    for table in TABLES:
+        op.execute(sa.text(f'DELETE FROM {table} WHERE deleted_at IS NOT NULL'))
+        op.create_unique_constraint(f'{table}_title_key', table, ['title'])
+        op.drop_index(f'uq_{table}_title', table_name=table)
+        op.drop_index(f'ix_{table}_deleted_at', table_name=table)
+        op.drop_index(f'ix_{table}_updated_at_id', table_name=table)
+        op.drop_column(table, 'deleted_at')
+        op.drop_column(table, 'updated_at')
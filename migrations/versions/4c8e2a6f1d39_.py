@@ -0,0 +1,32 @@
+"""index for lattes and projects paged by title, NULL titles as ''
+
+Revision ID: 4c8e2a6f1d39
+Revises: 0e5b7d3a9f12
+Create Date: 2026-10-19 22:30:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '4c8e2a6f1d39'
+down_revision = '0e5b7d3a9f12'
+branch_labels = None
+depends_on = None
+
+TABLES = ['latte', 'project']
+
+
+def upgrade():
+    # `./manage.py migrate-online title-sort-indexes` may have built them already, expression
+    # indexes aren't reflected so IF NOT EXISTS checks for them
+    for table in TABLES:
+        op.execute(
+            f"CREATE INDEX IF NOT EXISTS ix_{table}_owner_title_id "
+            f"ON {table} (owner, coalesce(title, ''), id)"
+        )
+
+
+def downgrade():
+    for table in TABLES:
+        op.drop_index(f'ix_{table}_owner_title_id', table_name=table)
@@ -0,0 +1,46 @@
+"""index review for the api access patterns
+
+Revision ID: 5e8a1c3f7b62
+Revises: 2b7e5f0c9d31
+Create Date: 2026-10-19 13:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e8a1c3f7b62'
+down_revision = '2b7e5f0c9d31'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # `./manage.py migrate-online latte-ingredient-indexes` may have built them already
+    existing = {
+        i['name'] for i in sa.inspect(op.get_bind()).get_indexes('latte_ingredient')
+    }
+    # Eager loads filter by latte and sort by position, the old index needed a sort
+    if 'ix_latte_ingredient_latte_id_position' not in existing:
+        op.create_index(
+            'ix_latte_ingredient_latte_id_position', 'latte_ingredient', ['latte_id', 'position']
+        )
+    op.drop_index('ix_latte_ingredient_latte_id', table_name='latte_ingredient')
+    # Adding parts lets usage counts run from the index alone
+    if 'ix_latte_ingredient_name_latte_id_parts' not in existing:
+        op.create_index(
+            'ix_latte_ingredient_name_latte_id_parts',
+            'latte_ingredient',
+            ['name', 'latte_id', 'parts'],
+        )
+    op.drop_index('ix_latte_ingredient_name_latte_id', table_name='latte_ingredient')
+
+
+def downgrade():
+    op.create_index(
+        'ix_latte_ingredient_name_latte_id', 'latte_ingredient', ['name', 'latte_id']
+    )
+    op.drop_index('ix_latte_ingredient_name_latte_id_parts', table_name='latte_ingredient')
+    op.create_index('ix_latte_ingredient_latte_id', 'latte_ingredient', ['latte_id'])
+    op.drop_index('ix_latte_ingredient_latte_id_position', table_name='latte_ingredient')
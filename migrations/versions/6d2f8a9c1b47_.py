@@ -0,0 +1,28 @@
+"""index for lattes and projects sorted by id
+
+Revision ID: 6d2f8a9c1b47
+Revises: 8b1e4c7d2f90
+Create Date: 2026-10-19 18:20:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '6d2f8a9c1b47'
+down_revision = '8b1e4c7d2f90'
+branch_labels = None
+depends_on = None
+
+TABLES = ['latte', 'project']
+
+
+def upgrade():
+    # Title and updated_at pages read uq_{table}_owner_title and ix_{table}_owner_updated_at_id
+    for table in TABLES:
+        op.create_index(f'ix_{table}_owner_id', table, ['owner', 'id'])
+
+
+def downgrade():
+    for table in TABLES:
+        op.drop_index(f'ix_{table}_owner_id', table_name=table)
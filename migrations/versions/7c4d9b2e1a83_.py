@@ -0,0 +1,30 @@
+"""progress of online migration backfills
+
+Revision ID: 7c4d9b2e1a83
+Revises: 5e8a1c3f7b62
+Create Date: 2026-10-19 14:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c4d9b2e1a83'
+down_revision = '5e8a1c3f7b62'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('online_migration_progress',
+    sa.Column('step', sa.String(length=120), nullable=False),
+    sa.Column('last_id', sa.Integer(), nullable=False),
+    sa.Column('rows', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.Float(), nullable=False),
+    sa.PrimaryKeyConstraint('step')
+    )
+
+
+def downgrade():
+    op.drop_table('online_migration_progress')
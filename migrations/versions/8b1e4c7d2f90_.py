@@ -0,0 +1,52 @@
+"""rows owned by a tenant
+
+Revision ID: 8b1e4c7d2f90
+Revises: 3f6a2d8c5e14
+Create Date: 2026-10-19 15:10:00.000000
+
+"""
+import os
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b1e4c7d2f90'
+down_revision = '3f6a2d8c5e14'
+branch_labels = None
+depends_on = None
+
+TABLES = ['latte', 'project']
+
+
+def upgrade():
+    live = sa.text('deleted_at IS NULL')
+    # Existing rows belong to the tenant public reads default to
+    owner = os.getenv('DEFAULT_TENANT', '')
+    for table in TABLES:
+        op.add_column(
+            table,
+            sa.Column('owner', sa.String(length=128), nullable=False, server_default=owner),
+        )
+        op.alter_column(table, 'owner', server_default=None)
+        op.create_index(
+            f'uq_{table}_owner_title', table, ['owner', 'title'], unique=True,
+            postgresql_where=live, sqlite_where=live,
+        )
+        op.drop_index(f'uq_{table}_title', table_name=table)
+        op.create_index(f'ix_{table}_owner_updated_at_id', table, ['owner', 'updated_at', 'id'])
+        op.drop_index(f'ix_{table}_updated_at_id', table_name=table)
+
+
+def downgrade():
+    live = sa.text('deleted_at IS NULL')
+    for table in TABLES:
+        op.create_index(f'ix_{table}_updated_at_id', table, ['updated_at', 'id'])
+        op.drop_index(f'ix_{table}_owner_updated_at_id', table_name=table)
+        op.create_index(
+            f'uq_{table}_title', table, ['title'], unique=True,
+            postgresql_where=live, sqlite_where=live,
+        )
+        op.drop_index(f'uq_{table}_owner_title', table_name=table)
+        op.drop_column(table, 'owner')
@@ -0,0 +1,93 @@
+"""normalized latte ingredients
+
+Revision ID: 9c1d2e7a4b50
+Revises: f55e85d6e6e1
+Create Date: 2026-10-19 12:40:00.000000
+
+"""
+import json
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9c1d2e7a4b50'
+down_revision = 'f55e85d6e6e1'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 1000
+
+
+def upgrade():
+    ingredient = op.create_table('latte_ingredient',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('latte_id', sa.Integer(), nullable=False),
+    sa.Column('position', sa.Integer(), nullable=False),
+    sa.Column('color', sa.String(length=40), nullable=True),
+    sa.Column('name', sa.String(length=80), nullable=True),
+    sa.Column('parts', sa.Float(), nullable=True),
+    sa.ForeignKeyConstraint(['latte_id'], ['latte.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_latte_ingredient_latte_id', 'latte_ingredient', ['latte_id'])
+    op.create_index(
+        'ix_latte_ingredient_name_latte_id', 'latte_ingredient', ['name', 'latte_id']
+    )
+    backfill(op.get_bind(), ingredient)
+
+
+def backfill(conn, ingredient):
+    """Copy the ingredient blobs into rows, one batch of lattes at a time"""
+    latte = sa.table('latte', sa.column('id', sa.Integer), sa.column('ingredients', sa.String))
+    last_id = 0
+    while True:
+        lattes = conn.execute(
+            sa.select([latte.c.id, latte.c.ingredients])
+            .where(latte.c.id > last_id)
+            .order_by(latte.c.id)
+            .limit(BATCH_SIZE)
+        ).fetchall()
+        if not lattes:
+            return
+        rows = [
+            dict(values, latte_id=latte_id)
+            for latte_id, blob in lattes
+            for values in parse_blob(blob)
+        ]
+        if rows:
+            conn.execute(ingredient.insert(), rows)
+        last_id = lattes[-1][0]
+
+
+def parse_blob(blob):
+    # Same rules as src.database.ingredient.parse_blob, frozen for this revision
+    try:
+        items = json.loads(blob) if blob else []
+    except (TypeError, ValueError):
+        return []
+    if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+        return []
+
+    def text(value, length):
+        return value[:length] if isinstance(value, str) else None
+
+    def number(value):
+        return value if isinstance(value, (int, float)) and not isinstance(value, bool) else None
+
+    return [
+        {
+            'position': position,
+            'color': text(item.get('color'), 40),
+            'name': text(item.get('name'), 80),
+            'parts': number(item.get('parts')),
+        }
+        for position, item in enumerate(items)
+    ]
+
+
+def downgrade():
+    op.drop_index('ix_latte_ingredient_name_latte_id', table_name='latte_ingredient')
+    op.drop_index('ix_latte_ingredient_latte_id', table_name='latte_ingredient')
+    op.drop_table('latte_ingredient')
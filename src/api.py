@@ -1,47 +1,110 @@
+import os
+
 from flask import Flask, jsonify
 from flask_cors import CORS
 
+from src.database.cache import identity_cache, listen_for_changes
 from src.database.persistence import db, migrate
+from src.database.storage import storage
+from src.apis.images import images_bp
 from src.apis.lattes import lattes_bp
 from src.apis.projects import projects_bp
-from src.auth.auth import AuthError
+from src.apis.stats import stats_bp
+from src.auth.auth import AuthError, requires_auth
+from src.helpers.errors import InvalidPayload
+from src.helpers.images import images
+from src.helpers.logs import init_logging
+from src.helpers.static import static_export
+from src.helpers.tasks import tasks
+from src.middleware.admission import Overloaded, admission, admit
+from src.middleware.idempotency import IdempotencyError, idempotency
+from src.middleware.ratelimit import RateLimitExceeded, limiter, rate_limit
+
+
+def start_background_threads(app: Flask) -> None:
+    """Threads do not survive a fork, start them in the worker serving requests"""
+    if app.config["IDENTITY_CACHE_LISTEN"]:
+        app.before_first_request(lambda: listen_for_changes(db.engine, logger=app.logger))
+    if app.config["TASKS_EMBEDDED_WORKER"] and tasks.backend == "database":
+        app.before_first_request(tasks.start_worker)
 
 
-def create_app(config_name: str) -> Flask:
+def create_app(config_name: str, serving: bool = None) -> Flask:
     """Create Flask app corresponding to the config name
     Args:
         config_name: configuration name
+        serving: skip CLI only extensions such as Flask-Migrate, defaults to
+            True unless the app is loaded by the flask command
     Return:
         app: Flask instance
     """
+    if serving is None:
+        serving = os.getenv("FLASK_RUN_FROM_CLI") != "true"
 
     app = Flask(__name__)
     app.register_blueprint(lattes_bp)
     app.register_blueprint(projects_bp)
+    app.register_blueprint(images_bp)
+    app.register_blueprint(stats_bp)
     config_module = f"src.config.{config_name.capitalize()}Config"
     app.config.from_object(config_module)
     CORS(app, resources={r"/api/*": {"origins": "*"}})
+    init_logging(app)
 
     db.init_app(app)
-    migrate.init_app(app, db)
+    if not serving:
+        migrate.init_app(app, db)
+    identity_cache.init_app(app)
+    storage.init_app(app)
+    limiter.init_app(app)
+    idempotency.init_app(app)
+    admission.init_app(app)
+    images.init_app(app)
+    tasks.init_app(app)
+    static_export.init_app(app)
+    start_background_threads(app)
 
     @app.route("/")
     def running():
         """Check if the server is running or not"""
         return jsonify({"status": "running"})
 
+    @app.route("/tasks")
+    @rate_limit(permission="get:tasks")
+    @requires_auth(permission="get:tasks", audience="project")
+    @admit()
+    def task_stats(jwt):
+        """Background task queue depth and outcomes, for operators"""
+        return jsonify(tasks.stats())
+
     @app.errorhandler(400)
     @app.errorhandler(401)
     @app.errorhandler(404)
     @app.errorhandler(405)
     @app.errorhandler(409)
+    @app.errorhandler(410)
     @app.errorhandler(422)
     @app.errorhandler(500)
     @app.errorhandler(502)
     @app.errorhandler(AuthError)
+    @app.errorhandler(IdempotencyError)
     def _handle_api_error(err):
         "Necessary when using blueprints"
-        app.logger.error(str(err))
-        return jsonify({"error": err.code, "message": err.description, "success": False}), err.code
+        # Handlers already logged the cause, only auth failures are new here
+        if isinstance(err, AuthError):
+            app.logger.info("Auth failure %s: %s", err.code, err.description)
+        else:
+            app.logger.debug(str(err))
+        body = {"error": err.code, "message": err.description, "success": False}
+        if isinstance(err, InvalidPayload):
+            body["errors"] = err.errors
+        return jsonify(body), err.code
+
+    @app.errorhandler(Overloaded)
+    @app.errorhandler(RateLimitExceeded)
+    def _handle_retry_later(err):
+        response = jsonify({"error": err.code, "message": err.description, "success": False})
+        response.headers["Retry-After"] = str(err.retry_after)
+        return response, err.code
 
     return app
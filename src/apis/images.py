@@ -0,0 +1,21 @@
+"""This is where the image variants are served from the disk cache"""
+from flask import Blueprint, abort, send_file
+
+from src.helpers.images import images
+from src.middleware.ratelimit import rate_limit
+
+images_bp = Blueprint("images_bp", __name__)
+# Paths are content addressed, a file never changes once written
+MAX_AGE = 365 * 24 * 3600
+
+
+@images_bp.route("/api/image/<string:digest>/<string:name>")
+@rate_limit()
+def get_image(digest, name):
+    """Return a thumbnail built by the image pipeline"""
+    path = images.path(digest, name)
+    if path is None:
+        abort(404)
+    response = send_file(path, conditional=True, cache_timeout=MAX_AGE)
+    response.headers["Cache-Control"] = f"public, max-age={MAX_AGE}, immutable"
+    return response
@@ -5,22 +5,51 @@ from flask import Blueprint, jsonify, abort, request, current_app as context
 from sqlalchemy.exc import DataError, IntegrityError, OperationalError
 from sqlalchemy.orm.exc import NoResultFound
 
-from src.database.latte import Latte
+from src.database.fields import parse_fields
+from src.database.pagination import parse_ids, parse_page
+from src.database.storage import storage
+from src.database.tombstone import parse_cursor
 from src.auth.auth import requires_auth
-from src.helpers.tools import validate_none_word_input
-from src.helpers.errors import InvalidUserInput
+from src.middleware.admission import admit
+from src.middleware.idempotency import idempotent
+from src.middleware.ratelimit import rate_limit
+from src.helpers.recipe import parse_volume, recipe
+from src.helpers.validation import Field, Schema, validate
 
 
 lattes_bp = Blueprint("lattes_bp", __name__)
 AUDIENCE = "latte"
 
+INGREDIENT = Schema(
+    color=Field(str, min_length=1, max_length=40),
+    name=Field(str, min_length=1, max_length=80),
+    parts=Field(float, minimum=0),
+)
+LATTE = Schema(
+    title=Field(str, min_length=1, max_length=80, pattern=r"[\w ]+"),
+    ingredients=Field(list, min_length=1, items=INGREDIENT, max_json_length=300),
+)
+
 
 @lattes_bp.route("/api/latte")
+@rate_limit()
+@admit()
 def get_lattes():
-    """Return lattes from database"""
+    """Return lattes from database, sorted and paged by the sort, limit and cursor args
+    or the ones listed by the ids arg, in that order, with the ids that don't exist
+    """
+    ids = parse_ids(request.args)
+    page = parse_page(request.args)
+    fields = parse_fields(request.args, storage.lattes.model)
     try:
-        lattes = [_.long() for _ in Latte.query.all()]
-        return jsonify({"lattes": lattes})
+        if ids is not None:
+            lattes, missing = storage.lattes.get_many(ids)
+            return jsonify({"lattes": [_.long(fields) for _ in lattes], "missing": missing})
+        lattes, cursor = storage.lattes.list(page, fields)
+        body = {"lattes": [_.long(fields) for _ in lattes]}
+        if page.limit:
+            body["next"] = cursor
+        return jsonify(body)
     except OperationalError as err:
         context.logger.error(err)
         abort(502)
@@ -30,13 +59,73 @@ def get_lattes():
 
 
 @lattes_bp.route("/api/latte/<int:latte_id>")
+@rate_limit()
+@admit()
 def get_latte(latte_id):
-    """Return a latte from database"""
+    """Return a latte from database, only its fields listed by the fields arg if any"""
+    fields = parse_fields(request.args, storage.lattes.model)
     try:
-        latte = Latte.query.filter(Latte.id == latte_id).one()
-        return jsonify({"lattes": latte.long()})
+        latte = storage.lattes.get(latte_id)
+        return jsonify({"lattes": latte.long(fields)})
     except NoResultFound as err:
+        context.logger.debug(err)
+        abort(404)
+    except OperationalError as err:
         context.logger.error(err)
+        abort(502)
+    except Exception as err:
+        context.logger.error(err)
+        abort(500)
+
+
+@lattes_bp.route("/api/latte/changes")
+@rate_limit()
+@admit()
+def get_latte_changes():
+    """Return the lattes written and the ids deleted after a cursor, for delta sync"""
+    since = request.args.get("since")
+    cursor = parse_cursor(since, storage.lattes.table)
+    try:
+        lattes, deleted, last = storage.lattes.changes(cursor)
+        return jsonify(
+            {"lattes": [_.long() for _ in lattes], "deleted": deleted, "cursor": last or since}
+        )
+    except OperationalError as err:
+        context.logger.error(err)
+        abort(502)
+    except Exception as err:
+        context.logger.error(err)
+        abort(500)
+
+
+@lattes_bp.route("/api/latte/recipe")
+@rate_limit()
+@admit()
+def get_recipes():
+    """Return the cup layout of every latte"""
+    volume = parse_volume(request.args.get("volume"))
+    try:
+        lattes, _ = storage.lattes.list()
+        return jsonify({"recipes": [recipe(_, volume) for _ in lattes]})
+    except OperationalError as err:
+        context.logger.error(err)
+        abort(502)
+    except Exception as err:
+        context.logger.error(err)
+        abort(500)
+
+
+@lattes_bp.route("/api/latte/<int:latte_id>/recipe")
+@rate_limit()
+@admit()
+def get_recipe(latte_id):
+    """Return the cup layout of a latte, volume splits a cup of that size"""
+    volume = parse_volume(request.args.get("volume"))
+    try:
+        latte = storage.lattes.get(latte_id)
+        return jsonify({"recipe": recipe(latte, volume)})
+    except NoResultFound as err:
+        context.logger.debug(err)
         abort(404)
     except OperationalError as err:
         context.logger.error(err)
@@ -46,19 +135,50 @@ def get_latte(latte_id):
         abort(500)
 
 
+@lattes_bp.route("/api/ingredient")
+@rate_limit()
+@admit()
+def get_ingredient_usage():
+    """Return how many lattes use each ingredient and their total parts"""
+    try:
+        return jsonify({"ingredients": storage.lattes.usage()})
+    except OperationalError as err:
+        context.logger.error(err)
+        abort(502)
+    except Exception as err:
+        context.logger.error(err)
+        abort(500)
+
+
+@lattes_bp.route("/api/ingredient/<string:name>/latte")
+@rate_limit()
+@admit()
+def get_lattes_by_ingredient(name):
+    """Return the lattes that use an ingredient"""
+    try:
+        lattes = storage.lattes.by_ingredient(name)
+        return jsonify({"lattes": [_.long() for _ in lattes]})
+    except OperationalError as err:
+        context.logger.error(err)
+        abort(502)
+    except Exception as err:
+        context.logger.error(err)
+        abort(500)
+
+
 @lattes_bp.route("/api/latte", methods=["POST"])
+@rate_limit(permission="post:latte")
 @requires_auth(permission="post:latte", audience=AUDIENCE)
-def create_lattes(jwt):
+@admit()
+@idempotent()
+@validate(LATTE)
+def create_lattes(jwt, body):
     """Create new latte"""
     try:
-        ingredients = json.dumps(request.json["ingredients"])
-        rawTitle = request.json["title"]
-        validTitle = validate_none_word_input(rawTitle)
-        latte = Latte(title=validTitle, ingredients=ingredients,)
-        latte.insert()
+        latte = storage.lattes.add(title=body["title"], ingredients=json.dumps(body["ingredients"]))
 
         return jsonify({"success": True, "lattes": [latte.long()]}), 201
-    except (KeyError, InvalidUserInput, DataError) as err:
+    except DataError as err:
         context.logger.error(err)
         abort(400)
     except IntegrityError as err:
@@ -73,28 +193,24 @@ def create_lattes(jwt):
 
 
 @lattes_bp.route("/api/latte/<int:latte_id>", methods=["PATCH"])
+@rate_limit(permission="patch:latte")
 @requires_auth(permission="patch:latte", audience=AUDIENCE)
-def update_drink(jwt, latte_id):
+@admit()
+@validate(LATTE, partial=True)
+def update_drink(jwt, latte_id, body):
     """Update latte information"""
     try:
-        if "title" not in request.json and "ingredients" not in request.json:
-            raise KeyError
-
-        latte = Latte.query.filter(Latte.id == latte_id).one()
-        if "title" in request.json:
-            validTitle = validate_none_word_input(request.json["title"])
-            latte.title = validTitle
-        if "ingredients" in request.json:
-            validIng = json.dumps(request.json["ingredients"])
-            latte.ingredients = validIng
-        latte.update()
+        changes = dict(body)
+        if "ingredients" in body:
+            changes["ingredients"] = json.dumps(body["ingredients"])
+        latte = storage.lattes.update(latte_id, **changes)
 
         return jsonify({"success": True, "lattes": [latte.long()]})
-    except (KeyError, InvalidUserInput, DataError) as err:
+    except DataError as err:
         context.logger.error(err)
         abort(400)
     except NoResultFound as err:
-        context.logger.error(err)
+        context.logger.debug(err)
         abort(404)
     except OperationalError as err:
         context.logger.error(err)
@@ -105,16 +221,17 @@ def update_drink(jwt, latte_id):
 
 
 @lattes_bp.route("/api/latte/<int:latte_id>", methods=["DELETE"])
+@rate_limit(permission="delete:latte")
 @requires_auth(permission="delete:latte", audience=AUDIENCE)
+@admit()
 def remove_drink(jwt, latte_id):
     """Remove latte based on its id"""
     try:
-        latte = Latte.query.filter(Latte.id == latte_id).one()
-        latte.delete()
+        storage.lattes.delete(latte_id)
 
         return jsonify({"success": True, "delete": latte_id})
     except NoResultFound as err:
-        context.logger.error(err)
+        context.logger.debug(err)
         abort(404)
     except OperationalError as err:
         context.logger.error(err)
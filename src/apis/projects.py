@@ -2,23 +2,79 @@
 import json
 
 from flask import Blueprint, jsonify, abort, request, current_app as context
-from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.exc import DataError, IntegrityError, OperationalError
 from sqlalchemy.orm.exc import NoResultFound
 
 from src.auth.auth import requires_auth
-from src.database.project import Project
+from src.database.fields import parse_fields
+from src.database.pagination import parse_ids, parse_page
+from src.database.storage import storage
+from src.database.tombstone import parse_cursor
+from src.helpers.validation import Field, Schema, validate
+from src.middleware.admission import admit
+from src.middleware.idempotency import idempotent
+from src.middleware.ratelimit import rate_limit
 
 projects_bp = Blueprint("projects_bp", __name__)
 AUDIENCE = "project"
 
+PROJECT = Schema(
+    title=Field(str, min_length=1, max_length=80),
+    meta=Field(list, items=Field(str), max_json_length=300),
+    description=Field(str, nullable=True, max_length=300),
+    image=Field(str, nullable=True, max_length=300),
+    git_repo=Field(str, nullable=True, max_length=300),
+    demo_link=Field(str, nullable=True, max_length=300),
+)
+
 
 @projects_bp.route("/api/project")
+@rate_limit()
+@admit()
 def get_projects():
-    """Return projects from database"""
+    """Return projects from database, sorted and paged by the sort, limit and cursor args
+    or the ones listed by the ids arg, in that order
+    the body stays a list, the cursor of the next page is in the X-Next-Cursor header
+    and the listed ids that don't exist in X-Missing-Ids
+    """
+    ids = parse_ids(request.args)
+    page = parse_page(request.args)
+    fields = parse_fields(request.args, storage.projects.model)
+    try:
+        if ids is not None:
+            projects, missing = storage.projects.get_many(ids)
+            response = jsonify([_.sparse_json(fields) for _ in projects])
+            response.headers["X-Missing-Ids"] = ",".join(str(_) for _ in missing)
+            return response
+        projects, cursor = storage.projects.list(page, fields)
+        response = jsonify([_.sparse_json(fields) for _ in projects])
+        if cursor:
+            response.headers["X-Next-Cursor"] = cursor
+        return response
+    except OperationalError as err:
+        context.logger.error(err)
+        abort(502)
+    except Exception as err:
+        context.logger.error(err)
+        abort(500)
+
+
+@projects_bp.route("/api/project/changes")
+@rate_limit()
+@admit()
+def get_project_changes():
+    """Return the projects written and the ids deleted after a cursor, for delta sync"""
+    since = request.args.get("since")
+    cursor = parse_cursor(since, storage.projects.table)
     try:
-        projects = Project.query.all()
-        projects = [_.to_json for _ in projects]
-        return jsonify(projects)
+        projects, deleted, last = storage.projects.changes(cursor)
+        return jsonify(
+            {
+                "projects": [_.to_json for _ in projects],
+                "deleted": deleted,
+                "cursor": last or since,
+            }
+        )
     except OperationalError as err:
         context.logger.error(err)
         abort(502)
@@ -28,13 +84,16 @@ def get_projects():
 
 
 @projects_bp.route("/api/project/<int:project_id>")
+@rate_limit()
+@admit()
 def get_project(project_id):
-    """Return a project from database"""
+    """Return a project from database, only its fields listed by the fields arg if any"""
+    fields = parse_fields(request.args, storage.projects.model)
     try:
-        project = Project.query.filter(Project.id == project_id).one()
-        return jsonify(project.to_json)
+        project = storage.projects.get(project_id)
+        return jsonify(project.sparse_json(fields))
     except NoResultFound as err:
-        context.logger.error(err)
+        context.logger.debug(err)
         abort(404)
     except OperationalError as err:
         context.logger.error(err)
@@ -45,22 +104,17 @@ def get_project(project_id):
 
 
 @projects_bp.route("/api/project", methods=["POST"])
+@rate_limit(permission="post:project")
 @requires_auth(permission="post:project", audience=AUDIENCE)
-def create_project(jwt):
+@admit()
+@idempotent()
+@validate(PROJECT)
+def create_project(jwt, body):
     """Create a project on database"""
     try:
-        payload = {
-            "title": request.json["title"],
-            "meta": json.dumps(request.json["meta"]),
-            "description": request.json["description"],
-            "image": request.json["image"],
-            "git_repo": request.json["git_repo"],
-            "demo_link": request.json["demo_link"],
-        }
-        project = Project(**payload)
-        project.insert()
+        project = storage.projects.add(**dict(body, meta=json.dumps(body["meta"])))
         return jsonify(project.to_json), 201
-    except (KeyError, TypeError) as err:
+    except DataError as err:
         context.logger.error(err)
         abort(400)
     except IntegrityError as err:
@@ -75,27 +129,20 @@ def create_project(jwt):
 
 
 @projects_bp.route("/api/project/<int:project_id>", methods=["PATCH"])
+@rate_limit(permission="patch:project")
 @requires_auth(permission="patch:project", audience=AUDIENCE)
-def update_project(jwt, project_id):
+@admit()
+@validate(PROJECT)
+def update_project(jwt, project_id, body):
     """Update a project on database"""
     try:
-        project = Project.query.filter(Project.id == project_id).one()
-        updated_project = {
-            "title": request.json["title"],
-            "meta": json.dumps(request.json["meta"]),
-            "description": request.json["description"],
-            "image": request.json["image"],
-            "git_repo": request.json["git_repo"],
-            "demo_link": request.json["demo_link"],
-        }
-        print(updated_project)
-        project.update(**updated_project)
+        project = storage.projects.update(project_id, **dict(body, meta=json.dumps(body["meta"])))
         return jsonify(project.to_json)
-    except (KeyError, TypeError) as err:
+    except DataError as err:
         context.logger.error(err)
         abort(400)
     except NoResultFound as err:
-        context.logger.error(err)
+        context.logger.debug(err)
         abort(404)
     except OperationalError as err:
         context.logger.error(err)
@@ -106,15 +153,16 @@ def update_project(jwt, project_id):
 
 
 @projects_bp.route("/api/project/<int:project_id>", methods=["DELETE"])
+@rate_limit(permission="delete:project")
 @requires_auth(permission="delete:project", audience=AUDIENCE)
+@admit()
 def delete_project(jwt, project_id):
     """Delete a project from database"""
     try:
-        project = Project.query.filter(Project.id == project_id).one()
-        project.delete()
+        storage.projects.delete(project_id)
         return jsonify({"success": True, "project_id": project_id})
     except NoResultFound as err:
-        context.logger.error(err)
+        context.logger.debug(err)
         abort(404)
     except OperationalError as err:
         context.logger.error(err)
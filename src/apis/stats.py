@@ -0,0 +1,25 @@
+"""This is where the aggregate stats endpoint is located"""
+from flask import Blueprint, jsonify, abort, current_app as context
+from sqlalchemy.exc import OperationalError
+
+from src.database.stats import Stat
+from src.middleware.admission import admit
+from src.middleware.ratelimit import rate_limit
+from src.helpers.tenant import current_tenant
+
+stats_bp = Blueprint("stats_bp", __name__)
+
+
+@stats_bp.route("/api/stats")
+@rate_limit()
+@admit()
+def get_stats():
+    """Return the latte and project counts, lattes per ingredient and projects per tag"""
+    try:
+        return jsonify(Stat.summary(current_tenant()))
+    except OperationalError as err:
+        context.logger.error(err)
+        abort(502)
+    except Exception as err:
+        context.logger.error(err)
+        abort(500)
@@ -1,12 +1,19 @@
 import json
-from flask import request
+import time
+from flask import current_app, has_app_context, has_request_context, request
 from functools import wraps
-from jose import jwt
 from urllib.request import urlopen
 
+from src.helpers.tenant import TENANT
+from src.middleware.ratelimit import limiter
 
 AUTH0_DOMAIN = "mothership-v2.us.auth0.com"
 ALGORITHMS = ["RS256"]
+# Seconds the Auth0 signing keys are reused before fetching them again
+JWKS_TTL = 600
+# Minimum seconds between the fetches forced by tokens signed with an unknown key
+JWKS_MIN_REFETCH = 30
+_jwks_cache = {"url": None, "jwks": None, "expires": 0.0, "refetched": None}
 
 
 class AuthError(Exception):
@@ -53,11 +60,65 @@ def check_permissions(permission, payload):
     return True
 
 
+def auth0_settings():
+    """Return the JWKS url and issuer, from the app config when there is one"""
+    config = current_app.config if has_app_context() else {}
+    domain = config.get("AUTH0_DOMAIN") or AUTH0_DOMAIN
+    jwks_url = config.get("AUTH0_JWKS_URL") or f"https://{domain}/.well-known/jwks.json"
+    issuer = config.get("AUTH0_ISSUER") or f"https://{domain}/"
+    return jwks_url, issuer
+
+
+def get_jwks(url, refresh=False):
+    """Return the public keys at url, fetched at most once per JWKS_TTL
+    Args:
+        url: JWKS url
+        refresh: fetch them again before the TTL, e.g. after Auth0 rotated its
+            signing key, unless the last fetch is less than JWKS_MIN_REFETCH old
+    """
+    now = time.monotonic()
+    refetched = _jwks_cache["refetched"]
+    refresh = refresh and (refetched is None or refetched + JWKS_MIN_REFETCH <= now)
+    if refresh or _jwks_cache["url"] != url or _jwks_cache["expires"] <= now:
+        jsonurl = urlopen(url)
+        _jwks_cache["jwks"] = json.loads(jsonurl.read())
+        _jwks_cache["url"] = url
+        _jwks_cache["expires"] = now + JWKS_TTL
+        if refresh:
+            _jwks_cache["refetched"] = now
+    return _jwks_cache["jwks"]
+
+
+def reset_jwks_cache():
+    """Forget the cached keys, e.g. after forking a worker"""
+    _jwks_cache["url"] = None
+    _jwks_cache["jwks"] = None
+    _jwks_cache["expires"] = 0.0
+    _jwks_cache["refetched"] = None
+
+
+def find_key(jwks, kid):
+    """RSA key of the JWKS with the given key id, {} when there is none"""
+    for key in jwks["keys"]:
+        if key["kid"] == kid:
+            return {
+                "kty": key["kty"],
+                "kid": key["kid"],
+                "use": key["use"],
+                "n": key["n"],
+                "e": key["e"],
+            }
+    return {}
+
+
 def verify_decode_jwt(token, audience):  # noqa: C901
     """Checks if the jwt has been tampered with"""
+    # python-jose pulls in the crypto backends, only pay for it on first use
+    from jose import jwt
+
     # Get auth0 public key
-    jsonurl = urlopen(f"https://{AUTH0_DOMAIN}/.well-known/jwks.json")
-    jwks = json.loads(jsonurl.read())
+    jwks_url, issuer = auth0_settings()
+    jwks = get_jwks(jwks_url)
 
     # Get data from header
     try:
@@ -68,19 +129,13 @@ def verify_decode_jwt(token, audience):  # noqa: C901
         )
 
     # Choose our key
-    rsa_key = {}
     if "kid" not in unverified_header:
         raise AuthError("Authorization malformed.", 401)
 
-    for key in jwks["keys"]:
-        if key["kid"] == unverified_header["kid"]:
-            rsa_key = {
-                "kty": key["kty"],
-                "kid": key["kid"],
-                "use": key["use"],
-                "n": key["n"],
-                "e": key["e"],
-            }
+    rsa_key = find_key(jwks, unverified_header["kid"])
+    if not rsa_key:
+        # Signed with a key newer than our copy, fetch them again (rate limited)
+        rsa_key = find_key(get_jwks(jwks_url, refresh=True), unverified_header["kid"])
 
     # Verify
     if rsa_key:
@@ -91,7 +146,7 @@ def verify_decode_jwt(token, audience):  # noqa: C901
                 rsa_key,
                 algorithms=ALGORITHMS,
                 audience=audience,
-                issuer="https://" + AUTH0_DOMAIN + "/",
+                issuer=issuer,
             )
 
             return payload
@@ -127,6 +182,12 @@ def requires_auth(permission="", audience=""):
                 )
 
             check_permissions(permission, payload)
+            if not payload.get("sub"):
+                raise AuthError("Token has no subject.", 401)
+            if has_request_context():
+                # Writes are scoped to the rows the subject owns
+                request.environ[TENANT] = payload["sub"]
+            limiter.check_subject(payload["sub"])
 
             return f(payload, *args, **kwargs)
 
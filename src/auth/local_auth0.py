@@ -0,0 +1,187 @@
+"""Offline stand-in for Auth0: RSA keys, a JWKS endpoint and a token minter
+
+Point the app at it with AUTH0_JWKS_URL (a file:// or http:// url) and
+AUTH0_ISSUER, then tokens minted here go through the real RS256 checks.
+
+Usage:
+    python -m src.auth.local_auth0 keygen --dir .auth0
+    python -m src.auth.local_auth0 serve --dir .auth0 --port 8900
+    python -m src.auth.local_auth0 mint --dir .auth0 --audience latte --permission post:latte
+"""
+import argparse
+import base64
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from src.auth.auth import AUTH0_DOMAIN
+
+PERMISSIONS = {
+    "latte": ["get:latte", "post:latte", "patch:latte", "delete:latte"],
+    "project": ["get:project", "post:project", "patch:project", "delete:project", "get:tasks"],
+}
+
+
+def b64url_uint(value):
+    """Encode an integer the way JWK 'n' and 'e' members expect"""
+    raw = value.to_bytes((value.bit_length() + 7) // 8, "big")
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+class LocalAuth0(object):
+    """
+    LocalAuth0
+    signs tokens with a local RSA key and publishes the matching JWKS
+    """
+
+    def __init__(self, private_pem, kid="local-auth0", issuer=None):
+        from Crypto.PublicKey import RSA
+
+        self.private_pem = private_pem
+        self.kid = kid
+        self.issuer = issuer or f"https://{AUTH0_DOMAIN}/"
+        self._public = RSA.import_key(private_pem).publickey()
+
+    @classmethod
+    def generate(cls, bits=2048, **kwargs):
+        """Create a stand-in with a fresh RSA keypair"""
+        from Crypto.PublicKey import RSA
+
+        return cls(RSA.generate(bits).export_key().decode(), **kwargs)
+
+    @classmethod
+    def load(cls, directory, **kwargs):
+        """Load the keypair saved by save()"""
+        with open(os.path.join(directory, "private.pem")) as f:
+            return cls(f.read(), **kwargs)
+
+    def save(self, directory):
+        """Write private.pem and jwks.json, returns the jwks path"""
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, "private.pem"), "w") as f:
+            f.write(self.private_pem)
+        return self.write_jwks(os.path.join(directory, "jwks.json"))
+
+    def write_jwks(self, path):
+        with open(path, "w") as f:
+            json.dump(self.jwks, f)
+        return path
+
+    @property
+    def jwks(self):
+        return {
+            "keys": [
+                {
+                    "kty": "RSA",
+                    "kid": self.kid,
+                    "use": "sig",
+                    "alg": "RS256",
+                    "n": b64url_uint(self._public.n),
+                    "e": b64url_uint(self._public.e),
+                }
+            ]
+        }
+
+    def mint(
+        self, audience, permissions=None, subject="local-auth0@clients", expires_in=3600, **claims
+    ):
+        """Sign an access token
+        Args:
+            audience: api audience, e.g. 'latte'
+            permissions: granted permissions, all of the audience's by default
+            subject: 'sub' claim
+            expires_in: seconds until 'exp', negative for an expired token
+            claims: extra claims, overriding the defaults
+        Returns:
+            encoded jwt
+        """
+        from jose import jwt
+
+        now = int(time.time())
+        payload = {
+            "iss": self.issuer,
+            "sub": subject,
+            "aud": audience,
+            "iat": now,
+            "exp": now + expires_in,
+            "permissions": PERMISSIONS.get(audience, [])
+            if permissions is None
+            else list(permissions),
+        }
+        payload.update(claims)
+        return jwt.encode(payload, self.private_pem, algorithm="RS256", headers={"kid": self.kid})
+
+    def serve(self, host="127.0.0.1", port=0):
+        """Serve /.well-known/jwks.json and /oauth/token from a daemon thread
+        Returns:
+            the running server, its url is http://host:server.server_port
+        """
+        server = ThreadingHTTPServer((host, port), self.handler())
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+    def handler(self):
+        auth0 = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/.well-known/jwks.json":
+                    return self.reply(404, {"error": "not_found"})
+                self.reply(200, auth0.jwks)
+
+            def do_POST(self):
+                if self.path != "/oauth/token":
+                    return self.reply(404, {"error": "not_found"})
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                token = auth0.mint(body.get("audience", ""), body.get("permissions"))
+                self.reply(200, {"access_token": token, "token_type": "Bearer"})
+
+            def reply(self, status, data):
+                raw = json.dumps(data).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(raw)))
+                self.end_headers()
+                self.wfile.write(raw)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("command", choices=["keygen", "serve", "mint"])
+    parser.add_argument("--dir", default=".auth0", help="where the keypair is kept")
+    parser.add_argument("--issuer", help="'iss' claim, defaults to the production issuer")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--audience", default="latte")
+    parser.add_argument("--permission", action="append", dest="permissions")
+    parser.add_argument("--expires-in", type=int, default=3600)
+    args = parser.parse_args()
+
+    if args.command == "keygen":
+        path = LocalAuth0.generate(issuer=args.issuer).save(args.dir)
+        print(f"AUTH0_JWKS_URL=file://{os.path.abspath(path)}")
+        return
+
+    auth0 = LocalAuth0.load(args.dir, issuer=args.issuer)
+    if args.command == "mint":
+        print(auth0.mint(args.audience, args.permissions, expires_in=args.expires_in))
+        return
+
+    server = auth0.serve(port=args.port)
+    print(f"AUTH0_JWKS_URL=http://127.0.0.1:{server.server_port}/.well-known/jwks.json")
+    print(f"AUTH0_ISSUER={auth0.issuer}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
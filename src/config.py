@@ -8,11 +8,117 @@ class Config(object):
 
     SQLALCHEMY_DATABASE_URI = os.environ["DATABASE_URL"]
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+    # One JSON object per line instead of plain text
+    LOG_JSON = os.getenv("LOG_JSON", "false").lower() == "true"
+    # Write logs from a background thread, dropping records past LOG_QUEUE_SIZE
+    LOG_ASYNC = os.getenv("LOG_ASYNC", "true").lower() == "true"
+    LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+    # At most LOG_SAMPLE_LIMIT records of one message type per LOG_SAMPLE_INTERVAL seconds
+    LOG_SAMPLE_LIMIT = int(os.getenv("LOG_SAMPLE_LIMIT", "10"))
+    LOG_SAMPLE_INTERVAL = float(os.getenv("LOG_SAMPLE_INTERVAL", "60"))
+    # Token issuer, point these at src/auth/local_auth0.py to run offline
+    AUTH0_DOMAIN = os.getenv("AUTH0_DOMAIN", "mothership-v2.us.auth0.com")
+    AUTH0_ISSUER = os.getenv("AUTH0_ISSUER", f"https://{AUTH0_DOMAIN}/")
+    AUTH0_JWKS_URL = os.getenv("AUTH0_JWKS_URL", f"https://{AUTH0_DOMAIN}/.well-known/jwks.json")
+    # Listen for change notifications from other workers (Postgres only)
+    IDENTITY_CACHE_LISTEN = os.getenv("IDENTITY_CACHE_LISTEN", "false").lower() == "true"
+    # Max number of row snapshots kept per worker, 0 disables the cache
+    IDENTITY_CACHE_SIZE = int(os.getenv("IDENTITY_CACHE_SIZE", "1024"))
+    # Max snapshots per tenant, keeps one large tenant from evicting the others
+    IDENTITY_CACHE_TENANT_SIZE = int(os.getenv("IDENTITY_CACHE_TENANT_SIZE", "256"))
+    # Seconds a snapshot is served, bounds staleness should a notification be lost, or
+    # how long other workers' writes go unseen when nothing listens
+    IDENTITY_CACHE_TTL = float(
+        os.getenv("IDENTITY_CACHE_TTL", "60" if IDENTITY_CACHE_LISTEN else "5")
+    )
+    # Seconds a nonexistent id is answered from memory, 0 disables it
+    NEGATIVE_CACHE_TTL = float(os.getenv("NEGATIVE_CACHE_TTL", "5"))
+    # Max number of nonexistent ids remembered per worker, whatever IDENTITY_CACHE_SIZE
+    NEGATIVE_CACHE_SIZE = int(os.getenv("NEGATIVE_CACHE_SIZE", "1024"))
+    # Per worker concurrency limit, adapted to the observed request latency
+    ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+    ADMISSION_INITIAL_LIMIT = int(os.getenv("ADMISSION_INITIAL_LIMIT", "20"))
+    ADMISSION_MIN_LIMIT = int(os.getenv("ADMISSION_MIN_LIMIT", "2"))
+    ADMISSION_MAX_LIMIT = int(os.getenv("ADMISSION_MAX_LIMIT", "100"))
+    ADMISSION_LATENCY_TARGET = float(os.getenv("ADMISSION_LATENCY_TARGET", "0.25"))
+    # Share of the limit writes may use, the rest is kept for reads
+    ADMISSION_WRITE_SHARE = float(os.getenv("ADMISSION_WRITE_SHARE", "0.5"))
+    ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", "1"))
+    # Seconds a POST response is replayed for the same Idempotency-Key, 0 disables it
+    IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", "86400"))
+    IDEMPOTENCY_STORAGE_URL = os.getenv("IDEMPOTENCY_STORAGE_URL", "memory://")
+    IDEMPOTENCY_MAX_KEYS = int(os.getenv("IDEMPOTENCY_MAX_KEYS", "10000"))
+    # Thumbnails and blurhash of Project.image, unset keeps the pipeline off
+    IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR")
+    IMAGE_WIDTHS = [int(w) for w in os.getenv("IMAGE_WIDTHS", "160,480,960").split(",")]
+    IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "webp")
+    IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+    IMAGE_MAX_BYTES = int(os.getenv("IMAGE_MAX_BYTES", str(10 * 1024 * 1024)))
+    IMAGE_FETCH_TIMEOUT = float(os.getenv("IMAGE_FETCH_TIMEOUT", "10"))
+    # Seconds before an image that failed to fetch or render is tried again
+    IMAGE_RETRY_AFTER = float(os.getenv("IMAGE_RETRY_AFTER", "300"))
+    # Manifests kept in memory per worker, the least recently read are reloaded from disk
+    IMAGE_MANIFEST_CACHE_SIZE = int(os.getenv("IMAGE_MANIFEST_CACHE_SIZE", "1024"))
+    # Url schemes that are fetched, add file to use local images as a stand-in for the CDN
+    IMAGE_SCHEMES = os.getenv("IMAGE_SCHEMES", "http,https").split(",")
+    # Prefix of the thumbnail urls, e.g. a CDN in front of /api/image
+    IMAGE_BASE_URL = os.getenv("IMAGE_BASE_URL", "/api/image")
+    # Directory the public GET endpoints are rendered to after every write, unset keeps it off
+    STATIC_EXPORT_DIR = os.getenv("STATIC_EXPORT_DIR")
+    # sql reads the database, memory serves reads from an in-process copy synced from it
+    STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "sql")
+    # Seconds the memory copy may lag the writes of other processes
+    STORAGE_REFRESH = float(os.getenv("STORAGE_REFRESH", "1"))
+    # thread runs tasks in this process, database queues them in the task table
+    TASKS_BACKEND = os.getenv("TASKS_BACKEND", "thread")
+    TASKS_WORKERS = int(os.getenv("TASKS_WORKERS", "4"))
+    # Tasks waiting in the thread backend past this are dropped
+    TASKS_MAX_QUEUE = int(os.getenv("TASKS_MAX_QUEUE", "10000"))
+    TASKS_MAX_ATTEMPTS = int(os.getenv("TASKS_MAX_ATTEMPTS", "5"))
+    # Seconds before the first retry, doubled after every failure up to TASKS_MAX_BACKOFF
+    TASKS_RETRY_BACKOFF = float(os.getenv("TASKS_RETRY_BACKOFF", "1"))
+    TASKS_MAX_BACKOFF = float(os.getenv("TASKS_MAX_BACKOFF", "300"))
+    # Seconds a claimed database task is hidden from other workers
+    TASKS_LEASE = float(os.getenv("TASKS_LEASE", "300"))
+    TASKS_POLL_INTERVAL = float(os.getenv("TASKS_POLL_INTERVAL", "1"))
+    # Also run database tasks from the web processes instead of ./manage.py worker
+    TASKS_EMBEDDED_WORKER = os.getenv("TASKS_EMBEDDED_WORKER", "false").lower() == "true"
+    # Rows belong to the token subject that wrote them, off keeps one tenant for everyone
+    TENANCY_ENABLED = os.getenv("TENANCY_ENABLED", "false").lower() == "true"
+    # Owner of the rows written before tenancy and tenant of public reads without ?owner=,
+    # the one tenant of every request with tenancy off
+    DEFAULT_TENANT = os.getenv("DEFAULT_TENANT", "")
+    # Seconds deleted rows are kept as tombstones for delta sync before the purge
+    TOMBSTONE_RETENTION = float(os.getenv("TOMBSTONE_RETENTION", str(30 * 24 * 3600)))
+    PURGE_BATCH_SIZE = int(os.getenv("PURGE_BATCH_SIZE", "500"))
+    # Seconds between purge batches, keeps the purge from competing with traffic
+    PURGE_PAUSE = float(os.getenv("PURGE_PAUSE", "0.5"))
+    RATELIMIT_ENABLED = os.getenv("RATELIMIT_ENABLED", "true").lower() == "true"
+    # memory:// keeps buckets per worker, redis://host:port/db shares them (pip install redis)
+    RATELIMIT_STORAGE_URL = os.getenv("RATELIMIT_STORAGE_URL", "memory://")
+    # Number of proxies in front of the app whose X-Forwarded-For is trusted, heroku's
+    # router counts as one. Without proxies a client could pick its own ip bucket
+    RATELIMIT_TRUSTED_PROXIES = int(os.getenv("RATELIMIT_TRUSTED_PROXIES", "0"))
+    RATELIMIT_DEFAULT = os.getenv("RATELIMIT_DEFAULT", "120/minute")
+    # Per permission or endpoint overrides of the default limit
+    RATELIMIT_RULES = {
+        "post:latte": "10/minute",
+        "patch:latte": "30/minute",
+        "delete:latte": "30/minute",
+        "post:project": "10/minute",
+        "patch:project": "30/minute",
+        "delete:project": "30/minute",
+    }
 
 
 class ProductionConfig(Config):
     """Production configuration"""
 
+    LOG_JSON = os.getenv("LOG_JSON", "true").lower() == "true"
+    # Heroku's router is the proxy in front of the dynos, every request comes from its ip
+    RATELIMIT_TRUSTED_PROXIES = int(os.getenv("RATELIMIT_TRUSTED_PROXIES", "1"))
+
 
 class DevelopmentConfig(Config):
     """Development configuration"""
@@ -22,3 +128,9 @@ class TestingConfig(Config):
     """Testing configuration"""
 
     TESTING = True
+    TENANCY_ENABLED = True
+    IDENTITY_CACHE_SIZE = 0
+    NEGATIVE_CACHE_TTL = 0
+    RATELIMIT_ENABLED = False
+    ADMISSION_ENABLED = False
+    LOG_ASYNC = False
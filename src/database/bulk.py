@@ -0,0 +1,241 @@
+"""Streaming bulk export/import of the latte and project tables"""
+import csv
+import io
+import json
+import os
+from functools import partial
+
+from sqlalchemy import func, select, text
+
+from src.database.ingredient import sync_ingredients
+from src.database.latte import Latte
+from src.database.persistence import is_postgres
+from src.database.project import Project
+from src.database.stats import count_records
+from src.database.tombstone import stamp_records
+
+TABLES = {"latte": Latte.__table__, "project": Project.__table__}
+# Derived rows, counters and commit stamps kept inside each chunk's transaction, the ORM
+# is bypassed here
+AFTER_IMPORT = {
+    "latte": [sync_ingredients, partial(count_records, "latte"), partial(stamp_records, "latte")],
+    "project": [partial(count_records, "project"), partial(stamp_records, "project")],
+}
+FORMATS = ("ndjson", "csv")
+# NULL in CSV files, COPY would otherwise read empty strings as NULL and vice versa
+CSV_NULL = "\\N"
+
+
+class Checkpoint(object):
+    """
+    Checkpoint
+    progress of an export/import, saved atomically next to the data file
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path) as f:
+            return json.load(f)
+
+    def save(self, state):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp, self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def export_table(
+    engine, table, path, fmt="ndjson", chunk_size=1000, resume=False, progress=None
+):
+    """Stream a table to a file in primary key order, one chunk at a time
+    Args:
+        engine: SQLAlchemy engine
+        table: SQLAlchemy table
+        path: output file
+        fmt: 'ndjson' or 'csv'
+        chunk_size: rows per chunk
+        resume: continue from the checkpoint left by an interrupted export
+        progress: optional callable(table name, rows done, total rows)
+    Returns:
+        number of rows written
+    """
+    columns = [c.name for c in table.columns]
+    checkpoint = Checkpoint(path + ".checkpoint")
+    state = checkpoint.load() if resume else {}
+    last_id, done = state.get("last_id", 0), state.get("rows", 0)
+
+    with engine.connect() as conn:
+        total = conn.execute(select([func.count()]).select_from(table)).scalar()
+
+    mode = "r+" if state else "w"
+    with open(path, mode, newline="") as f:
+        # Drop anything written after the last checkpoint
+        f.seek(state.get("offset", 0))
+        f.truncate()
+        if fmt == "csv" and not state:
+            csv.writer(f).writerow(columns)
+
+        while True:
+            with engine.connect() as conn:
+                ids = select([table.c.id]).where(table.c.id > last_id)
+                ids = ids.order_by(table.c.id).limit(chunk_size).alias("ids")
+                upper = conn.execute(select([func.max(ids.c.id)])).scalar()
+                if upper is None:
+                    break
+                if fmt == "csv" and is_postgres(engine):
+                    rows = copy_to(conn, table, columns, last_id, upper, f)
+                else:
+                    query = (
+                        select([table])
+                        .where(table.c.id > last_id)
+                        .where(table.c.id <= upper)
+                        .order_by(table.c.id)
+                    )
+                    rows = write_rows(conn.execute(query), columns, fmt, f)
+            f.flush()
+            last_id, done = upper, done + rows
+            checkpoint.save({"last_id": last_id, "rows": done, "offset": f.tell()})
+            if progress:
+                progress(table.name, done, total)
+
+    checkpoint.clear()
+    return done
+
+
+def copy_to(conn, table, columns, lower, upper, f):
+    """COPY one id range to the file as CSV (Postgres only)"""
+    cursor = conn.connection.cursor()
+    cursor.copy_expert(
+        f"COPY (SELECT {', '.join(columns)} FROM {table.name} "
+        f"WHERE id > {int(lower)} AND id <= {int(upper)} ORDER BY id) "
+        f"TO STDOUT WITH (FORMAT csv, NULL '{CSV_NULL}')",
+        f,
+    )
+    return cursor.rowcount
+
+
+def write_rows(result, columns, fmt, f):
+    rows = 0
+    writer = csv.writer(f) if fmt == "csv" else None
+    for row in result:
+        if writer:
+            writer.writerow([CSV_NULL if row[c] is None else row[c] for c in columns])
+        else:
+            f.write(json.dumps({c: row[c] for c in columns}) + "\n")
+        rows += 1
+    return rows
+
+
+def read_records(f, fmt, columns):
+    """Yield one dict per record, CSV_NULL fields are read as NULL and empty ones as ''"""
+    if fmt == "csv":
+        for record in csv.DictReader(f):
+            yield {c: (None if record[c] == CSV_NULL else record[c]) for c in columns}
+    else:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                yield {c: record.get(c) for c in columns}
+
+
+def chunked(records, size):
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def import_table(
+    engine, table, path, fmt="ndjson", chunk_size=1000, resume=False, progress=None
+):
+    """Load a file produced by export_table, committing one chunk at a time
+    Postgres loads each chunk with COPY, other databases use executemany.
+    Args:
+        engine: SQLAlchemy engine
+        table: SQLAlchemy table
+        path: input file
+        fmt: 'ndjson' or 'csv'
+        chunk_size: rows per chunk and transaction
+        resume: skip the records committed by an interrupted import, and those of the
+            next chunk if it was committed before the checkpoint could be saved
+        progress: optional callable(table name, rows done, total rows)
+    Returns:
+        number of rows loaded
+    """
+    columns = [c.name for c in table.columns]
+    checkpoint = Checkpoint(path + ".checkpoint")
+    done = checkpoint.load().get("rows", 0) if resume else 0
+
+    with open(path, newline="") as f:
+        records = read_records(f, fmt, columns)
+        for _ in range(done):
+            next(records, None)
+        # Only the first chunk can be ahead of the checkpoint
+        first = resume
+        for chunk in chunked(records, chunk_size):
+            with engine.begin() as conn:
+                load_chunk(conn, table, columns, not_loaded(conn, table, chunk) if first else chunk)
+            first = False
+            done += len(chunk)
+            checkpoint.save({"rows": done})
+            if progress:
+                progress(table.name, done, None)
+
+    if is_postgres(engine):
+        with engine.begin() as conn:
+            conn.execute(
+                text(
+                    f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), "
+                    f"COALESCE(MAX(id), 1)) FROM {table.name}"
+                )
+            )
+    checkpoint.clear()
+    return done
+
+
+def load_chunk(conn, table, columns, chunk):
+    """Insert the records and the rows derived from them, in the caller's transaction"""
+    if not chunk:
+        return
+    if is_postgres(conn.engine):
+        copy_from(conn, table, columns, chunk)
+    else:
+        conn.execute(table.insert(), chunk)
+    for after_import in AFTER_IMPORT.get(table.name, ()):
+        after_import(conn, chunk)
+
+
+def not_loaded(conn, table, chunk):
+    """Records of a chunk whose id isn't in the table yet
+    A crash between the commit of a chunk and the checkpoint leaves it loaded.
+    """
+    ids = [record["id"] for record in chunk if record["id"] is not None]
+    query = select([table.c.id]).where(table.c.id.in_(ids))
+    loaded = {str(row_id) for row_id, in conn.execute(query)}
+    return [record for record in chunk if str(record["id"]) not in loaded]
+
+
+def copy_from(conn, table, columns, chunk):
+    """COPY one chunk of records into the table (Postgres only)"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for record in chunk:
+        writer.writerow([CSV_NULL if record[c] is None else record[c] for c in columns])
+    buffer.seek(0)
+    conn.connection.cursor().copy_expert(
+        f"COPY {table.name} ({', '.join(columns)}) "
+        f"FROM STDIN WITH (FORMAT csv, NULL '{CSV_NULL}')",
+        buffer,
+    )
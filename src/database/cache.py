@@ -0,0 +1,295 @@
+"""Process level identity cache for single row lookups"""
+import logging
+import select
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import text
+from sqlalchemy.orm.exc import NoResultFound
+
+from src.database.persistence import is_postgres
+
+CHANNEL = "identity_cache"
+# Seconds between listener reconnection attempts, doubled up to LISTEN_MAX_BACKOFF
+LISTEN_BACKOFF = 1.0
+LISTEN_MAX_BACKOFF = 60.0
+
+
+class IdentityCache(object):
+    """
+    IdentityCache
+    a size bounded LRU map of (table, id) -> immutable row snapshot,
+    plus a short lived record of ids known not to exist, kept even when no
+    rows are (maxsize 0).
+    Rows are kept per tenant, a tenant holds at most tenant_size of them so
+    one large tenant can't evict everyone else's rows.
+    Snapshots expire after ttl seconds, which bounds how stale a row can get
+    when a change notification is lost, or when no worker listens for them.
+    """
+
+    def __init__(self, maxsize=0, negative_ttl=0, tenant_size=None, ttl=0, negative_size=None):
+        self.maxsize = maxsize
+        self.negative_ttl = negative_ttl
+        self.negative_size = negative_size or maxsize
+        self.tenant_size = tenant_size or maxsize
+        self.ttl = ttl
+        # tenant -> OrderedDict of (row, expiry)
+        self._rows = {}
+        self._missing = OrderedDict()
+        self._size = 0
+        # Bumped by every invalidation, loads that started before one don't store their row
+        self.generation = 0
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """Read the cache size from the app configuration
+        Args:
+            app: Flask instance
+        """
+        self.maxsize = app.config.get("IDENTITY_CACHE_SIZE", 0)
+        self.negative_ttl = app.config.get("NEGATIVE_CACHE_TTL", 0)
+        self.negative_size = app.config.get("NEGATIVE_CACHE_SIZE", 1024)
+        self.tenant_size = app.config.get("IDENTITY_CACHE_TENANT_SIZE") or self.maxsize
+        self.ttl = app.config.get("IDENTITY_CACHE_TTL", 0)
+        self.clear()
+
+    @property
+    def enabled(self):
+        return self.maxsize > 0
+
+    def get(self, table, row_id, tenant=None):
+        """Return the cached snapshot or None"""
+        key = (table, row_id)
+        with self._lock:
+            rows = self._rows.get(tenant)
+            entry = rows.get(key) if rows else None
+            if entry is None:
+                return None
+            row, expires = entry
+            if expires is not None and expires <= time.monotonic():
+                self._drop(tenant, key)
+                return None
+            rows.move_to_end(key)
+            return row
+
+    def put(self, table, row_id, row, tenant=None, generation=None):
+        """Store a snapshot, evicting the least recently used one if full
+        Args:
+            generation: the generation when the row was read, the row isn't stored
+                if an invalidation happened since (None for the writer's own rows)
+        """
+        key = (table, row_id)
+        expires = time.monotonic() + self.ttl if self.ttl > 0 else None
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._missing.pop((tenant,) + key, None)
+            if not self.enabled:
+                return
+            rows = self._rows.setdefault(tenant, OrderedDict())
+            self._size += key not in rows
+            rows[key] = (row, expires)
+            rows.move_to_end(key)
+            if len(rows) > self.tenant_size:
+                self._evict(tenant)
+            while self._size > self.maxsize:
+                self._evict(max(self._rows, key=lambda t: len(self._rows[t])))
+
+    def _evict(self, tenant):
+        rows = self._rows[tenant]
+        rows.popitem(last=False)
+        self._size -= 1
+        if not rows:
+            del self._rows[tenant]
+
+    def _drop(self, tenant, key):
+        rows = self._rows[tenant]
+        if rows.pop(key, None) is not None:
+            self._size -= 1
+            if not rows:
+                del self._rows[tenant]
+
+    def invalidate(self, table, row_id):
+        """Drop a snapshot or miss record if present, whichever tenant holds it"""
+        key = (table, row_id)
+        with self._lock:
+            self.generation += 1
+            for tenant in list(self._rows):
+                self._drop(tenant, key)
+            for missed in [k for k in self._missing if k[1:] == key]:
+                del self._missing[missed]
+
+    def mark_missing(self, table, row_id, tenant=None):
+        """Remember that a row does not exist for negative_ttl seconds"""
+        if self.negative_ttl <= 0 or self.negative_size <= 0:
+            return
+        key = (tenant, table, row_id)
+        with self._lock:
+            self._missing[key] = time.monotonic() + self.negative_ttl
+            self._missing.move_to_end(key)
+            while len(self._missing) > self.negative_size:
+                self._missing.popitem(last=False)
+
+    def is_missing(self, table, row_id, tenant=None):
+        """Check if a row is known not to exist"""
+        key = (tenant, table, row_id)
+        with self._lock:
+            expires = self._missing.get(key)
+            if expires is None:
+                return False
+            if expires <= time.monotonic():
+                del self._missing[key]
+                return False
+            return True
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._rows.clear()
+            self._missing.clear()
+            self._size = 0
+
+    def fetch(self, table, row_id, loader, tenant=None):
+        """Return a snapshot from the cache, falling back to the loader
+        Args:
+            table: table name
+            row_id: primary key
+            loader: callable returning the model instance, may raise NoResultFound
+            tenant: namespace of the row, the loader must only find rows of that tenant
+        Returns:
+            snapshot of the row
+        Raises:
+            NoResultFound, without calling the loader for known misses
+        """
+        row = self.get(table, row_id, tenant)
+        if row is not None:
+            return row
+        if self.is_missing(table, row_id, tenant):
+            raise NoResultFound("No row was found for one()")
+        generation = self.generation
+        try:
+            row = loader().snapshot()
+        except NoResultFound:
+            self.mark_missing(table, row_id, tenant)
+            raise
+        self.put(table, row_id, row, tenant, generation)
+        return row
+
+    def fetch_many(self, table, row_ids, loader, tenant=None):
+        """Return snapshots from the cache, loading all the others at once
+        Args:
+            table: table name
+            row_ids: primary keys
+            loader: callable(ids) returning the model instances found among them,
+                in any order, with one query
+            tenant: namespace of the rows, the loader must only find rows of that tenant
+        Returns:
+            snapshots in the order of row_ids and the ids that don't exist
+        """
+        found, misses = {}, []
+        for row_id in row_ids:
+            row = self.get(table, row_id, tenant)
+            if row is not None:
+                found[row_id] = row
+            elif not self.is_missing(table, row_id, tenant):
+                misses.append(row_id)
+        if misses:
+            generation = self.generation
+            for model in loader(misses):
+                found[model.id] = model.snapshot()
+                self.put(table, model.id, found[model.id], tenant, generation)
+            for row_id in misses:
+                if row_id not in found:
+                    self.mark_missing(table, row_id, tenant)
+        rows = [found[row_id] for row_id in row_ids if row_id in found]
+        return rows, [row_id for row_id in row_ids if row_id not in found]
+
+    def handle_notification(self, payload):
+        """Invalidate the entry named by a '<table>:<id>' notification payload"""
+        table, _, row_id = payload.partition(":")
+        if row_id.isdigit():
+            self.invalidate(table, int(row_id))
+
+    def __len__(self):
+        return self._size
+
+
+identity_cache = IdentityCache()
+
+
+def notify_change(session, table, row_id):
+    """Tell other workers a row changed, delivered when the session commits
+    Only Postgres supports it, other dialects rely on the local cache only.
+    Args:
+        session: SQLAlchemy session holding the pending write
+        table: table name
+        row_id: primary key
+    """
+    if not is_postgres(session.get_bind()):
+        return
+    session.execute(
+        text("SELECT pg_notify(:channel, :payload)"),
+        {"channel": CHANNEL, "payload": f"{table}:{row_id}"},
+    )
+
+
+def listen_for_changes(engine, cache=identity_cache, poll=5.0, logger=None):
+    """Start a daemon thread that applies change notifications to the cache
+    The connection is opened again whenever it fails, and the cache is cleared
+    since the notifications sent meanwhile are lost.
+    Args:
+        engine: SQLAlchemy engine bound to a Postgres database
+        cache: cache to invalidate
+        poll: seconds to wait on the connection between checks
+        logger: where connection failures are reported
+    Returns:
+        thread: the started listener
+    """
+    logger = logger or logging.getLogger(__name__)
+
+    delay = LISTEN_BACKOFF
+
+    def listening():
+        nonlocal delay
+        delay = LISTEN_BACKOFF
+        # Rows may have changed while nobody listened
+        cache.clear()
+
+    def listen():
+        nonlocal delay
+        while True:
+            try:
+                receive(engine, cache, poll, on_listen=listening)
+            except Exception as err:
+                logger.error("Identity cache listener failed, reconnecting in %ss: %s", delay, err)
+                cache.clear()
+                time.sleep(delay)
+                delay = min(delay * 2, LISTEN_MAX_BACKOFF)
+
+    thread = threading.Thread(target=listen, name="identity-cache-listener", daemon=True)
+    thread.start()
+    return thread
+
+
+def receive(engine, cache, poll, on_listen=None):
+    """Listen on a new connection and apply notifications until it fails
+    Args:
+        on_listen: called once the LISTEN is in place
+    """
+    # Out of the pool, the connection stays in autocommit
+    conn = engine.raw_connection()
+    conn.detach()
+    try:
+        conn.connection.set_isolation_level(0)
+        conn.cursor().execute(f"LISTEN {CHANNEL};")
+        if on_listen:
+            on_listen()
+        while True:
+            if select.select([conn.connection], [], [], poll) == ([], [], []):
+                continue
+            conn.connection.poll()
+            while conn.connection.notifies:
+                cache.handle_notification(conn.connection.notifies.pop(0).payload)
+    finally:
+        conn.close()
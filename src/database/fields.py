@@ -0,0 +1,61 @@
+"""Sparse fieldsets: ?fields=title,image returns only those fields of each row
+
+A model lists its fields in FIELDS, each with the attributes it reads and
+how it is rendered. restrict() turns the requested fields into a SELECT of
+their columns, and leaves out the relationships nobody asked for, render()
+only reads the attributes of the requested fields so nothing else is loaded.
+"""
+from sqlalchemy.orm import lazyload, load_only, undefer
+
+from src.helpers.errors import InvalidPayload
+
+
+def parse_fields(args, model):
+    """Read the fields query parameter
+    Args:
+        args: request.args
+        model: model class with FIELDS
+    Returns:
+        set of field names, id always included, None when the parameter is absent
+    Raises:
+        InvalidPayload: unknown field
+    """
+    raw = args.get("fields")
+    if raw is None:
+        return None
+    fields = set(raw.split(","))
+    if not fields <= set(model.FIELDS):
+        raise InvalidPayload({"fields": f"must be among {', '.join(model.FIELDS)}"})
+    return fields | {"id"}
+
+
+def restrict(query, model, fields, *columns):
+    """Load only the columns and relationships the fields read
+    Args:
+        query: query of the model
+        model: model class with FIELDS
+        fields: set from parse_fields, None leaves the query as is
+        columns: other columns the caller reads, e.g. the sort key of a page
+    """
+    if fields is None:
+        return query
+    attributes = {attribute for field in fields for attribute in model.FIELDS[field][0]}
+    relationships = set(model.__mapper__.relationships.keys())
+    options = [load_only(*(attributes - relationships))]
+    options += [undefer(column) for column in columns]
+    # Eager relationships would still load, without anything reading them
+    options += [lazyload(getattr(model, key)) for key in relationships - attributes]
+    return query.options(*options)
+
+
+def render(row, fields=None):
+    """Render the fields of a model or of its snapshot
+    Args:
+        row: instance of a class with FIELDS
+        fields: names of the fields to render, all of them by default
+    """
+    return {
+        name: value(row)
+        for name, (_, value) in row.FIELDS.items()
+        if fields is None or name in fields
+    }
@@ -0,0 +1,123 @@
+"""This is where the normalized latte ingredients are defined"""
+import json
+
+from sqlalchemy import Column, Float, ForeignKey, Index, Integer, String, distinct, func
+
+from src.database.persistence import db
+
+
+def parse_blob(blob):
+    """Turn an ingredients blob into row values
+    Args:
+        blob: json string, [{'color': string, 'name':string, 'parts':number}]
+    Returns:
+        list of column dicts, empty when the blob has another shape
+    """
+    try:
+        items = json.loads(blob) if blob else []
+    except (TypeError, ValueError):
+        return []
+    if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+        return []
+    return [
+        {
+            "position": position,
+            "color": text(item.get("color"), 40),
+            "name": text(item.get("name"), 80),
+            "parts": item.get("parts") if is_number(item.get("parts")) else None,
+        }
+        for position, item in enumerate(items)
+    ]
+
+
+def text(value, length):
+    # Blobs written before validation existed may hold anything
+    return value[:length] if isinstance(value, str) else None
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def number(value):
+    """Floats that hold whole numbers go back out as ints"""
+    return int(value) if isinstance(value, float) and value.is_integer() else value
+
+
+class LatteIngredient(db.Model):
+    """
+    LatteIngredient
+    one ingredient of a latte, the queryable copy of Latte.ingredients
+    """
+
+    __tablename__ = "latte_ingredient"
+    __table_args__ = (
+        # Eager loads read the rows of a latte already in recipe order
+        Index("ix_latte_ingredient_latte_id_position", "latte_id", "position"),
+        # Covers lattes by ingredient and usage counts, the table is never read
+        Index("ix_latte_ingredient_name_latte_id_parts", "name", "latte_id", "parts"),
+    )
+    id = Column(Integer, primary_key=True)
+    latte_id = Column(Integer, ForeignKey("latte.id", ondelete="CASCADE"), nullable=False)
+    # Order of the ingredient in the recipe
+    position = Column(Integer, nullable=False)
+    color = Column(String(40))
+    name = Column(String(80))
+    parts = Column(Float)
+
+    def to_json(self):
+        """the ingredient as it appears in the latte blob"""
+        item = {"color": self.color, "name": self.name, "parts": number(self.parts)}
+        return {key: value for key, value in item.items() if value is not None}
+
+    @classmethod
+    def from_blob(cls, blob):
+        return [cls(**values) for values in parse_blob(blob)]
+
+    @classmethod
+    def latte_ids(cls, name):
+        """Ids of the lattes using an ingredient, for Latte.id.in_()"""
+        return db.session.query(cls.latte_id).filter(cls.name == name)
+
+    @classmethod
+    def usage(cls, owner=None):
+        """Number of lattes and total parts per ingredient, most used first
+        Args:
+            owner: only count the lattes of this tenant, None counts every latte
+        """
+        lattes = func.count(distinct(cls.latte_id))
+        # The rows of soft deleted lattes stay until the purge
+        latte = db.metadata.tables["latte"]
+        rows = (
+            db.session.query(cls.name, lattes, func.sum(cls.parts))
+            .join(latte, latte.c.id == cls.latte_id)
+            .filter(cls.name.isnot(None), latte.c.deleted_at.is_(None))
+        )
+        if owner is not None:
+            rows = rows.filter(latte.c.owner == owner)
+        rows = rows.group_by(cls.name).order_by(lattes.desc(), cls.name)
+        return [
+            {"name": name, "lattes": count, "parts": number(parts)}
+            for name, count, parts in rows
+        ]
+
+
+def sync_ingredients(conn, lattes):
+    """Rebuild the ingredient rows of lattes written without the ORM
+    Args:
+        conn: connection inside the caller's transaction
+        lattes: records with the 'id' and 'ingredients' latte columns
+    """
+    table = LatteIngredient.__table__
+    # CSV imports hand over the ids as strings
+    ids = [int(latte["id"]) for latte in lattes]
+    if not ids:
+        return
+    conn.execute(table.delete().where(table.c.latte_id.in_(ids)))
+    rows = [
+        dict(values, latte_id=latte_id)
+        for latte_id, latte in zip(ids, lattes)
+        for values in parse_blob(latte["ingredients"])
+    ]
+    if rows:
+        conn.execute(table.insert(), rows)
@@ -1,33 +1,65 @@
 """This is where the Latte schema is defined"""
 import json
+from collections import namedtuple
 
-from sqlalchemy import Column, String, Integer
+from sqlalchemy import Column, String, Integer, event
+from sqlalchemy.orm import relationship
 
+from src.database.cache import identity_cache, notify_change
+from src.database.fields import render
+from src.database.ingredient import LatteIngredient
 from src.database.persistence import db
+from src.database.tenant import Owned
+from src.database.tombstone import SoftDelete, collection_indexes
 
 
-class Latte(db.Model):
+class Latte(Owned, SoftDelete, db.Model):
     """
     Latte
     a persistent Latte entity, extends the base SQLAlchemy Model
     """
 
     __tablename__ = "latte"
+    __table_args__ = collection_indexes(__tablename__)
     # Autoincrementing, unique primary key
     id = Column(Integer, primary_key=True)
-    # String Title
-    title = Column(String(80), unique=True)
+    # String Title, unique among the live lattes of the owner
+    title = Column(String(80))
     # the ingredients blob - this stores a lazy json blob
     # the required datatype is [{'color': string, 'name':string, 'parts':number}]
     ingredients = Column(String(300), nullable=False)
+    # the blob normalized into latte_ingredient rows, kept in sync on assignment
+    # selectin loads them for a whole result set with one extra IN query
+    ingredient_rows = relationship(
+        LatteIngredient,
+        order_by=LatteIngredient.position,
+        cascade="all, delete-orphan",
+        lazy="selectin",
+    )
 
-    def long(self):
-        """long form representation of the Latte model"""
-        return {
-            "id": self.id,
-            "title": self.title,
-            "ingredients": json.loads(self.ingredients),
-        }
+    def ingredients_json(self):
+        """the ingredients from their rows, or the blob when it is not a list of objects"""
+        if self.ingredient_rows:
+            return [row.to_json() for row in self.ingredient_rows]
+        return json.loads(self.ingredients)
+
+    # Fields of long(): the attributes each one reads and how it is rendered
+    FIELDS = {
+        "id": (["id"], lambda latte: latte.id),
+        "title": (["title"], lambda latte: latte.title),
+        "ingredients": (["ingredients", "ingredient_rows"], lambda latte: latte.ingredients_json()),
+    }
+
+    def long(self, fields=None):
+        """long form representation of the Latte model
+        Args:
+            fields: only the fields to render, from ?fields=
+        """
+        return render(self, fields)
+
+    def snapshot(self):
+        """immutable copy of the row, safe to share across requests"""
+        return LatteSnapshot(self.id, self.title, self.ingredients_json())
 
     def insert(self):
         """inserts a new model into a database
@@ -38,27 +70,53 @@ class Latte(db.Model):
             Latte.insert()
         """
         db.session.add(self)
+        db.session.flush()
+        notify_change(db.session, self.__tablename__, self.id)
         db.session.commit()
+        identity_cache.put(self.__tablename__, self.id, self.snapshot(), self.owner)
 
     def delete(self):
-        """deletes a new model into a database
+        """soft deletes a model, the row stays as a tombstone until it is purged
             the model must exist in the database
             Examples:
                 Latte = Latte(title=req_title, ingredients=req_ingredients)
                 Latte.delete()
         """
-        db.session.delete(self)
+        notify_change(db.session, self.__tablename__, self.id)
+        self.soft_delete()
         db.session.commit()
+        identity_cache.invalidate(self.__tablename__, self.id)
 
-    def update(self):
+    def update(self, **values):
         """updates a new model into a database
             the model must exist in the database
+            values are columns set before the update
             Examples:
                 Latte = Latte.query.filter(Latte.id == id).one_or_none()
                 Latte.title = 'Black Coffee'
                 Latte.update()
+                Latte.update(title='Black Coffee')
         """
+        for column, value in values.items():
+            setattr(self, column, value)
+        notify_change(db.session, self.__tablename__, self.id)
         db.session.commit()
+        identity_cache.put(self.__tablename__, self.id, self.snapshot(), self.owner)
 
     def __repr__(self):
         return json.dumps(self.long())
+
+
+@event.listens_for(Latte.ingredients, "set")
+def _normalize_ingredients(latte, value, oldvalue, initiator):
+    latte.ingredient_rows = LatteIngredient.from_blob(value)
+
+
+class LatteSnapshot(namedtuple("LatteSnapshot", ["id", "title", "ingredients"])):
+    """Detached, read only latte row held by the identity cache
+    ingredients is the parsed list, not the blob
+    """
+
+    __slots__ = ()
+    FIELDS = dict(Latte.FIELDS, ingredients=([], lambda latte: latte.ingredients))
+    long = Latte.long
@@ -0,0 +1,348 @@
+"""Rows held in memory, indexed like their tables, for reads that skip the database
+
+MemoryRepository keeps the rows of each tenant with sorted (sort key, id)
+indexes, the same keys as the table indexes, so a page is a bisect and a
+slice rather than a sort, and lattes by ingredient name. It stands alone
+(tests, local tools) or behind WriteThroughRepository, which writes to the
+database and serves the reads from memory, brought up to date from the
+changes feed of every tenant at most every STORAGE_REFRESH seconds and right
+after its own writes. One thread syncs at a time, the others keep reading the
+copy meanwhile.
+"""
+import bisect
+import heapq
+import itertools
+import threading
+import time
+from collections import Counter, defaultdict, namedtuple
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import NoResultFound
+
+from src.database.ingredient import is_number, number
+from src.database.pagination import ALL, SORT_KEYS, encode_cursor
+from src.database.repository import Repository
+from src.database.tombstone import CHANGES_LIMIT, format_cursor, read_cursor
+from src.helpers.tenant import current_tenant, default_owner
+
+# values: the column values of the row, snapshot: what the reads return
+Row = namedtuple("Row", ["values", "snapshot"])
+
+
+class Namespace(object):
+    """
+    Namespace
+    indexes of the rows of one tenant
+    """
+
+    def __init__(self):
+        # sort key -> sorted (value, id) of the live rows
+        self.live = {sort: [] for sort in SORT_KEYS}
+        # sorted (updated_at, id) of every row, tombstones included
+        self.written = []
+        # title -> id of the live row holding it
+        self.titles = {}
+        # ingredient name -> ids of the live lattes using it
+        self.ingredients = defaultdict(set)
+
+
+def ingredients(snapshot):
+    """Ingredients of a latte snapshot, none for other rows or blobs of another shape"""
+    items = getattr(snapshot, "ingredients", None)
+    return [item for item in items if isinstance(item, dict)] if isinstance(items, list) else []
+
+
+def sort_key(sort, values):
+    # Titles are optional in the table, None doesn't compare with strings
+    value = values[sort]
+    return ("" if value is None else value, values["id"])
+
+
+def after(index, key):
+    """Entries of a sorted index greater than key, ascending"""
+    start = 0 if key is None else bisect.bisect_right(index, tuple(key))
+    return (index[i] for i in range(start, len(index)))
+
+
+def before(index, key):
+    """Entries of a sorted index lower than key, descending"""
+    end = len(index) if key is None else bisect.bisect_left(index, tuple(key))
+    return (index[i] for i in range(end - 1, -1, -1))
+
+
+def remove(index, key):
+    i = bisect.bisect_left(index, key)
+    if i < len(index) and index[i] == key:
+        del index[i]
+
+
+class MemoryRepository(Repository):
+    """
+    MemoryRepository
+    rows of a model held in memory, scoped by tenant like the tables
+    """
+
+    def __init__(self, model):
+        super(MemoryRepository, self).__init__(model)
+        self.columns = [column.key for column in model.__table__.columns]
+        # id -> Row, tombstones included
+        self._rows = {}
+        self._tenants = {}
+        self._next_id = 1
+        self._lock = threading.RLock()
+
+    def list(self, page=ALL, fields=None):
+        with self._lock:
+            scan = before if page.descending else after
+            runs = [scan(tenant.live[page.sort], page.after) for tenant in self._scope()]
+            keys = list(
+                itertools.islice(
+                    heapq.merge(*runs, reverse=page.descending),
+                    page.limit + 1 if page.limit else None,
+                )
+            )
+            cursor = None
+            if page.limit and len(keys) > page.limit:
+                keys.pop()
+                cursor = encode_cursor(page, *keys[-1])
+            return [self._rows[row_id].snapshot for _, row_id in keys], cursor
+
+    def get(self, row_id):
+        with self._lock:
+            row = self._visible(row_id)
+            if row is None:
+                raise NoResultFound("No row was found for one()")
+            return row.snapshot
+
+    def get_many(self, row_ids):
+        with self._lock:
+            found = {row_id: self._visible(row_id) for row_id in row_ids}
+            rows = [row.snapshot for row in found.values() if row is not None]
+            return rows, [row_id for row_id, row in found.items() if row is None]
+
+    def changes(self, cursor, everyone=False):
+        with self._lock:
+            namespaces = list(self._tenants.values()) if everyone else self._scope()
+            runs = [after(tenant.written, cursor) for tenant in namespaces]
+            keys = list(itertools.islice(heapq.merge(*runs), CHANGES_LIMIT))
+            rows = [self._rows[row_id] for _, row_id in keys]
+            live = [row.snapshot for row in rows if row.values["deleted_at"] is None]
+            deleted = [row.values["id"] for row in rows if row.values["deleted_at"] is not None]
+            last = format_cursor(*keys[-1]) if keys else None
+            return live, deleted, last
+
+    def add(self, **values):
+        with self._lock:
+            values = dict(dict.fromkeys(self.columns), **values)
+            values["id"] = values["id"] or self._next_id
+            if values["owner"] is None:
+                values["owner"] = default_owner()
+            values["updated_at"] = time.time()
+            self._check_title(values)
+            return self._store(values).snapshot
+
+    def update(self, row_id, **values):
+        with self._lock:
+            row = self._visible(row_id)
+            if row is None:
+                raise NoResultFound("No row was found for one()")
+            # Derived fields passed back from a render, like image_variants, aren't columns
+            changes = {key: value for key, value in values.items() if key in self.columns}
+            values = dict(row.values, **changes)
+            values["updated_at"] = time.time()
+            self._check_title(values)
+            return self._store(values).snapshot
+
+    def delete(self, row_id):
+        with self._lock:
+            row = self._visible(row_id)
+            if row is None:
+                raise NoResultFound("No row was found for one()")
+            now = time.time()
+            self._store(dict(row.values, deleted_at=now, updated_at=now), row.snapshot)
+
+    def by_ingredient(self, name):
+        with self._lock:
+            ids = sorted(
+                row_id
+                for tenant in self._scope()
+                for row_id in tenant.ingredients.get(name, ())
+            )
+            return [self._rows[row_id].snapshot for row_id in ids]
+
+    def usage(self):
+        with self._lock:
+            lattes, parts = Counter(), {}
+            for tenant in self._scope():
+                for name, ids in tenant.ingredients.items():
+                    lattes[name] += len(ids)
+                    for row_id in ids:
+                        for item in ingredients(self._rows[row_id].snapshot):
+                            if item.get("name") == name and is_number(item.get("parts")):
+                                parts[name] = parts.get(name, 0) + item["parts"]
+            return [
+                {"name": name, "lattes": count, "parts": number(parts.get(name))}
+                for name, count in sorted(lattes.items(), key=lambda item: (-item[1], item[0]))
+            ]
+
+    def load(self, rows, deleted=()):
+        """Store rows read from another repository as they are, and drop the deleted ids
+        Args:
+            rows: model instances, e.g. from changes()
+            deleted: ids of the rows to drop
+        """
+        with self._lock:
+            for row in rows:
+                values = {column: getattr(row, column) for column in self.columns}
+                self._store(values, row.snapshot())
+            for row_id in deleted:
+                self._drop(row_id)
+
+    def _scope(self):
+        """Namespaces the request reads, every one outside requests"""
+        tenant = current_tenant()
+        if tenant is None:
+            return list(self._tenants.values())
+        # get() rather than a defaultdict, owner query parameters mustn't create namespaces
+        return [self._tenants[tenant]] if tenant in self._tenants else []
+
+    def _visible(self, row_id):
+        row = self._rows.get(row_id)
+        tenant = current_tenant()
+        if row is None or row.values["deleted_at"] is not None:
+            return None
+        return row if tenant is None or row.values["owner"] == tenant else None
+
+    def _check_title(self, values):
+        tenant = self._tenants.get(values["owner"])
+        # Like the unique index, rows without a title never conflict
+        holder = tenant.titles.get(values["title"]) if tenant and values["title"] else None
+        if holder is not None and holder != values["id"]:
+            raise IntegrityError(
+                f"{self.table}: title already used", values, ValueError(values["title"])
+            )
+
+    def _store(self, values, snapshot=None):
+        self._drop(values["id"])
+        row = Row(values, snapshot or self.model(**values).snapshot())
+        self._rows[values["id"]] = row
+        self._next_id = max(self._next_id, values["id"] + 1)
+        tenant = self._tenants.setdefault(values["owner"], Namespace())
+        bisect.insort(tenant.written, (values["updated_at"], values["id"]))
+        if values["deleted_at"] is None:
+            for sort in SORT_KEYS:
+                bisect.insort(tenant.live[sort], sort_key(sort, values))
+            tenant.titles[values["title"]] = values["id"]
+            for item in ingredients(row.snapshot):
+                tenant.ingredients[item.get("name")].add(values["id"])
+            tenant.ingredients.pop(None, None)
+        return row
+
+    def _drop(self, row_id):
+        row = self._rows.pop(row_id, None)
+        if row is None:
+            return
+        values, tenant = row.values, self._tenants[row.values["owner"]]
+        remove(tenant.written, (values["updated_at"], row_id))
+        if not tenant.written:
+            # Namespaces only exist for tenants with rows
+            del self._tenants[values["owner"]]
+        if values["deleted_at"] is not None:
+            return
+        for sort in SORT_KEYS:
+            remove(tenant.live[sort], sort_key(sort, values))
+        tenant.titles.pop(values["title"], None)
+        for item in ingredients(row.snapshot):
+            ids = tenant.ingredients.get(item.get("name"), set())
+            ids.discard(row_id)
+            if not ids:
+                tenant.ingredients.pop(item.get("name"), None)
+
+
+class WriteThroughRepository(Repository):
+    """
+    WriteThroughRepository
+    writes to a backing repository, reads from a copy of it in memory
+    """
+
+    def __init__(self, backing, refresh=1.0, retention=None):
+        super(WriteThroughRepository, self).__init__(backing.model)
+        self.backing = backing
+        self.memory = MemoryRepository(backing.model)
+        self.refresh = refresh
+        self.retention = retention
+        # Cursor of the changes of every tenant, None until the first sync
+        self._cursor = None
+        self._synced = 0.0
+        # Held while the database is read, never while the copy is
+        self._sync_lock = threading.Lock()
+
+    def list(self, page=ALL, fields=None):
+        self.sync()
+        return self.memory.list(page, fields)
+
+    def get(self, row_id):
+        self.sync()
+        return self.memory.get(row_id)
+
+    def get_many(self, row_ids):
+        self.sync()
+        return self.memory.get_many(row_ids)
+
+    def changes(self, cursor, everyone=False):
+        return self.backing.changes(cursor, everyone)
+
+    def add(self, **values):
+        row = self.backing.add(**values)
+        self.sync(force=True)
+        return row
+
+    def update(self, row_id, **values):
+        row = self.backing.update(row_id, **values)
+        self.sync(force=True)
+        return row
+
+    def delete(self, row_id):
+        self.backing.delete(row_id)
+        self.sync(force=True)
+
+    def by_ingredient(self, name):
+        self.sync()
+        return self.memory.by_ingredient(name)
+
+    def usage(self):
+        self.sync()
+        return self.memory.usage()
+
+    def sync(self, force=False):
+        """Apply what the backing repository wrote since the last sync, for every tenant
+        A sync already running is left to finish while the reads go on from the
+        copy, unless there is no copy yet or the caller must see its own write.
+        Args:
+            force: sync even if the last one is less than refresh seconds old
+        """
+        if not force and time.time() - self._synced < self.refresh:
+            return
+        if not self._sync_lock.acquire(blocking=force or self._cursor is None):
+            return
+        try:
+            now = time.time()
+            # Another thread may have synced while this one waited
+            if force or now - self._synced >= self.refresh:
+                self._pull(now)
+        finally:
+            self._sync_lock.release()
+
+    def _pull(self, now):
+        memory, cursor = self.memory, self._cursor
+        # Tombstones past the retention are gone, the feed would miss those deletes
+        if cursor is None or (self.retention is not None and self._synced < now - self.retention):
+            # Loaded aside, reads go on from the old copy until the new one is whole
+            memory, cursor = MemoryRepository(self.model), (0.0, 0)
+        while True:
+            rows, deleted, last = self.backing.changes(cursor, everyone=True)
+            if last is None:
+                break
+            memory.load(rows, deleted)
+            cursor = read_cursor(last)
+        self.memory, self._cursor, self._synced = memory, cursor, now
@@ -0,0 +1,414 @@
+"""Online schema changes for the large tables, run by `./manage.py migrate-online`
+
+Alembic revisions run in one transaction during the release phase, anything
+that rewrites or scans a big table there holds its lock for the whole time.
+An online migration is a list of expand/contract steps instead:
+    AddColumn    add a nullable column, a catalog change
+    Backfill     update rows in small keyset batches, each in its own
+                 transaction, throttled and resumable
+    CreateIndex  CREATE INDEX CONCURRENTLY on Postgres
+    AlterType    widening a varchar is a catalog change, anything else is
+                 refused unless the rewrite is allowed
+    DropColumn   the contract step, once no deployed code reads the column
+Every DDL statement runs with a lock_timeout on Postgres and is retried when
+the lock is busy, rather than queueing all traffic behind it.
+"""
+import time
+from abc import ABC, abstractmethod
+
+from sqlalchemy import Column, Float, Integer, String, Table, Text, inspect, select, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.schema import CreateColumn
+
+from src.database.persistence import db, is_postgres
+
+# Throughput used by the dry-run estimates, measure yours and adjust
+UPDATE_ROWS_PER_SECOND = 20000
+INDEX_ROWS_PER_SECOND = 200000
+REWRITE_ROWS_PER_SECOND = 50000
+CATALOG_LOCK_SECONDS = 0.01
+# Postgres lock_not_available
+LOCK_TIMEOUT_CODE = "55P03"
+
+progress_table = Table(
+    "online_migration_progress",
+    db.metadata,
+    # <migration name>:<step number>
+    Column("step", String(120), primary_key=True),
+    Column("last_id", Integer, nullable=False),
+    Column("rows", Integer, nullable=False),
+    Column("updated_at", Float, nullable=False),
+)
+
+MIGRATIONS = {}
+
+
+def table_rows(engine, table):
+    """Row count of a table, the planner estimate on Postgres so it is instant"""
+    with engine.connect() as conn:
+        if is_postgres(engine):
+            rows = conn.execute(
+                text("SELECT reltuples FROM pg_class WHERE oid = to_regclass(:t)"), t=table
+            ).scalar()
+            if rows is not None and rows >= 0:
+                return int(rows)
+        return conn.execute(text(f"SELECT count(*) FROM {table}")).scalar()
+
+
+class Step(ABC):
+    """
+    Step
+    one change of an online migration
+    """
+
+    table = None
+    # Strongest lock the step takes and what waits on it while it is held
+    lock = "ACCESS EXCLUSIVE"
+    blocks = "reads and writes"
+
+    @abstractmethod
+    def describe(self):
+        """One line summary of the change, for the dry run"""
+
+    def locks(self, engine):
+        return self.lock, self.blocks
+
+    def estimate(self, engine, rows):
+        """Seconds the lock is held and seconds the whole step takes"""
+        return CATALOG_LOCK_SECONDS, CATALOG_LOCK_SECONDS
+
+    @abstractmethod
+    def run(self, migration, engine, number):
+        """Apply the step, migration.ddl runs the statements that take locks"""
+
+
+class AddColumn(Step):
+    """Expand: add a nullable column without a default, no rows are touched"""
+
+    def __init__(self, table, column):
+        if not column.nullable or column.server_default is not None:
+            raise ValueError("Add the column nullable, backfill it, then add the constraint")
+        self.table, self.column = table, column
+
+    def describe(self):
+        return f"add column {self.table}.{self.column.name}"
+
+    def run(self, migration, engine, number):
+        ddl = CreateColumn(self.column).compile(dialect=engine.dialect)
+        migration.ddl(engine, f"ALTER TABLE {self.table} ADD COLUMN {ddl}")
+
+
+class DropColumn(Step):
+    """Contract: drop a column no deployed code reads anymore"""
+
+    def __init__(self, table, column):
+        self.table, self.column = table, column
+
+    def describe(self):
+        return f"drop column {self.table}.{self.column}"
+
+    def run(self, migration, engine, number):
+        migration.ddl(engine, f"ALTER TABLE {self.table} DROP COLUMN {self.column}")
+
+
+def is_widening(old, new):
+    """A varchar made longer or turned into text keeps every stored value as is"""
+    if not isinstance(old, String) or not isinstance(new, String):
+        return False
+    if isinstance(old, Text) or getattr(old, "length", None) is None:
+        return isinstance(new, Text) or new.length is None
+    return isinstance(new, Text) or new.length is None or new.length >= old.length
+
+
+class AlterType(Step):
+    """Change a column type in place, only when Postgres can skip the table rewrite
+    Anything else (e.g. text to jsonb) is an expand/contract: AddColumn the new
+    column, Backfill it, switch the code, then DropColumn the old one.
+    """
+
+    def __init__(self, table, column, type_, using=None, allow_rewrite=False):
+        self.table, self.column, self.type = table, column, type_
+        self.using = using
+        self.allow_rewrite = allow_rewrite
+
+    def describe(self):
+        return f"alter column {self.table}.{self.column} type {self.type}"
+
+    def current_type(self, engine):
+        for column in inspect(engine).get_columns(self.table):
+            if column["name"] == self.column:
+                return column["type"]
+        raise KeyError(f"No column {self.table}.{self.column}")
+
+    def rewrites(self, engine):
+        return not is_widening(self.current_type(engine), self.type)
+
+    def estimate(self, engine, rows):
+        if not self.rewrites(engine):
+            return CATALOG_LOCK_SECONDS, CATALOG_LOCK_SECONDS
+        seconds = rows / REWRITE_ROWS_PER_SECOND
+        return seconds, seconds
+
+    def run(self, migration, engine, number):
+        if self.rewrites(engine) and not self.allow_rewrite:
+            raise RuntimeError(f"{self.describe()} rewrites the table, use expand/contract")
+        if not is_postgres(engine):
+            # SQLite does not enforce varchar lengths, there is nothing to change
+            if not self.rewrites(engine):
+                return
+            raise RuntimeError(f"{self.describe()} needs Postgres")
+        using = f" USING {self.using}" if self.using else ""
+        type_ = self.type.compile(dialect=engine.dialect)
+        migration.ddl(
+            engine, f"ALTER TABLE {self.table} ALTER COLUMN {self.column} TYPE {type_}{using}"
+        )
+
+
+class CreateIndex(Step):
+    """Build an index, on Postgres without blocking writes"""
+
+    def __init__(self, name, table, columns, unique=False):
+        self.name, self.table, self.columns = name, table, columns
+        self.unique = unique
+
+    def describe(self):
+        return f"create index {self.name} on {self.table} ({', '.join(self.columns)})"
+
+    def locks(self, engine):
+        if is_postgres(engine):
+            return "SHARE UPDATE EXCLUSIVE", "other schema changes"
+        return "SHARE", "writes"
+
+    def estimate(self, engine, rows):
+        seconds = rows / INDEX_ROWS_PER_SECOND
+        return (0.0 if is_postgres(engine) else seconds), seconds
+
+    def run(self, migration, engine, number):
+        unique = "UNIQUE " if self.unique else ""
+        columns = ", ".join(self.columns)
+        if not is_postgres(engine):
+            migration.ddl(
+                engine,
+                f"CREATE {unique}INDEX IF NOT EXISTS {self.name} ON {self.table} ({columns})",
+            )
+            return
+        # An interrupted concurrent build leaves an invalid index behind, IF NOT
+        # EXISTS would keep it, so drop it first
+        with engine.connect() as conn:
+            invalid = conn.execute(
+                text(
+                    "SELECT 1 FROM pg_index WHERE indexrelid = to_regclass(:name) "
+                    "AND NOT indisvalid"
+                ),
+                name=self.name,
+            ).scalar()
+        if invalid:
+            migration.ddl(engine, f"DROP INDEX CONCURRENTLY {self.name}", autocommit=True)
+        migration.ddl(
+            engine,
+            f"CREATE {unique}INDEX CONCURRENTLY IF NOT EXISTS {self.name} "
+            f"ON {self.table} ({columns})",
+            autocommit=True,
+        )
+
+
+class Backfill(Step):
+    """Update every row in primary key batches, each batch commits on its own
+    Args:
+        table: table name, with an integer id primary key
+        assignments: SET clause, e.g. "ingredients_jsonb = ingredients::jsonb"
+        where: optional filter, rows already done should not match it
+        batch_size: rows per transaction
+        throttle: seconds slept per second spent in a batch, 1.0 keeps the
+            database half idle and backs off by itself when batches slow down
+    """
+
+    lock = "ROW EXCLUSIVE"
+    blocks = "writes to the rows of the current batch"
+
+    def __init__(self, table, assignments, where=None, batch_size=1000, throttle=0.5):
+        self.table, self.assignments, self.where = table, assignments, where
+        self.batch_size = batch_size
+        self.throttle = throttle
+
+    def describe(self):
+        where = f" where {self.where}" if self.where else ""
+        return f"backfill {self.table} set {self.assignments}{where}"
+
+    def estimate(self, engine, rows):
+        batch = min(rows, self.batch_size) / UPDATE_ROWS_PER_SECOND
+        working = rows / UPDATE_ROWS_PER_SECOND
+        return batch, working * (1 + self.throttle)
+
+    def run(self, migration, engine, number):
+        key = f"{migration.name}:{number}"
+        with engine.connect() as conn:
+            state = conn.execute(
+                select([progress_table.c.last_id, progress_table.c.rows]).where(
+                    progress_table.c.step == key
+                )
+            ).first()
+        last_id, done = state if state else (0, 0)
+        saved = state is not None
+        where = f" AND ({self.where})" if self.where else ""
+
+        while True:
+            started = time.monotonic()
+            with engine.begin() as conn:
+                upper = conn.execute(
+                    text(
+                        f"SELECT max(id) FROM (SELECT id FROM {self.table} "
+                        f"WHERE id > :last ORDER BY id LIMIT :size) AS batch"
+                    ),
+                    last=last_id,
+                    size=self.batch_size,
+                ).scalar()
+                if upper is None:
+                    break
+                updated = conn.execute(
+                    text(
+                        f"UPDATE {self.table} SET {self.assignments} "
+                        f"WHERE id > :last AND id <= :upper{where}"
+                    ),
+                    last=last_id,
+                    upper=upper,
+                ).rowcount
+                last_id, done = upper, done + updated
+                # Saved with the batch, a restart continues after it
+                self.save(conn, key, last_id, done, saved)
+                saved = True
+            migration.report(f"{self.table}: {done} rows updated, up to id {last_id}")
+            time.sleep((time.monotonic() - started) * self.throttle)
+        return done
+
+    def save(self, conn, key, last_id, done, exists):
+        values = {"last_id": last_id, "rows": done, "updated_at": time.time()}
+        if exists:
+            conn.execute(
+                progress_table.update().where(progress_table.c.step == key).values(**values)
+            )
+        else:
+            conn.execute(progress_table.insert().values(step=key, **values))
+
+
+class OnlineMigration(object):
+    """
+    OnlineMigration
+    named list of steps, run in order, each with its own short transactions
+    """
+
+    def __init__(self, name, steps, lock_timeout=2.0, retries=10, retry_backoff=1.0):
+        self.name, self.steps = name, steps
+        self.lock_timeout = lock_timeout
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.report = lambda message: None
+
+    def plan(self, engine):
+        """Dry run, what every step would lock and for how long
+        Returns:
+            list of dicts, one per step
+        """
+        rows = {}
+        report = []
+        for number, step in enumerate(self.steps, 1):
+            if step.table not in rows:
+                rows[step.table] = table_rows(engine, step.table)
+            lock_seconds, seconds = step.estimate(engine, rows[step.table])
+            lock, blocks = step.locks(engine)
+            report.append(
+                {
+                    "step": number,
+                    "action": step.describe(),
+                    "rows": rows[step.table],
+                    "lock": lock,
+                    "blocks": blocks,
+                    "lock_seconds": round(lock_seconds, 3),
+                    "seconds": round(seconds, 3),
+                }
+            )
+        return report
+
+    def run(self, engine, report=None):
+        """Run every step, a rerun after a failure resumes interrupted backfills
+        Args:
+            engine: SQLAlchemy engine
+            report: optional callable(message) for progress
+        """
+        self.report = report or self.report
+        progress_table.create(engine, checkfirst=True)
+        for number, step in enumerate(self.steps, 1):
+            self.report(f"{number}/{len(self.steps)} {step.describe()}")
+            step.run(self, engine, number)
+        with engine.begin() as conn:
+            conn.execute(
+                progress_table.delete().where(progress_table.c.step.like(f"{self.name}:%"))
+            )
+
+    def ddl(self, engine, statement, autocommit=False):
+        """Run one DDL statement, retrying while another transaction holds the lock
+        Args:
+            engine: SQLAlchemy engine
+            statement: SQL text
+            autocommit: run outside a transaction, CONCURRENTLY requires it
+        """
+        for attempt in range(1, self.retries + 1):
+            try:
+                return self._ddl(engine, statement, autocommit)
+            except OperationalError as err:
+                code = getattr(err.orig, "pgcode", None)
+                if code != LOCK_TIMEOUT_CODE or attempt == self.retries:
+                    raise
+                delay = self.retry_backoff * attempt
+                self.report(f"lock busy, retrying in {delay}s: {statement}")
+                time.sleep(delay)
+
+    def _ddl(self, engine, statement, autocommit):
+        if not is_postgres(engine):
+            with engine.begin() as conn:
+                conn.execute(text(statement))
+            return
+        timeout = f"lock_timeout = '{int(self.lock_timeout * 1000)}ms'"
+        with engine.connect() as conn:
+            if autocommit:
+                conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+                conn.execute(text(f"SET {timeout}"))
+                try:
+                    conn.execute(text(statement))
+                finally:
+                    conn.execute(text("RESET lock_timeout"))
+                return
+            with conn.begin():
+                conn.execute(text(f"SET LOCAL {timeout}"))
+                conn.execute(text(statement))
+
+
+def online_migration(name, *steps, **options):
+    """Register an online migration under a name for manage.py"""
+    MIGRATIONS[name] = OnlineMigration(name, list(steps), **options)
+    return MIGRATIONS[name]
+
+
+# The latte_ingredient indexes of revision 5e8a1c3f7b62, for databases too
+# busy to build them inside the release phase. Run this first, the revision
+# then finds them in place.
+online_migration(
+    "latte-ingredient-indexes",
+    CreateIndex(
+        "ix_latte_ingredient_latte_id_position", "latte_ingredient", ["latte_id", "position"]
+    ),
+    CreateIndex(
+        "ix_latte_ingredient_name_latte_id_parts",
+        "latte_ingredient",
+        ["name", "latte_id", "parts"],
+    ),
+)
+
+# The title page indexes of revision 4c8e2a6f1d39
+online_migration(
+    "title-sort-indexes",
+    *[
+        CreateIndex(f"ix_{table}_owner_title_id", table, ["owner", "coalesce(title, '')", "id"])
+        for table in ("latte", "project")
+    ],
+)
@@ -0,0 +1,143 @@
+"""Sorted collections paged with keyset cursors
+
+?sort=title (or id, updated_at, with a leading - for descending) orders a
+collection, ?limit=N returns its first N rows and a cursor for the next ones.
+Cursors hold the sort key of the last row and its id rather than an offset,
+rows inserted meanwhile never shift a page.
+?ids=1,5,9 asks for given rows instead, in that order.
+"""
+import base64
+import binascii
+import json
+import math
+from collections import OrderedDict, namedtuple
+
+from sqlalchemy import func, literal_column, tuple_
+
+from src.helpers.errors import InvalidPayload
+
+SORT_KEYS = ("id", "title", "updated_at")
+# JSON types a cursor may hold for each sort key, titles without a value page as ''
+SORT_TYPES = {"id": (int,), "title": (str,), "updated_at": (int, float)}
+MAX_LIMIT = 100
+
+Page = namedtuple("Page", ["sort", "descending", "limit", "after"])
+# The whole collection by id, what a request without page parameters gets
+ALL = Page("id", False, None, None)
+
+
+def parse_page(args):
+    """Read the sort, limit and cursor query parameters
+    Args:
+        args: request.args
+    Returns:
+        Page, limit is None when the whole collection is asked for
+    Raises:
+        InvalidPayload: unknown sort key, bad limit or cursor
+    """
+    sort = args.get("sort", "id")
+    descending = sort.startswith("-")
+    sort = sort.lstrip("-")
+    if sort not in SORT_KEYS:
+        raise InvalidPayload({"sort": f"must be one of {', '.join(SORT_KEYS)}"})
+    limit = args.get("limit")
+    if limit is not None:
+        if not limit.isdigit() or not 0 < int(limit) <= MAX_LIMIT:
+            raise InvalidPayload({"limit": f"must be between 1 and {MAX_LIMIT}"})
+        limit = int(limit)
+    after = args.get("cursor")
+    if after is not None:
+        after = decode_cursor(after, sort, descending)
+    return Page(sort, descending, limit, after)
+
+
+def parse_ids(args):
+    """Read the ids query parameter
+    Args:
+        args: request.args
+    Returns:
+        distinct ids in the requested order, None when the parameter is absent
+    Raises:
+        InvalidPayload: not a comma separated list of at most MAX_LIMIT ids, or
+            combined with the sort, limit or cursor parameters
+    """
+    raw = args.get("ids")
+    if raw is None:
+        return None
+    if any(name in args for name in ("sort", "limit", "cursor")):
+        raise InvalidPayload({"ids": "can't be combined with sort, limit or cursor"})
+    ids = raw.split(",")
+    if not all(_.isdigit() for _ in ids) or len(ids) > MAX_LIMIT:
+        raise InvalidPayload({"ids": f"must be a comma separated list of up to {MAX_LIMIT} ids"})
+    return list(OrderedDict.fromkeys(int(_) for _ in ids))
+
+
+def encode_cursor(page, value, row_id):
+    """Cursor of the page after the row with this sort key value and id"""
+    key = [page.sort, page.descending, value, row_id]
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip("=")
+
+
+def is_key(value, types):
+    """Whether a decoded cursor value is one of types, bools and NaN/Infinity aren't keys"""
+    if isinstance(value, bool) or not isinstance(value, types):
+        return False
+    return not isinstance(value, float) or math.isfinite(value)
+
+
+def decode_cursor(raw, sort, descending):
+    """Read a cursor written by encode_cursor for the same sort
+    Returns:
+        (sort key value, id)
+    Raises:
+        InvalidPayload: not a cursor, or a cursor of another sort
+    """
+    try:
+        key = json.loads(base64.urlsafe_b64decode(raw + "=" * (-len(raw) % 4)))
+        cursor_sort, cursor_descending, value, row_id = key
+    except (binascii.Error, ValueError, TypeError):
+        raise InvalidPayload({"cursor": "must be a cursor returned by a previous page"})
+    if (cursor_sort, cursor_descending) != (sort, descending):
+        raise InvalidPayload({"cursor": "was returned for another sort"})
+    if not is_key(value, SORT_TYPES[sort]) or not is_key(row_id, (int,)):
+        raise InvalidPayload({"cursor": "must be a cursor returned by a previous page"})
+    return value, row_id
+
+
+def sort_column(model, sort):
+    """Column expression pages are ordered by
+    NULL compares as unknown, titles without a value sort as '' instead, like
+    they do in memory. The literal '' matches the expression of the index.
+    """
+    column = getattr(model, sort)
+    return func.coalesce(column, literal_column("''")) if sort == "title" else column
+
+
+def paginate(query, model, page):
+    """Order a query and cut one page out of it
+    Args:
+        query: query of a model with an id and the SORT_KEYS columns
+        model: the model class
+        page: Page from parse_page
+    Returns:
+        rows and the cursor of the next page, None on the last one
+    """
+    if page.sort == "id":
+        order, key = [model.id], model.id
+        last = page.after and page.after[1]
+    else:
+        order = [sort_column(model, page.sort), model.id]
+        # A row value comparison is one range of the (sort key, id) index
+        key, last = tuple_(*order), page.after and tuple_(*page.after)
+    if page.after is not None:
+        query = query.filter(key < last if page.descending else key > last)
+    query = query.order_by(*[o.desc() if page.descending else o for o in order])
+    if page.limit is None:
+        return query.all(), None
+    # One extra row tells whether there is a next page
+    rows = query.limit(page.limit + 1).all()
+    if len(rows) <= page.limit:
+        return rows, None
+    rows.pop()
+    value = getattr(rows[-1], page.sort)
+    return rows, encode_cursor(page, "" if value is None else value, rows[-1].id)
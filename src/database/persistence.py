@@ -1,5 +1,43 @@
+import sqlite3
+
 from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 
 db = SQLAlchemy()
-migrate = Migrate()
+
+
+def is_postgres(bind):
+    """Whether an engine, connection or session bind talks to Postgres"""
+    return bind.dialect.name == "postgresql"
+
+
+@event.listens_for(Engine, "connect")
+def _sqlite_foreign_keys(dbapi_connection, connection_record):
+    """SQLite only honours ON DELETE CASCADE with foreign keys switched on"""
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+
+
+class LazyMigrate(object):
+    """Flask-Migrate registration that only imports Alembic when it is used"""
+
+    def init_app(self, app, db):
+        from flask_migrate import Migrate
+
+        Migrate(app, db)
+
+
+migrate = LazyMigrate()
+
+
+def dispose_engine(app):
+    """Drop pooled connections inherited from a parent process
+    Call it after forking, e.g. from gunicorn's post_fork with preload_app.
+    Args:
+        app: Flask instance
+    """
+    with app.app_context():
+        db.engine.dispose()
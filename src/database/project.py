@@ -1,21 +1,30 @@
 """This is where the Project schema is defined"""
 import json
+from collections import namedtuple
 
 from sqlalchemy import Column, String, Integer
 
+from src.database.cache import identity_cache, notify_change
+from src.database.fields import render
 from src.database.persistence import db
+from src.database.tenant import Owned
+from src.database.tombstone import SoftDelete, collection_indexes
+from src.helpers.images import images
+from src.helpers.tasks import tasks
 
 
-class Project(db.Model):
+class Project(Owned, SoftDelete, db.Model):
     """
     Project
     a persistent Project entity, extends the base SQLAlchemy Model
     """
 
     __tablename__ = "project"
+    __table_args__ = collection_indexes(__tablename__)
     # Autoincrementing, unique primary key
     id = Column(Integer, primary_key=True)
-    title = Column(String(80), unique=True)
+    # unique among the live projects of the owner
+    title = Column(String(80))
     # json string blob of array format
     meta = Column(String(300))
     description = Column(String(300))
@@ -24,18 +33,39 @@ class Project(db.Model):
     git_repo = Column(String(300))
     demo_link = Column(String(300))
 
+    # Fields of to_json: the attributes each one reads and how it is rendered
+    FIELDS = {
+        "id": (["id"], lambda project: project.id),
+        "title": (["title"], lambda project: project.title),
+        "meta": (["meta"], lambda project: json.loads(project.meta)),
+        "description": (["description"], lambda project: project.description),
+        "image": (["image"], lambda project: project.image),
+        # thumbnails and placeholder of image, null until they are built
+        "image_variants": (["image"], lambda project: images.variants(project.image)),
+        "git_repo": (["git_repo"], lambda project: project.git_repo),
+        "demo_link": (["demo_link"], lambda project: project.demo_link),
+    }
+
     @property
     def to_json(self):
         """JSON form representation of the project model"""
-        return {
-            "id": self.id,
-            "title": self.title,
-            "meta": json.loads(self.meta),
-            "description": self.description,
-            "image": self.image,
-            "git_repo": self.git_repo,
-            "demo_link": self.demo_link,
-        }
+        return render(self)
+
+    def sparse_json(self, fields):
+        """to_json with only the fields asked for with ?fields="""
+        return render(self, fields)
+
+    def snapshot(self):
+        """immutable copy of the row, safe to share across requests"""
+        return ProjectSnapshot(
+            self.id,
+            self.title,
+            self.meta,
+            self.description,
+            self.image,
+            self.git_repo,
+            self.demo_link,
+        )
 
     def insert(self):
         """inserts a new model into a database
@@ -45,20 +75,28 @@ class Project(db.Model):
             TODO
         """
         db.session.add(self)
+        db.session.flush()
+        notify_change(db.session, self.__tablename__, self.id)
+        self.warm_image()
         db.session.commit()
+        identity_cache.put(self.__tablename__, self.id, self.snapshot(), self.owner)
 
     def delete(self):
-        """deletes a new model into a database
+        """soft deletes a model, the row stays as a tombstone until it is purged
             the model must exist in the database
             Examples:
                 TODO
         """
-        db.session.delete(self)
+        notify_change(db.session, self.__tablename__, self.id)
+        self.soft_delete()
         db.session.commit()
+        identity_cache.invalidate(self.__tablename__, self.id)
 
-    def update(self, title, meta, description, image, git_repo, demo_link):
+    def update(self, title, meta, description, image, git_repo, demo_link, image_variants=None):
         """updates a new model into a database
             the model must exist in the database
+            image_variants is derived from image and ignored, it is accepted
+            so the output of to_json can be passed back
             Examples:
                 TODO
         """
@@ -68,7 +106,29 @@ class Project(db.Model):
         self.image = image
         self.git_repo = git_repo
         self.demo_link = demo_link
+        notify_change(db.session, self.__tablename__, self.id)
+        self.warm_image()
         db.session.commit()
+        identity_cache.put(self.__tablename__, self.id, self.snapshot(), self.owner)
+
+    def warm_image(self):
+        """build the image variants once the write commits, before a client asks"""
+        if images.enabled and self.image:
+            tasks.on_commit(db.session, "images.warm", self.image)
 
     def __repr__(self):
         return f"<Project title: {self.title}>"
+
+
+class ProjectSnapshot(
+    namedtuple(
+        "ProjectSnapshot",
+        ["id", "title", "meta", "description", "image", "git_repo", "demo_link"],
+    )
+):
+    """Detached, read only project row held by the identity cache"""
+
+    __slots__ = ()
+    FIELDS = Project.FIELDS
+    to_json = Project.to_json
+    sparse_json = Project.sparse_json
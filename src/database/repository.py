@@ -0,0 +1,123 @@
+"""Storage of lattes and projects as the blueprints see it
+
+A Repository reads and writes the rows of one model, scoped to the tenant
+of the request. Rows come back as the model or its snapshot, anything with
+the model's renderers (long() for lattes, to_json and sparse_json for
+projects). Failures keep the SQLAlchemy exception types whatever the store:
+NoResultFound for a missing row, IntegrityError for a title already used,
+OperationalError when the store can't be reached.
+"""
+from abc import ABC, abstractmethod
+
+from src.database.cache import identity_cache
+from src.database.fields import restrict
+from src.database.ingredient import LatteIngredient
+from src.database.pagination import ALL, paginate
+from src.database.tombstone import changes
+from src.helpers.tenant import current_tenant
+
+
+class Repository(ABC):
+    """
+    Repository
+    interface of the storage of a model
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.table = model.__tablename__
+
+    @abstractmethod
+    def list(self, page=ALL, fields=None):
+        """Rows in the order of a page
+        Args:
+            page: Page from parse_page, every row by id by default
+            fields: fields the caller renders, others may be left unloaded
+        Returns:
+            rows and the cursor of the next page, None on the last one
+        """
+
+    @abstractmethod
+    def get(self, row_id):
+        """A row by id, raises NoResultFound"""
+
+    @abstractmethod
+    def get_many(self, row_ids):
+        """Rows by id
+        Returns:
+            rows in the order of row_ids and the ids that don't exist
+        """
+
+    @abstractmethod
+    def changes(self, cursor, everyone=False):
+        """Rows written after a cursor, see src.database.tombstone.changes"""
+
+    @abstractmethod
+    def add(self, **values):
+        """Insert a row from its column values, returns it"""
+
+    @abstractmethod
+    def update(self, row_id, **values):
+        """Change the columns of a row, returns it, raises NoResultFound"""
+
+    @abstractmethod
+    def delete(self, row_id):
+        """Delete a row, leaving a tombstone, raises NoResultFound"""
+
+    @abstractmethod
+    def by_ingredient(self, name):
+        """Lattes using an ingredient, by id (lattes only)"""
+
+    @abstractmethod
+    def usage(self):
+        """Number of lattes and total parts per ingredient, most used first (lattes only)"""
+
+
+class SqlRepository(Repository):
+    """
+    SqlRepository
+    rows in the database, single rows through the identity cache
+    """
+
+    def list(self, page=ALL, fields=None):
+        model = self.model
+        query = restrict(model.query, model, fields, getattr(model, page.sort))
+        return paginate(query, model, page)
+
+    def get(self, row_id):
+        return identity_cache.fetch(self.table, row_id, lambda: self._one(row_id), current_tenant())
+
+    def get_many(self, row_ids):
+        return identity_cache.fetch_many(
+            self.table,
+            row_ids,
+            lambda misses: self.model.query.filter(self.model.id.in_(misses)).all(),
+            current_tenant(),
+        )
+
+    def changes(self, cursor, everyone=False):
+        return changes(self.model, cursor, everyone=everyone)
+
+    def add(self, **values):
+        row = self.model(**values)
+        row.insert()
+        return row
+
+    def update(self, row_id, **values):
+        row = self._one(row_id)
+        row.update(**values)
+        return row
+
+    def delete(self, row_id):
+        self._one(row_id).delete()
+
+    def by_ingredient(self, name):
+        model = self.model
+        query = model.query.filter(model.id.in_(LatteIngredient.latte_ids(name)))
+        return query.order_by(model.id).all()
+
+    def usage(self):
+        return LatteIngredient.usage(current_tenant())
+
+    def _one(self, row_id):
+        return self.model.query.filter(self.model.id == row_id).one()
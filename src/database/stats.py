@@ -0,0 +1,202 @@
+"""Counters behind /api/stats, maintained with every write instead of counted on read
+
+Each live latte counts once for its owner and once for every ingredient it
+uses, each live project once and once for every meta tag. The deltas of a
+flush are applied in the same transaction as the rows, tombstones count
+for nothing. Writes that bypass the ORM (bulk imports) call count_records,
+rebuild recomputes everything from the tables should the counters drift.
+"""
+import json
+from collections import Counter
+
+from sqlalchemy import Column, Integer, String, and_, event, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from src.database.ingredient import parse_blob
+from src.database.persistence import db, is_postgres
+from src.helpers.tenant import default_owner
+
+REBUILD_BATCH_SIZE = 1000
+
+
+class Stat(db.Model):
+    """
+    Stat
+    one counter of a tenant: its lattes, projects, lattes per ingredient
+    or projects per tag
+    """
+
+    __tablename__ = "stat"
+    owner = Column(String(128), primary_key=True)
+    # 'lattes' and 'projects' totals, 'ingredient' or 'tag' counts by name
+    kind = Column(String(20), primary_key=True)
+    name = Column(String(80), primary_key=True, default="")
+    count = Column(Integer, nullable=False, default=0)
+
+    @classmethod
+    def summary(cls, owner):
+        """Counters of a tenant, read by primary key prefix whatever the size of the tables
+        Returns:
+            dict of the latte and project totals, lattes per ingredient and
+            projects per tag, most used first
+        """
+        rows = cls.query.filter(cls.owner == owner, cls.count > 0).all()
+        totals = {row.kind: row.count for row in rows if not row.name}
+        by_count = sorted(rows, key=lambda row: (-row.count, row.name))
+        return {
+            "lattes": totals.get("lattes", 0),
+            "projects": totals.get("projects", 0),
+            "ingredients": [
+                {"name": row.name, "lattes": row.count}
+                for row in by_count
+                if row.kind == "ingredient"
+            ],
+            "tags": [
+                {"name": row.name, "projects": row.count} for row in by_count if row.kind == "tag"
+            ],
+        }
+
+
+def tags(blob):
+    """Distinct tags of a project meta blob, a json array of strings"""
+    try:
+        items = json.loads(blob) if blob else []
+    except (TypeError, ValueError):
+        return set()
+    if not isinstance(items, list):
+        return set()
+    return {item[:80] for item in items if isinstance(item, str)}
+
+
+def latte_keys(values):
+    names = {item["name"] for item in parse_blob(values["ingredients"]) if item["name"]}
+    return [("lattes", "")] + [("ingredient", name) for name in names]
+
+
+def project_keys(values):
+    return [("projects", "")] + [("tag", tag) for tag in tags(values["meta"])]
+
+
+# The counters each table feeds, from the column values of one of its rows
+COUNTED = {"latte": latte_keys, "project": project_keys}
+
+
+def counters(table, values):
+    """Counters a row adds to, none for a missing row or a tombstone
+    Args:
+        table: table name, a key of COUNTED
+        values: mapping of the row's column values, None when there is no row
+    Returns:
+        Counter of (owner, kind, name)
+    """
+    if values is None or values["deleted_at"] is not None:
+        return Counter()
+    return Counter((values["owner"], kind, name) for kind, name in COUNTED[table](values))
+
+
+def increment(conn, deltas):
+    """Add deltas to the counters, creating the missing ones
+    Args:
+        conn: connection inside the caller's transaction
+        deltas: mapping of (owner, kind, name) to the amount to add
+    """
+    table = Stat.__table__
+    # A fixed order keeps concurrent writers of the same counters from deadlocking
+    for (owner, kind, name), delta in sorted(deltas.items()):
+        if not delta:
+            continue
+        key = {"owner": owner, "kind": kind, "name": name}
+        if is_postgres(conn):
+            upsert = insert(table).values(count=delta, **key)
+            conn.execute(
+                upsert.on_conflict_do_update(
+                    index_elements=list(key), set_={"count": table.c.count + delta}
+                )
+            )
+            continue
+        where = and_(*[table.c[column] == value for column, value in key.items()])
+        updated = conn.execute(table.update().where(where).values(count=table.c.count + delta))
+        if not updated.rowcount:
+            conn.execute(table.insert().values(count=delta, **key))
+
+
+def count_records(table, conn, records):
+    """Count rows inserted without the ORM, e.g. a bulk import chunk
+    Args:
+        table: table name, a key of COUNTED
+        conn: connection inside the caller's transaction
+        records: dicts of the inserted column values
+    """
+    deltas = Counter()
+    for record in records:
+        deltas.update(counters(table, record))
+    increment(conn, deltas)
+
+
+def rebuild(engine):
+    """Recompute every counter from the tables, in one transaction
+    Returns:
+        number of counters
+    """
+    deltas = Counter()
+    with engine.begin() as conn:
+        for name in COUNTED:
+            table = db.metadata.tables[name]
+            last_id = 0
+            while True:
+                rows = conn.execute(
+                    select([table])
+                    .where(table.c.id > last_id)
+                    .where(table.c.deleted_at.is_(None))
+                    .order_by(table.c.id)
+                    .limit(REBUILD_BATCH_SIZE)
+                ).fetchall()
+                if not rows:
+                    break
+                for row in rows:
+                    deltas.update(counters(name, row))
+                last_id = rows[-1]["id"]
+        conn.execute(Stat.__table__.delete())
+        increment(conn, deltas)
+    return len(deltas)
+
+
+def previous(conn, table, row_id):
+    """Column values of a row as they are in the database, before the flush
+    The row is locked until the commit: a concurrent writer waits, then reads the
+    values this transaction leaves, so each delta applies to the state it replaces.
+    """
+    query = select([table]).where(table.c.id == row_id).with_for_update()
+    return conn.execute(query).first()
+
+
+def current(row):
+    values = {column.name: getattr(row, column.key) for column in row.__table__.columns}
+    # Column defaults are only applied by the insert
+    if values["owner"] is None:
+        values["owner"] = default_owner()
+    return values
+
+
+@event.listens_for(Session, "before_flush")
+def _count_flushed(session, flush_context, instances):
+    rows = [
+        row
+        for row in (*session.new, *session.dirty, *session.deleted)
+        if getattr(row, "__tablename__", None) in COUNTED
+    ]
+    # Rows are locked in a fixed order so concurrent flushes don't deadlock
+    rows.sort(key=lambda row: (row.__tablename__, row.id or 0))
+    if not rows:
+        return
+    conn, deltas = session.connection(), Counter()
+    for row in rows:
+        if row in session.dirty and not session.is_modified(row):
+            continue
+        table = row.__table__
+        before = None if row in session.new else previous(conn, table, row.id)
+        after = None if row in session.deleted else current(row)
+        deltas.update(counters(table.name, after))
+        deltas.subtract(counters(table.name, before))
+    increment(conn, deltas)
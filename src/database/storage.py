@@ -0,0 +1,44 @@
+"""Repositories the blueprints read and write through, picked by STORAGE_BACKEND
+
+sql reads and writes the database. memory also writes to the database but
+serves the reads from an indexed copy of the rows in each process, synced
+from the changes feed, for read heavy deployments that can take reads up to
+STORAGE_REFRESH seconds stale from other processes' writes.
+"""
+from src.database.latte import Latte
+from src.database.memory import WriteThroughRepository
+from src.database.project import Project
+from src.database.repository import SqlRepository
+
+BACKENDS = ("sql", "memory")
+
+
+class Storage(object):
+    """
+    Storage
+    the latte and project repositories of the app
+    """
+
+    def __init__(self):
+        self.backend = "sql"
+        self.lattes = SqlRepository(Latte)
+        self.projects = SqlRepository(Project)
+
+    def init_app(self, app):
+        """Build the repositories of the configured backend
+        Args:
+            app: Flask instance
+        """
+        self.backend = app.config.get("STORAGE_BACKEND", "sql")
+        if self.backend not in BACKENDS:
+            raise RuntimeError(f"STORAGE_BACKEND must be one of {', '.join(BACKENDS)}")
+        self.lattes = SqlRepository(Latte)
+        self.projects = SqlRepository(Project)
+        if self.backend == "memory":
+            refresh = app.config.get("STORAGE_REFRESH", 1.0)
+            retention = app.config.get("TOMBSTONE_RETENTION")
+            self.lattes = WriteThroughRepository(self.lattes, refresh, retention)
+            self.projects = WriteThroughRepository(self.projects, refresh, retention)
+
+
+storage = Storage()
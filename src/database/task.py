@@ -0,0 +1,29 @@
+"""This is where the durable background task queue is defined"""
+from sqlalchemy import Column, Float, Index, Integer, String, Text
+
+from src.database.persistence import db
+
+QUEUED = "queued"
+RUNNING = "running"
+FAILED = "failed"
+
+
+class Task(db.Model):
+    """
+    Task
+    a queued call of a registered task, deleted once it succeeds
+    """
+
+    __tablename__ = "task"
+    # Workers look for due tasks by status and time
+    __table_args__ = (Index("ix_task_status_run_at", "status", "run_at"),)
+    id = Column(Integer, primary_key=True)
+    # Name the function was registered under
+    name = Column(String(80), nullable=False)
+    # json list of positional arguments
+    args = Column(Text, nullable=False)
+    status = Column(String(10), nullable=False, default=QUEUED)
+    attempts = Column(Integer, nullable=False, default=0)
+    # Epoch seconds the task is due, for a running task when its lease expires
+    run_at = Column(Float, nullable=False)
+    last_error = Column(String(300))
@@ -0,0 +1,24 @@
+"""Rows owned by a tenant, the subject of the token that wrote them"""
+from sqlalchemy import Column, String
+
+from src.helpers.tenant import current_tenant, default_owner
+
+
+class Owned(object):
+    """
+    Owned
+    mixin of the models partitioned by tenant
+    """
+
+    # jwt 'sub' of the writer, DEFAULT_TENANT with tenancy off and for rows older than it
+    owner = Column(String(128), nullable=False, default=default_owner)
+
+    @classmethod
+    def scope(cls, query):
+        """limit a query to the tenant of the request, outside requests it is left as is"""
+        tenant = current_tenant()
+        return query if tenant is None else query.filter(cls.owner == tenant)
+
+    def in_scope(self):
+        tenant = current_tenant()
+        return tenant is None or self.owner == tenant
@@ -0,0 +1,329 @@
+"""Soft deletes: deleted rows stay as tombstones until the purge removes them
+
+Model.query leaves tombstones out, so the blueprints only ever see live rows
+(of the current tenant, for Owned models).
+changes() pages through everything written since a cursor, tombstones
+included, for clients that sync deltas. updated_at is stamped when the
+transaction commits and the feed stops short of the transactions still
+writing, so a cursor never passes a row that commits later. `./manage.py
+purge` deletes the tombstones older than TOMBSTONE_RETENTION in small batches
+and records the newest one it removed, only the cursors before it may have
+missed a delete.
+"""
+import math
+import time
+
+from flask_sqlalchemy import BaseQuery
+from sqlalchemy import (
+    Column,
+    Float,
+    Index,
+    Integer,
+    String,
+    Table,
+    event,
+    extract,
+    func,
+    or_,
+    select,
+    text,
+)
+from sqlalchemy.orm import Session
+from werkzeug.exceptions import Gone
+
+from src.database.persistence import db, is_postgres
+from src.database.tenant import Owned
+from src.helpers.errors import InvalidPayload
+
+CHANGES_LIMIT = 500
+# session.info key of the rows written by the transaction, table name -> ids
+WRITTEN = "tombstone.written"
+
+# Start of the oldest other transaction of the database holding a transaction id
+OLDEST_WRITER = text(
+    "SELECT extract(epoch FROM coalesce(min(xact_start), clock_timestamp())) "
+    "FROM pg_stat_activity WHERE backend_xid IS NOT NULL "
+    "AND datname = current_database() AND pid <> pg_backend_pid()"
+)
+
+horizon_table = Table(
+    "tombstone_horizon",
+    db.metadata,
+    Column("table_name", String(64), primary_key=True),
+    # updated_at and id of the newest tombstone purged from the table
+    Column("updated_at", Float, nullable=False),
+    Column("id", Integer, nullable=False),
+)
+
+
+class ScopedQuery(BaseQuery):
+    """Query of the rows of the current tenant, live ones only unless with_deleted"""
+
+    live = True
+
+    def get(self, ident):
+        # get() refuses a filtered query and looks up by key alone, check it here
+        row = super(ScopedQuery, self.enable_assertions(False)).get(ident)
+        if row is None or (self.live and row.deleted_at is not None):
+            return None
+        return row if not isinstance(row, Owned) or row.in_scope() else None
+
+
+class LiveQueryProperty(object):
+    """Model.query without the soft deleted rows nor the rows of other tenants"""
+
+    def __get__(self, obj, cls):
+        return cls.with_deleted(live=True).filter(cls.deleted_at.is_(None))
+
+
+class SoftDelete(object):
+    """
+    SoftDelete
+    mixin of the models whose deletes leave a tombstone
+    """
+
+    # Epoch seconds of the commit of the last write, tombstones included, for delta sync
+    updated_at = Column(Float, nullable=False, default=time.time, onupdate=time.time)
+    # Epoch seconds of the delete, null while the row is live
+    deleted_at = Column(Float)
+
+    query = LiveQueryProperty()
+
+    @classmethod
+    def with_deleted(cls, live=False, everyone=False):
+        """query including the tombstones, of every tenant with everyone"""
+        query = ScopedQuery(cls, session=db.session())
+        query.live = live
+        return cls.scope(query) if issubclass(cls, Owned) and not everyone else query
+
+    def soft_delete(self):
+        """turn the row into a tombstone, the caller commits"""
+        self.deleted_at = self.updated_at = time.time()
+
+
+def collection_indexes(table):
+    """Indexes of an Owned SoftDelete table: titles unique among the live rows of a
+    tenant, the sort orders of its pages and changes, and the purge
+    """
+    live, dead = text("deleted_at IS NULL"), text("deleted_at IS NOT NULL")
+    return (
+        Index(
+            f"uq_{table}_owner_title",
+            "owner",
+            "title",
+            unique=True,
+            postgresql_where=live,
+            sqlite_where=live,
+        ),
+        Index(f"ix_{table}_owner_id", "owner", "id"),
+        # Title pages order by the expression of src.database.pagination.sort_column
+        Index(f"ix_{table}_owner_title_id", "owner", text("coalesce(title, '')"), "id"),
+        Index(f"ix_{table}_owner_updated_at_id", "owner", "updated_at", "id"),
+        Index(f"ix_{table}_deleted_at", "deleted_at", postgresql_where=dead, sqlite_where=dead),
+    )
+
+
+def commit_time(conn):
+    """Time to stamp the rows a transaction writes with, right before it commits
+    On Postgres it is read from the database clock, the one watermark() compares
+    with, whatever the clocks of the app servers.
+    Args:
+        conn: connection inside the transaction
+    Returns:
+        epoch seconds
+    """
+    if not is_postgres(conn):
+        return time.time()
+    return float(conn.execute(select([extract("epoch", func.clock_timestamp())])).scalar())
+
+
+def watermark(conn):
+    """Time before which every stamp belongs to a committed transaction
+    On Postgres it is the start of the oldest transaction still writing (one
+    holding a transaction id), whose stamps come later, or the database clock
+    when there is none. Writers don't wait on each other, a long one holds the
+    feed back until it ends instead. The changes query runs after it, so at
+    read committed it sees every transaction that ended before. SQLite
+    serializes writers, nothing is in flight there.
+    Args:
+        conn: connection of the session the feed is read with
+    Returns:
+        epoch seconds, None when every write is committed
+    """
+    if not is_postgres(conn):
+        return None
+    # The activity is cached for the rest of a transaction once read, read it afresh
+    conn.execute(select([func.pg_stat_clear_snapshot()]))
+    return float(conn.execute(OLDEST_WRITER).scalar())
+
+
+def stamp(conn, written):
+    """Set updated_at of the rows written by a transaction to its commit time
+    Args:
+        conn: connection inside the transaction
+        written: table name -> ids of the rows written
+    """
+    now = commit_time(conn)
+    # A fixed order keeps transactions writing several tables from deadlocking
+    for name in sorted(written):
+        table = db.metadata.tables[name]
+        conn.execute(
+            table.update().where(table.c.id.in_(sorted(written[name]))).values(updated_at=now)
+        )
+
+
+def stamp_records(table, conn, records):
+    """Stamp the rows inserted without the ORM, e.g. a bulk import chunk"""
+    stamp(conn, {table: {int(record["id"]) for record in records if record["id"] is not None}})
+
+
+@event.listens_for(Session, "after_flush")
+def _track_written(session, flush_context):
+    for row in (*session.new, *session.dirty):
+        if isinstance(row, SoftDelete) and (row in session.new or session.is_modified(row)):
+            session.info.setdefault(WRITTEN, {}).setdefault(row.__tablename__, set()).add(row.id)
+
+
+@event.listens_for(Session, "before_commit")
+def _stamp_written(session):
+    # Flush first, the commit would flush after this hook
+    session.flush()
+    written = session.info.pop(WRITTEN, None)
+    if written:
+        stamp(session.connection(), written)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_written(session):
+    session.info.pop(WRITTEN, None)
+
+
+def format_cursor(updated_at, row_id):
+    """Cursor of the changes after a row, '<updated_at>:<id>'"""
+    return f"{updated_at!r}:{row_id}"
+
+
+def read_cursor(raw):
+    """Read a cursor written by format_cursor
+    Returns:
+        (updated_at, id)
+    Raises:
+        ValueError: malformed cursor
+    """
+    updated_at, row_id = raw.split(":")
+    cursor = float(updated_at), int(row_id)
+    if not math.isfinite(cursor[0]):
+        raise ValueError(f"{raw!r} is not a cursor")
+    return cursor
+
+
+def purged_through(conn, table):
+    """Position of the newest tombstone purged from a table
+    Args:
+        conn: connection or session
+        table: table name
+    Returns:
+        (updated_at, id), (0.0, 0) when nothing was purged
+    """
+    where = horizon_table.c.table_name == table
+    row = conn.execute(select([horizon_table.c.updated_at, horizon_table.c.id]).where(where))
+    return tuple(row.first() or (0.0, 0))
+
+
+def parse_cursor(raw, table):
+    """Read a changes cursor from a request, as returned by changes()
+    Args:
+        raw: cursor from the query string, None to start from the beginning
+        table: table name of the feed
+    Raises:
+        InvalidPayload: malformed cursor
+        Gone: cursor before a purged tombstone, that delete would be missed
+    """
+    if raw is None:
+        return 0.0, 0
+    try:
+        cursor = read_cursor(raw)
+    except ValueError:
+        raise InvalidPayload({"since": "must be a cursor returned by a previous call"})
+    if cursor < purged_through(db.session, table):
+        raise Gone("Cursor is older than the tombstones, sync again from the beginning")
+    return cursor
+
+
+def changes(model, cursor, limit=CHANGES_LIMIT, everyone=False, owner=None):
+    """Rows written after a cursor, in write order
+    Args:
+        model: SoftDelete model
+        cursor: (updated_at, id) of the last row seen
+        limit: rows per page
+        everyone: rows of every tenant rather than those of the request, e.g. to
+            keep a copy of the table
+        owner: rows of that tenant only, for Owned models read outside requests
+    Returns:
+        live rows, ids of the tombstones and the cursor of the last row
+        (None when nothing changed)
+    """
+    updated_at, row_id = cursor
+    query = model.with_deleted(everyone=everyone).filter(
+        # The first condition alone is the index range, the second skips the seen rows
+        model.updated_at >= updated_at,
+        or_(model.updated_at > updated_at, model.id > row_id),
+    )
+    if owner is not None:
+        query = query.filter(model.owner == owner)
+    until = watermark(db.session.connection())
+    if until is not None:
+        query = query.filter(model.updated_at < until)
+    rows = query.order_by(model.updated_at, model.id).limit(limit).all()
+    live = [row for row in rows if row.deleted_at is None]
+    deleted = [row.id for row in rows if row.deleted_at is not None]
+    last = format_cursor(rows[-1].updated_at, rows[-1].id) if rows else None
+    return live, deleted, last
+
+
+def purge(engine, table, before, batch_size=500, pause=0.5, deadline=None, progress=None):
+    """Delete the tombstones of a table deleted before a time, one batch per transaction
+    Args:
+        engine: SQLAlchemy engine
+        table: SQLAlchemy table with a deleted_at column
+        before: epoch seconds, newer tombstones are kept
+        batch_size: rows per transaction
+        pause: seconds slept between batches
+        deadline: optional epoch seconds to stop at, e.g. the end of the off-peak hours
+        progress: optional callable(table name, rows purged)
+    Returns:
+        number of rows purged
+    """
+    purged = 0
+    ids = (
+        select([table.c.id, table.c.updated_at])
+        .where(table.c.deleted_at < before)
+        .order_by(table.c.deleted_at)
+        .limit(batch_size)
+    )
+    while deadline is None or time.time() < deadline:
+        with engine.begin() as conn:
+            batch = conn.execute(ids).fetchall()
+            if not batch:
+                break
+            # Dependent rows, like latte_ingredient, go with ON DELETE CASCADE
+            conn.execute(table.delete().where(table.c.id.in_([row.id for row in batch])))
+            advance_horizon(conn, table.name, max((row.updated_at, row.id) for row in batch))
+        purged += len(batch)
+        if progress:
+            progress(table.name, purged)
+        time.sleep(pause)
+    return purged
+
+
+def advance_horizon(conn, table, position):
+    """Record a purged tombstone position, if it is past the one recorded"""
+    where = horizon_table.c.table_name == table
+    current = conn.execute(
+        select([horizon_table.c.updated_at, horizon_table.c.id]).where(where).with_for_update()
+    ).first()
+    values = {"updated_at": position[0], "id": position[1]}
+    if current is None:
+        conn.execute(horizon_table.insert().values(table_name=table, **values))
+    elif tuple(current) < position:
+        conn.execute(horizon_table.update().where(where).values(**values))
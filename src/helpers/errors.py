@@ -1,13 +1,10 @@
 """Custom errors goes here"""
+from werkzeug.exceptions import BadRequest
 
 
-class Error(Exception):
-    """Base error class"""
+class InvalidPayload(BadRequest):
+    """400 listing every invalid field of a request payload"""
 
-    pass
-
-
-class InvalidUserInput(Error):
-    """Exception raised for invalid user input"""
-
-    pass
+    def __init__(self, errors):
+        super().__init__()
+        self.errors = errors
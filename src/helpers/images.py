@@ -0,0 +1,393 @@
+"""Thumbnails and blurhash placeholders for project images
+
+Images are fetched once, processed in a small thread pool and kept in a
+content-addressed disk cache:
+    <IMAGE_CACHE_DIR>/<sha256 of the image>/manifest.json, <width>.<format>
+    <IMAGE_CACHE_DIR>/urls/<sha256 of the url>.json -> the image digest
+Requests only ever read the manifests kept in memory, a miss schedules the work
+which loads the manifest from disk or builds it.
+Needs Pillow (`pip install Pillow`), the pipeline stays off without it.
+"""
+import hashlib
+import io
+import ipaddress
+import json
+import math
+import os
+import re
+import socket
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPConnection, HTTPSConnection
+from urllib.parse import urlparse
+from urllib.request import (
+    HTTPHandler,
+    HTTPRedirectHandler,
+    HTTPSHandler,
+    ProxyHandler,
+    build_opener,
+)
+
+from src.helpers.tasks import tasks
+
+DIGEST = re.compile(r"[0-9a-f]{64}")
+VARIANT = re.compile(r"\d+\.(webp|jpeg|png)")
+BASE83 = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~"
+FAILED = "failed"
+# Schemes that reach other hosts, checked against private addresses
+NETWORK_SCHEMES = ("http", "https")
+
+
+def sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def write_atomic(path, data):
+    tmp = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def public_addresses(host, port=None):
+    """Resolve a host, refusing loopback, private, link-local or reserved addresses
+    project images are user input and mustn't reach the internal network
+    Returns:
+        the resolved addresses
+    Raises:
+        ValueError
+    """
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, port)}
+    except (socket.gaierror, UnicodeError) as err:
+        raise ValueError(f"{host} can't be resolved: {err}")
+    for address in addresses:
+        ip = ipaddress.ip_address(address.split("%")[0])
+        ip = getattr(ip, "ipv4_mapped", None) or ip
+        if not ip.is_global or ip.is_multicast:
+            raise ValueError(f"{host} resolves to the non public address {ip}")
+    return sorted(addresses)
+
+
+def check_public(url):
+    """Refuse urls without a host or whose host resolves to a non public address
+    Raises:
+        ValueError
+    """
+    host = urlparse(url).hostname
+    if not host:
+        raise ValueError(f"{url} has no host")
+    public_addresses(host)
+
+
+def connect_public(address, timeout, source_address=None):
+    """socket.create_connection to one of the addresses public_addresses checked
+    Connecting to the hostname would resolve it again, and a rebinding DNS server can
+    answer that second lookup with a private address.
+    """
+    host, port = address
+    error = None
+    for ip in public_addresses(host, port):
+        try:
+            return socket.create_connection((ip, port), timeout, source_address)
+        except OSError as err:
+            error = err
+    raise error
+
+
+class PublicHTTPConnection(HTTPConnection):
+    """HTTPConnection to public addresses only, the Host header keeps the hostname"""
+
+    def __init__(self, *args, **kwargs):
+        super(PublicHTTPConnection, self).__init__(*args, **kwargs)
+        self._create_connection = connect_public
+
+
+class PublicHTTPSConnection(HTTPSConnection):
+    """HTTPSConnection to public addresses only, SNI and the certificate check keep
+    the hostname
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(PublicHTTPSConnection, self).__init__(*args, **kwargs)
+        self._create_connection = connect_public
+
+
+class PublicHTTPHandler(HTTPHandler):
+    def http_open(self, req):
+        return self.do_open(PublicHTTPConnection, req)
+
+
+class PublicHTTPSHandler(HTTPSHandler):
+    def https_open(self, req):
+        return self.do_open(PublicHTTPSConnection, req, context=self._context)
+
+
+class PublicRedirectHandler(HTTPRedirectHandler):
+    """Follow redirects to public hosts only"""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        if urlparse(newurl).scheme not in NETWORK_SCHEMES:
+            raise ValueError(f"{req.full_url} redirects to {newurl}")
+        check_public(newurl)
+        return super(PublicRedirectHandler, self).redirect_request(
+            req, fp, code, msg, headers, newurl
+        )
+
+
+def fetch(url, max_bytes, timeout):
+    """Download an image, refusing anything larger than max_bytes or on a private host
+    The host is resolved once, when connecting, and the socket goes to the checked address.
+    """
+    if urlparse(url).scheme in NETWORK_SCHEMES and not urlparse(url).hostname:
+        raise ValueError(f"{url} has no host")
+    # No proxies, a proxy would resolve the host itself
+    opener = build_opener(
+        ProxyHandler({}), PublicHTTPHandler, PublicHTTPSHandler, PublicRedirectHandler
+    )
+    with opener.open(url, timeout=timeout) as res:
+        data = res.read(max_bytes + 1)
+    if len(data) > max_bytes:
+        raise ValueError(f"{url} is larger than {max_bytes} bytes")
+    return data
+
+
+def base83(value, length):
+    return "".join(BASE83[value // 83 ** (length - i) % 83] for i in range(1, length + 1))
+
+
+def srgb_to_linear(value):
+    value = value / 255
+    return value / 12.92 if value <= 0.04045 else ((value + 0.055) / 1.055) ** 2.4
+
+
+def linear_to_srgb(value):
+    value = min(max(value, 0.0), 1.0)
+    if value <= 0.0031308:
+        return int(value * 12.92 * 255 + 0.5)
+    return int((1.055 * value ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+
+def blurhash(image, x_components=4, y_components=3):
+    """Encode a https://blurha.sh placeholder from a Pillow image"""
+    small = image.convert("RGB")
+    small.thumbnail((32, 32))
+    width, height = small.size
+    raw = [srgb_to_linear(c) for c in small.tobytes()]
+    pixels = list(zip(raw[0::3], raw[1::3], raw[2::3]))
+
+    factors = []
+    for j in range(y_components):
+        for i in range(x_components):
+            norm = (1 if i == 0 and j == 0 else 2) / (width * height)
+            total = [0.0, 0.0, 0.0]
+            for y in range(height):
+                row = math.cos(math.pi * j * y / height)
+                for x in range(width):
+                    basis = norm * row * math.cos(math.pi * i * x / width)
+                    pixel = pixels[y * width + x]
+                    for c in range(3):
+                        total[c] += basis * pixel[c]
+            factors.append(total)
+
+    dc, ac = factors[0], factors[1:]
+    result = base83((x_components - 1) + (y_components - 1) * 9, 1)
+    if ac:
+        quantized = max(0, min(82, int(max(abs(v) for f in ac for v in f) * 166 - 0.5)))
+        maximum = (quantized + 1) / 166
+        result += base83(quantized, 1)
+    else:
+        maximum = 1
+        result += base83(0, 1)
+    r, g, b = (linear_to_srgb(c) for c in dc)
+    result += base83((r << 16) + (g << 8) + b, 4)
+    for factor in ac:
+        r, g, b = (
+            max(0, min(18, int(math.copysign(abs(v / maximum) ** 0.5, v) * 9 + 9.5)))
+            for v in factor
+        )
+        result += base83(r * 19 * 19 + g * 19 + b, 2)
+    return result
+
+
+class ImagePipeline(object):
+    """
+    ImagePipeline
+    serves image variants from disk and builds missing ones in the background
+    """
+
+    def __init__(self):
+        self.directory = None
+        # url -> manifest or (FAILED, when), least recently used first
+        self._manifests = OrderedDict()
+        self.manifest_cache_size = 1024
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def init_app(self, app):
+        self.directory = app.config.get("IMAGE_CACHE_DIR")
+        self.widths = sorted(app.config.get("IMAGE_WIDTHS", [160, 480, 960]))
+        self.format = app.config.get("IMAGE_FORMAT", "webp")
+        self.workers = app.config.get("IMAGE_WORKERS", 2)
+        self.max_bytes = app.config.get("IMAGE_MAX_BYTES", 10 * 1024 * 1024)
+        self.timeout = app.config.get("IMAGE_FETCH_TIMEOUT", 10)
+        self.retry_after = app.config.get("IMAGE_RETRY_AFTER", 300)
+        self.schemes = app.config.get("IMAGE_SCHEMES", ["http", "https"])
+        self.base_url = app.config.get("IMAGE_BASE_URL", "/api/image")
+        self.manifest_cache_size = app.config.get("IMAGE_MANIFEST_CACHE_SIZE", 1024)
+        self.logger = app.logger
+        self._manifests.clear()
+        self._pending.clear()
+        if self.directory:
+            try:
+                import PIL  # noqa: F401
+            except ImportError:
+                app.logger.warning("IMAGE_CACHE_DIR is set but Pillow is not installed")
+                self.directory = None
+                return
+            os.makedirs(os.path.join(self.directory, "urls"), exist_ok=True)
+
+    @property
+    def enabled(self):
+        return bool(self.directory)
+
+    def variants(self, url):
+        """Variants of an image, None until they are ready
+        Never blocks on processing, a miss schedules it instead.
+        Args:
+            url: Project.image
+        Returns:
+            manifest dict or None
+        """
+        if not self.enabled or not url or urlparse(url).scheme not in self.schemes:
+            return None
+        if url in self._pending:
+            return None
+        # No disk reads here, a manifest not in memory is loaded by the worker
+        manifest = self._cached(url)
+        if isinstance(manifest, tuple):
+            # (FAILED, when), retried once retry_after has passed
+            if time.monotonic() - manifest[1] < self.retry_after:
+                return None
+            with self._lock:
+                self._manifests.pop(url, None)
+            manifest = None
+        if manifest is None:
+            self.schedule(url)
+        return manifest
+
+    def schedule(self, url):
+        with self._lock:
+            if url in self._pending:
+                return
+            self._pending.add(url)
+            if self._executor is None:
+                # Not built in init_app, a pool made before gunicorn forks has no threads
+                self._executor = ThreadPoolExecutor(self.workers, "image")
+            self._executor.submit(self._run, url)
+
+    def wait(self):
+        """Block until the scheduled work is done, for tests and scripts"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=True)
+
+    def path(self, digest, name):
+        """File of a variant, None for names that are not cache entries"""
+        if not self.enabled or not DIGEST.fullmatch(digest) or not VARIANT.fullmatch(name):
+            return None
+        path = os.path.join(self.directory, digest, name)
+        return path if os.path.exists(path) else None
+
+    def _load(self, url):
+        try:
+            with open(self._url_path(url)) as f:
+                digest = json.load(f)["digest"]
+            with open(os.path.join(self.directory, digest, "manifest.json")) as f:
+                return json.load(f)
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _cached(self, url):
+        with self._lock:
+            manifest = self._manifests.get(url)
+            if manifest is not None:
+                self._manifests.move_to_end(url)
+            return manifest
+
+    def _remember(self, url, manifest):
+        with self._lock:
+            self._manifests[url] = manifest
+            self._manifests.move_to_end(url)
+            while len(self._manifests) > self.manifest_cache_size:
+                self._manifests.popitem(last=False)
+
+    def _url_path(self, url):
+        return os.path.join(self.directory, "urls", sha256(url.encode()) + ".json")
+
+    def _run(self, url):
+        try:
+            self._remember(url, self._load(url) or self.process(url))
+        except Exception as err:
+            self.logger.warning("Image %s failed: %s", url, err)
+            self._remember(url, (FAILED, time.monotonic()))
+        finally:
+            with self._lock:
+                self._pending.discard(url)
+
+    def process(self, url):
+        """Fetch an image and write its thumbnails and manifest
+        Returns:
+            the manifest
+        """
+        data = fetch(url, self.max_bytes, self.timeout)
+        digest = sha256(data)
+        folder = os.path.join(self.directory, digest)
+        manifest_path = os.path.join(folder, "manifest.json")
+        if not os.path.exists(manifest_path):
+            os.makedirs(folder, exist_ok=True)
+            manifest = self.render(data, digest, folder)
+            write_atomic(manifest_path, json.dumps(manifest).encode())
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        write_atomic(self._url_path(url), json.dumps({"digest": digest}).encode())
+        return manifest
+
+    def render(self, data, digest, folder):
+        from PIL import Image
+
+        image = Image.open(io.BytesIO(data))
+        width, height = image.size
+        # JPEGs can decode straight at a reduced scale
+        image.draft("RGB", (self.widths[-1], self.widths[-1]))
+        alpha = "A" in image.getbands() and self.format != "jpeg"
+        image = image.convert("RGBA" if alpha else "RGB")
+        thumbnails = []
+        for target in [w for w in self.widths if w < width] or [width]:
+            size = (target, max(1, round(height * target / width)))
+            name = f"{target}.{self.format}"
+            buffer = io.BytesIO()
+            image.resize(size, Image.LANCZOS).save(buffer, self.format.upper(), quality=80)
+            write_atomic(os.path.join(folder, name), buffer.getvalue())
+            thumbnails.append(
+                {"width": size[0], "height": size[1], "url": f"{self.base_url}/{digest}/{name}"}
+            )
+        return {
+            "width": width,
+            "height": height,
+            "blurhash": blurhash(image),
+            "thumbnails": thumbnails,
+        }
+
+
+images = ImagePipeline()
+
+
+@tasks.task("images.warm")
+def warm(url):
+    """Start building the variants of an image"""
+    images.variants(url)
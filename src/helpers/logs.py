@@ -0,0 +1,142 @@
+"""Structured, sampled and non-blocking logging for the app logger"""
+import json
+import logging
+import queue
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from flask import g, has_request_context, request
+from flask.logging import default_handler
+
+REQUEST_ID_HEADER = "X-Request-ID"
+_listeners = []
+
+
+class RequestIdFilter(logging.Filter):
+    """Tag records with the id of the request that emitted them"""
+
+    def filter(self, record):
+        record.request_id = getattr(g, "request_id", None) if has_request_context() else None
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Let at most limit records of a message type through per interval
+    The type is the message template, or the class of a logged exception,
+    so an error storm of one kind cannot flood the output.
+    """
+
+    def __init__(self, limit=10, interval=60.0):
+        super().__init__()
+        self.limit = limit
+        self.interval = interval
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def message_type(record):
+        if isinstance(record.msg, BaseException):
+            return type(record.msg).__name__
+        return str(record.msg)[:200]
+
+    def filter(self, record):
+        key = (record.name, record.levelno, self.message_type(record))
+        now = time.monotonic()
+        with self._lock:
+            start, count, suppressed = self._windows.get(key, (now, 0, 0))
+            if now - start >= self.interval:
+                # Report what the previous window dropped on the first record through
+                record.suppressed = suppressed
+                start, count, suppressed = now, 0, 0
+            if count >= self.limit:
+                self._windows[key] = (start, count, suppressed + 1)
+                return False
+            if len(self._windows) > 10000:
+                self._windows.clear()
+            self._windows[key] = (start, count + 1, suppressed)
+            return True
+
+
+class DroppingQueueHandler(QueueHandler):
+    """Queue handler that drops records instead of blocking when the queue is full"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line"""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", None),
+        }
+        if getattr(record, "suppressed", 0):
+            entry["suppressed"] = record.suppressed
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def init_logging(app):
+    """Replace Flask's default handler according to the app configuration
+    Args:
+        app: Flask instance
+    """
+    handler = logging.StreamHandler(sys.stdout)
+    if app.config.get("LOG_JSON", False):
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(
+            logging.Formatter("[%(asctime)s] %(levelname)s %(request_id)s %(name)s: %(message)s")
+        )
+
+    if app.config.get("LOG_ASYNC", False):
+        log_queue = queue.Queue(app.config.get("LOG_QUEUE_SIZE", 10000))
+        listener = QueueListener(log_queue, handler)
+        listener.start()
+        _listeners.append(listener)
+        front = DroppingQueueHandler(log_queue)
+    else:
+        front = handler
+
+    front.addFilter(RequestIdFilter())
+    front.addFilter(
+        SamplingFilter(
+            app.config.get("LOG_SAMPLE_LIMIT", 10), app.config.get("LOG_SAMPLE_INTERVAL", 60.0)
+        )
+    )
+    app.logger.removeHandler(default_handler)
+    app.logger.addHandler(front)
+    app.logger.setLevel(app.config.get("LOG_LEVEL", "INFO"))
+
+    @app.before_request
+    def _assign_request_id():
+        g.request_id = request.headers.get(REQUEST_ID_HEADER, "")[:200] or uuid.uuid4().hex
+
+    @app.after_request
+    def _echo_request_id(response):
+        response.headers[REQUEST_ID_HEADER] = g.get("request_id", "")
+        return response
+
+
+def after_fork():
+    """Restart the writer threads, which do not survive a fork"""
+    for listener in _listeners:
+        listener._thread = None
+        listener.start()
@@ -0,0 +1,87 @@
+"""Cup layouts computed from the parts of a latte's ingredients"""
+from functools import lru_cache
+
+from src.helpers.errors import InvalidPayload
+
+DEFAULT_VOLUME = 100.0
+MAX_VOLUME = 10000.0
+
+
+def parse_volume(raw):
+    """Read the volume query argument
+    Args:
+        raw: query string value or None
+    Raises:
+        InvalidPayload when it is not a number in (0, MAX_VOLUME]
+    Returns:
+        volume as a float
+    """
+    if raw is None:
+        return DEFAULT_VOLUME
+    try:
+        volume = float(raw)
+    except ValueError:
+        volume = 0
+    if not 0 < volume <= MAX_VOLUME:
+        raise InvalidPayload({"volume": f"must be a number above 0 and up to {MAX_VOLUME:g}"})
+    return volume
+
+
+def version(ingredients):
+    """Hashable form of an ingredient list, a new value whenever the latte's recipe changes"""
+    if not isinstance(ingredients, list):
+        return ()
+    return tuple(
+        (text(item.get("name")), text(item.get("color")), positive(item.get("parts")))
+        for item in ingredients
+        if isinstance(item, dict)
+    )
+
+
+def text(value):
+    return value if isinstance(value, str) else None
+
+
+def positive(part):
+    # Missing or malformed parts take no room in the cup
+    if isinstance(part, (int, float)) and not isinstance(part, bool) and part > 0:
+        return part
+    return 0
+
+
+@lru_cache(maxsize=4096)
+def layers(key, volume):
+    """Ratio, volume and stacking offset of every ingredient
+    Args:
+        key: version() of the ingredients
+        volume: cup volume to split
+    Returns:
+        tuple of layer dicts, shared between callers so treat them as read only
+    """
+    total = sum(part for _, _, part in key)
+    result, offset = [], 0.0
+    for name, color, part in key:
+        ratio = part / total if total else 0.0
+        result.append(
+            {
+                "name": name,
+                "color": color,
+                "parts": part,
+                "ratio": round(ratio, 4),
+                "percent": round(ratio * 100, 2),
+                "offset": round(offset * 100, 2),
+                "volume": round(ratio * volume, 2),
+            }
+        )
+        offset += ratio
+    return tuple(result)
+
+
+def recipe(latte, volume):
+    """Recipe of a latte or latte snapshot for a cup of the given volume"""
+    return {
+        "id": latte.id,
+        "title": latte.title,
+        "volume": volume,
+        "layers": layers(version(latte.long()["ingredients"]), volume),
+    }
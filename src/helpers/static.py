@@ -0,0 +1,172 @@
+"""Static snapshot of the public read API, for a CDN or nginx to serve
+
+The resources an anonymous client reads without ?owner=, the rows of
+DEFAULT_TENANT, are rendered to JSON files next to their precompressed
+variants:
+    <STATIC_EXPORT_DIR>/api/latte.json, .json.gz, .json.br
+    <STATIC_EXPORT_DIR>/api/latte/<id>.json, ...
+    <STATIC_EXPORT_DIR>/api/project.json, api/project/<id>.json, ...
+A build only renders the rows written since the previous one, read from the
+changes feed, and removes the files of deleted rows. Every commit touching a
+latte or project queues a build. Brotli variants need `pip install brotli`.
+"""
+import fcntl
+import glob
+import gzip
+import json
+import os
+
+from flask import json as flask_json
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from src.database.latte import Latte
+from src.database.persistence import db
+from src.database.project import Project
+from src.database.tombstone import changes, purged_through, read_cursor
+from src.helpers.images import write_atomic
+from src.helpers.tasks import tasks
+
+QUEUED = "static_build_queued"
+# The bodies of GET /api/<name> and GET /api/<name>/<id>
+RESOURCES = {
+    "latte": (
+        Latte,
+        lambda rows: {"lattes": [row.long() for row in rows]},
+        lambda row: {"lattes": row.long()},
+    ),
+    "project": (Project, lambda rows: [row.to_json for row in rows], lambda row: row.to_json),
+}
+
+
+class StaticExport(object):
+    """
+    StaticExport
+    renders the public GET endpoints to files, incrementally
+    """
+
+    def __init__(self):
+        self.directory = None
+        self.app = None
+        self.owner = None
+        self.brotli = None
+
+    def init_app(self, app):
+        self.directory = app.config.get("STATIC_EXPORT_DIR")
+        # The tenant of the anonymous reads, and of every write with tenancy off
+        self.owner = app.config.get("DEFAULT_TENANT", "")
+        self.app = app
+        if self.directory:
+            try:
+                import brotli
+            except ImportError:
+                brotli = None
+            self.brotli = brotli
+
+    @property
+    def enabled(self):
+        return bool(self.directory)
+
+    def build(self, full=False):
+        """Render the resources written since the previous build
+        Args:
+            full: render everything and drop the files of rows that no longer exist
+        Returns:
+            dict of table name to the number of files written or removed
+        """
+        os.makedirs(os.path.join(self.directory, "api"), exist_ok=True)
+        with open(os.path.join(self.directory, ".lock"), "w") as lock:
+            # One build at a time, across processes too
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            state = self._load_state()
+            # Outside requests nothing is scoped, the queries pick the owner themselves
+            with self.app.app_context():
+                counts = {
+                    name: self._build_table(name, None if full else state.get(name), state)
+                    for name in RESOURCES
+                }
+            write_atomic(self._path(".build"), json.dumps(state).encode())
+        return counts
+
+    def _build_table(self, name, cursor, state):
+        model, render_all, render_one = RESOURCES[name]
+        # The feed would miss the deletes of the tombstones purged since
+        if cursor is not None and tuple(cursor) < purged_through(db.session, name):
+            cursor = None
+        done, live = 0, set()
+        while True:
+            rows, deleted, last = changes(model, tuple(cursor or (0.0, 0)), owner=self.owner)
+            if last is None:
+                break
+            for row in rows:
+                self._write(f"api/{name}/{row.id}", render_one(row))
+                live.add(row.id)
+            for row_id in deleted:
+                self._remove(f"api/{name}/{row_id}")
+            done += len(rows) + len(deleted)
+            cursor = read_cursor(last)
+        if cursor is None or done:
+            if cursor is None:
+                done += self._remove_stale(name, live)
+            rows = model.query.filter(model.owner == self.owner).order_by(model.id).all()
+            self._write(f"api/{name}", render_all(rows))
+        state[name] = cursor
+        return done
+
+    def _remove_stale(self, name, live):
+        rendered = glob.glob(self._path(f"api/{name}/*.json"))
+        stale = {int(os.path.basename(path).split(".")[0]) for path in rendered} - live
+        for row_id in stale:
+            self._remove(f"api/{name}/{row_id}")
+        return len(stale)
+
+    def _write(self, resource, body):
+        path = self._path(f"{resource}.json")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = flask_json.dumps(body).encode()
+        write_atomic(path, data)
+        write_atomic(path + ".gz", gzip.compress(data, mtime=0))
+        if self.brotli is not None:
+            write_atomic(path + ".br", self.brotli.compress(data))
+
+    def _remove(self, resource):
+        for suffix in (".json", ".json.gz", ".json.br"):
+            try:
+                os.remove(self._path(resource + suffix))
+            except FileNotFoundError:
+                pass
+
+    def _load_state(self):
+        try:
+            with open(self._path(".build")) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+
+static_export = StaticExport()
+
+
+@tasks.task("static.build")
+def build():
+    """Render the resources written by the commit that queued it"""
+    static_export.build()
+
+
+@event.listens_for(Session, "before_flush")
+def _queue_build(session, flush_context, instances):
+    if not static_export.enabled or session.info.get(QUEUED):
+        return
+    tables = {getattr(row, "__tablename__", None) for row in (*session.new, *session.dirty)}
+    if tables & set(RESOURCES):
+        session.info[QUEUED] = True
+        tasks.on_commit(session, "static.build")
+
+
+@event.listens_for(Session, "after_commit")
+@event.listens_for(Session, "after_rollback")
+def _reset_queued(session):
+    session.info.pop(QUEUED, None)
@@ -0,0 +1,282 @@
+"""Background tasks, run after the database commit and off the request path
+
+TASKS_BACKEND picks where queued tasks live:
+    thread    a thread pool per process, tasks die with the process
+    database  rows of the task table, inserted in the same transaction as the
+              change that queued them and run by `./manage.py worker` (or by
+              the web processes with TASKS_EMBEDDED_WORKER)
+Failed tasks are retried with exponential backoff up to TASKS_MAX_ATTEMPTS.
+"""
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+
+from src.database.persistence import db
+from src.database.task import FAILED, QUEUED, RUNNING, Task
+
+BACKENDS = ("thread", "database")
+PENDING = "tasks"
+WAKE = "tasks_wake"
+
+
+class TaskQueue(object):
+    """
+    TaskQueue
+    registry of task functions and the backend that runs them
+    """
+
+    def __init__(self):
+        self.functions = {}
+        self.backend = "thread"
+        self.app = None
+        self._executor = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._counts = dict.fromkeys(
+            ["queued", "running", "retrying", "succeeded", "failed", "dropped"], 0
+        )
+
+    def init_app(self, app):
+        self.backend = app.config.get("TASKS_BACKEND", "thread")
+        if self.backend not in BACKENDS:
+            raise RuntimeError(f"TASKS_BACKEND must be one of {', '.join(BACKENDS)}")
+        self.app = app
+        self.logger = app.logger
+        self.workers = app.config.get("TASKS_WORKERS", 4)
+        self.max_queue = app.config.get("TASKS_MAX_QUEUE", 10000)
+        self.max_attempts = app.config.get("TASKS_MAX_ATTEMPTS", 5)
+        self.backoff = app.config.get("TASKS_RETRY_BACKOFF", 1.0)
+        self.max_backoff = app.config.get("TASKS_MAX_BACKOFF", 300.0)
+        self.lease = app.config.get("TASKS_LEASE", 300.0)
+        self.poll_interval = app.config.get("TASKS_POLL_INTERVAL", 1.0)
+
+    def task(self, name):
+        """Register a function as a task, its arguments must be JSON serializable"""
+
+        def register(f):
+            self.functions[name] = f
+            return f
+
+        return register
+
+    def on_commit(self, session, name, *args):
+        """Queue a task to run once the session commits, never if it rolls back
+        Args:
+            session: session of the write the task follows
+            name: registered task name
+            args: positional arguments of the task
+        """
+        if name not in self.functions:
+            raise KeyError(f"No task registered as {name}")
+        if self.backend == "database":
+            session.add(Task(name=name, args=json.dumps(args), status=QUEUED, run_at=time.time()))
+            session.info[WAKE] = True
+        else:
+            session.info.setdefault(PENDING, []).append((name, args))
+
+    def enqueue(self, name, *args):
+        """Queue a task right away, outside of any transaction"""
+        if name not in self.functions:
+            raise KeyError(f"No task registered as {name}")
+        if self.backend == "database":
+            with db.engine.begin() as conn:
+                conn.execute(
+                    Task.__table__.insert(),
+                    {
+                        "name": name,
+                        "args": json.dumps(args),
+                        "status": QUEUED,
+                        "attempts": 0,
+                        "run_at": time.time(),
+                    },
+                )
+            self._wake.set()
+        else:
+            self.submit(name, args)
+
+    def retry_delay(self, attempts):
+        return min(self.backoff * 2 ** (attempts - 1), self.max_backoff)
+
+    def _count(self, key, delta=1):
+        with self._lock:
+            self._counts[key] += delta
+
+    def stats(self):
+        """Queue depth and outcomes, for the database backend depth is read from the table"""
+        with self._lock:
+            stats = dict(self._counts, backend=self.backend)
+        if self.backend == "database":
+            counts = dict(
+                db.session.query(Task.status, func.count(Task.id)).group_by(Task.status).all()
+            )
+            stats.update(
+                queued=counts.get(QUEUED, 0),
+                running=counts.get(RUNNING, 0),
+                failed=counts.get(FAILED, 0),
+            )
+        return stats
+
+    # thread backend
+
+    def submit(self, name, args, attempt=1):
+        with self._lock:
+            if self._counts["queued"] >= self.max_queue:
+                self._counts["dropped"] += 1
+                self.logger.warning("Task queue is full, dropped %s", name)
+                return
+            self._counts["queued"] += 1
+            if self._executor is None:
+                # Created on first use so forked workers get their own threads
+                self._executor = ThreadPoolExecutor(self.workers, "task")
+            self._executor.submit(self._run, name, args, attempt)
+
+    def _run(self, name, args, attempt):
+        with self._lock:
+            self._counts["queued"] -= 1
+            self._counts["running"] += 1
+        try:
+            with self.app.app_context():
+                self.functions[name](*args)
+            self._count("succeeded")
+        except Exception as err:
+            if attempt < self.max_attempts:
+                delay = self.retry_delay(attempt)
+                self.logger.warning("Task %s failed, retrying in %ss: %s", name, delay, err)
+                self._count("retrying")
+                timer = threading.Timer(delay, self._retry, (name, args, attempt + 1))
+                timer.daemon = True
+                timer.start()
+            else:
+                self.logger.error("Task %s failed after %s attempts: %s", name, attempt, err)
+                self._count("failed")
+        finally:
+            self._count("running", -1)
+
+    def _retry(self, name, args, attempt):
+        self.submit(name, args, attempt)
+        self._count("retrying", -1)
+
+    def wait(self, timeout=10.0):
+        """Block until the thread backend is idle, for tests and scripts
+        Returns:
+            True when idle, False on timeout
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._lock:
+                busy = self._counts["queued"] + self._counts["running"] + self._counts["retrying"]
+            if not busy:
+                return True
+            time.sleep(0.01)
+        return False
+
+    # database backend
+
+    def run_worker(self, stop=None):
+        """Run due tasks from the table until stop is set
+        Errors of the table itself, e.g. the database restarting, are logged and
+        retried with the task backoff rather than ending the worker.
+        """
+        stop = stop or threading.Event()
+        failures = 0
+        while not stop.is_set():
+            try:
+                ran = self.run_due()
+            except Exception:
+                failures += 1
+                delay = self.retry_delay(failures)
+                self.logger.exception("Task worker failed, retrying in %ss", delay)
+                stop.wait(delay)
+                continue
+            failures = 0
+            if not ran:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+
+    def start_worker(self):
+        """Run the worker on a daemon thread of this process"""
+        thread = threading.Thread(target=self.run_worker, name="task-worker", daemon=True)
+        thread.start()
+        return thread
+
+    def run_due(self, limit=10):
+        """Claim and run the due tasks, including those whose lease expired
+        Returns:
+            number of tasks run
+        """
+        with self.app.app_context():
+            try:
+                due = (
+                    db.session.query(Task.id, Task.status, Task.run_at)
+                    .filter(Task.status.in_([QUEUED, RUNNING]), Task.run_at <= time.time())
+                    .order_by(Task.run_at)
+                    .limit(limit)
+                    .all()
+                )
+                db.session.commit()
+                ran = 0
+                for task_id, status, run_at in due:
+                    if self._claim(task_id, status, run_at):
+                        self._execute(task_id)
+                        ran += 1
+                return ran
+            finally:
+                # Rolls back whatever a failure left open
+                db.session.remove()
+
+    def _claim(self, task_id, status, run_at):
+        # Only one worker sees the row unchanged, the others match nothing
+        claimed = Task.query.filter(
+            Task.id == task_id, Task.status == status, Task.run_at == run_at
+        ).update(
+            {"status": RUNNING, "run_at": time.time() + self.lease, "attempts": Task.attempts + 1},
+            synchronize_session=False,
+        )
+        db.session.commit()
+        return claimed == 1
+
+    def _execute(self, task_id):
+        task = Task.query.get(task_id)
+        try:
+            self.functions[task.name](*json.loads(task.args))
+        except Exception as err:
+            db.session.rollback()
+            task = Task.query.get(task_id)
+            task.last_error = str(err)[:300]
+            if task.attempts >= self.max_attempts:
+                self.logger.error(
+                    "Task %s failed after %s attempts: %s", task.name, task.attempts, err
+                )
+                task.status = FAILED
+                self._count("failed")
+            else:
+                delay = self.retry_delay(task.attempts)
+                self.logger.warning("Task %s failed, retrying in %ss: %s", task.name, delay, err)
+                task.status = QUEUED
+                task.run_at = time.time() + delay
+            db.session.commit()
+            return
+        Task.query.filter(Task.id == task_id).delete(synchronize_session=False)
+        db.session.commit()
+        self._count("succeeded")
+
+
+tasks = TaskQueue()
+
+
+@event.listens_for(Session, "after_commit")
+def _run_committed(session):
+    for name, args in session.info.pop(PENDING, ()):
+        tasks.submit(name, args)
+    if session.info.pop(WAKE, False):
+        tasks._wake.set()
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_rolled_back(session):
+    session.info.pop(PENDING, None)
+    session.info.pop(WAKE, None)
@@ -0,0 +1,31 @@
+"""Tenant of the current request, the owner of the rows it reads and writes"""
+from flask import current_app, has_request_context, request
+
+# Key of the tenant in the WSGI environ, set by requires_auth
+TENANT = "mothership.tenant"
+
+
+def current_tenant():
+    """Tenant of the current request
+    With TENANCY_ENABLED, the subject of the token once requires_auth accepted
+    it, otherwise the owner query parameter or DEFAULT_TENANT for public reads.
+    Without it every request reads and writes the rows of DEFAULT_TENANT.
+    Returns:
+        tenant, None outside of requests (manage.py, workers) which see every tenant
+    """
+    if not has_request_context():
+        return None
+    config = current_app.config
+    if not config.get("TENANCY_ENABLED", False):
+        return config.get("DEFAULT_TENANT", "")
+    if TENANT in request.environ:
+        return request.environ[TENANT]
+    return request.args.get("owner") or config.get("DEFAULT_TENANT", "")
+
+
+def default_owner():
+    """Owner of a new row, the tenant of the request or DEFAULT_TENANT"""
+    tenant = current_tenant()
+    if tenant is None:
+        return current_app.config.get("DEFAULT_TENANT", "")
+    return tenant
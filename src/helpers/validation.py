@@ -0,0 +1,206 @@
+"""Declarative request payload schemas, compiled once into validators"""
+import json
+import re
+from functools import wraps
+
+from flask import request
+
+from src.helpers.errors import InvalidPayload
+
+TYPE_NAMES = {str: "a string", list: "a list", dict: "an object", bool: "a boolean"}
+
+
+class Field(object):
+    """
+    Field
+    declares the accepted type and constraints of one payload value
+    """
+
+    def __init__(
+        self,
+        kind,
+        required=True,
+        nullable=False,
+        min_length=None,
+        max_length=None,
+        pattern=None,
+        minimum=None,
+        items=None,
+        max_json_length=None,
+    ):
+        self.kind = kind
+        self.required = required
+        self.nullable = nullable
+        self.min_length = min_length
+        self.max_length = max_length
+        self.pattern = re.compile(pattern) if pattern else None
+        self.minimum = minimum
+        self.items = items
+        self.max_json_length = max_json_length
+        self.check = self.compile()
+
+    def compile(self):
+        """Build the check for this field from only the constraints it uses
+        Returns:
+            check(value, path, errors), True when the value is valid
+        """
+        constraints = [
+            (self.min_length, lambda m: length_check(m, "at least", lambda n, m: n >= m)),
+            (self.max_length, lambda m: length_check(m, "at most", lambda n, m: n <= m)),
+            (self.pattern, pattern_check),
+            (self.minimum, minimum_check),
+            (self.items, lambda items: items_check(items.check)),
+            (self.max_json_length, json_length_check),
+        ]
+        checks = [self.type_check()]
+        checks += [build(option) for option, build in constraints if option is not None]
+        nullable = self.nullable
+
+        def check(value, path, errors):
+            if value is None:
+                if not nullable:
+                    errors[path] = "must not be null"
+                return nullable
+            for step in checks:
+                if not step(value, path, errors):
+                    return False
+            return True
+
+        return check
+
+    def type_check(self):
+        kind = self.kind
+        if kind is float:
+            # JSON numbers, bool is an int subclass but never a number here
+            def check(value, path, errors):
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    return True
+                errors[path] = "must be a number"
+                return False
+
+            return check
+
+        name = TYPE_NAMES.get(kind, kind.__name__)
+
+        def check(value, path, errors):
+            if isinstance(value, kind):
+                return True
+            errors[path] = f"must be {name}"
+            return False
+
+        return check
+
+
+def length_check(limit, word, compare):
+    def check(value, path, errors):
+        if compare(len(value), limit):
+            return True
+        errors[path] = f"must have {word} {limit} characters or items"
+        return False
+
+    return check
+
+
+def pattern_check(pattern):
+    def check(value, path, errors):
+        if pattern.fullmatch(value):
+            return True
+        errors[path] = "contains invalid characters"
+        return False
+
+    return check
+
+
+def minimum_check(minimum):
+    def check(value, path, errors):
+        if value >= minimum:
+            return True
+        errors[path] = f"must be at least {minimum}"
+        return False
+
+    return check
+
+
+def items_check(item_check):
+    def check(value, path, errors):
+        valid = True
+        for index, item in enumerate(value):
+            valid = item_check(item, f"{path}[{index}]", errors) and valid
+        return valid
+
+    return check
+
+
+def json_length_check(limit):
+    def check(value, path, errors):
+        if len(json.dumps(value)) <= limit:
+            return True
+        errors[path] = f"must serialize to at most {limit} characters"
+        return False
+
+    return check
+
+
+class Schema(object):
+    """
+    Schema
+    declares the fields of a JSON object, usable as a Field for nested objects
+    """
+
+    def __init__(self, **fields):
+        self.fields = fields
+        self.check = self.compile()
+
+    def compile(self):
+        fields = list(self.fields.items())
+
+        def check(value, path, errors, partial=False):
+            if not isinstance(value, dict):
+                errors[path or "payload"] = "must be an object"
+                return False
+            valid = True
+            for name, field in fields:
+                field_path = f"{path}.{name}" if path else name
+                if name not in value:
+                    if field.required and not partial:
+                        errors[field_path] = "is required"
+                        valid = False
+                    continue
+                valid = field.check(value[name], field_path, errors) and valid
+            return valid
+
+        return check
+
+    def validate(self, data, partial=False):
+        """Validate a payload and keep only the declared fields
+        Args:
+            data: decoded JSON body
+            partial: only validate the fields that are present, at least one is needed
+        Raises:
+            InvalidPayload listing every invalid field
+        Returns:
+            the declared fields present in data
+        """
+        errors = {}
+        self.check(data, "", errors, partial)
+        if not errors and partial and not any(name in data for name in self.fields):
+            errors["payload"] = f"must contain one of {', '.join(self.fields)}"
+        if errors:
+            raise InvalidPayload(errors)
+        return {name: data[name] for name in self.fields if name in data}
+
+
+def validate(schema, partial=False):
+    """Payload validation decorator for routes, goes below requires_auth
+    The wrapped view receives the validated payload as the body argument.
+    """
+
+    def validate_decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            body = schema.validate(request.get_json(silent=True), partial=partial)
+            return f(*args, body=body, **kwargs)
+
+        return wrapper
+
+    return validate_decorator
@@ -0,0 +1,143 @@
+"""Adaptive concurrency limit that sheds load instead of queuing it"""
+import math
+import threading
+import time
+from functools import wraps
+
+from flask import request
+
+READ_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+class Overloaded(Exception):
+    """Overloaded Exception
+    Raised when the worker is at its concurrency limit, carries the seconds to wait
+    """
+
+    def __init__(self, description, retry_after, code=503):
+        self.description = description
+        self.retry_after = retry_after
+        self.code = code
+
+
+class AdaptiveLimiter(object):
+    """
+    AdaptiveLimiter
+    AIMD concurrency limit driven by request latency, which is dominated by
+    the database. Writes may only use part of the limit so reads keep headroom.
+    """
+
+    def __init__(
+        self,
+        limit=20,
+        min_limit=2,
+        max_limit=100,
+        latency_target=0.25,
+        backoff=0.9,
+        write_share=0.5,
+    ):
+        self.limit = float(limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target = latency_target
+        self.backoff = backoff
+        self.write_share = write_share
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+
+    def try_acquire(self, write=False):
+        """Take a slot if the current limit allows it
+        Args:
+            write: writes only get write_share of the limit
+        Returns:
+            True when admitted
+        """
+        with self._lock:
+            limit = self.limit * self.write_share if write else self.limit
+            if self.in_flight >= max(limit, 1):
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self, latency, failed=False, now=None):
+        """Give the slot back and adapt the limit
+        Args:
+            latency: seconds the request held the slot
+            failed: the request hit a database error
+            now: current time, defaults to time.monotonic()
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self.in_flight -= 1
+            if failed or latency > self.latency_target:
+                # Back off at most once per target interval so a single slow
+                # batch does not collapse the limit to its minimum
+                if now - self._last_decrease >= self.latency_target:
+                    self.limit = max(self.min_limit, self.limit * self.backoff)
+                    self._last_decrease = now
+            elif self.in_flight * 2 >= self.limit:
+                # Only grow while the limit is actually being used
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+
+class Admission(object):
+    """
+    Admission
+    per worker admission control configured from the app configuration
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.retry_after = 1
+        self.limiter = AdaptiveLimiter()
+
+    def init_app(self, app):
+        """Configure the limiter from the app configuration
+        Args:
+            app: Flask instance
+        """
+        self.enabled = app.config.get("ADMISSION_ENABLED", False)
+        self.retry_after = app.config.get("ADMISSION_RETRY_AFTER", 1)
+        self.limiter = AdaptiveLimiter(
+            limit=app.config.get("ADMISSION_INITIAL_LIMIT", 20),
+            min_limit=app.config.get("ADMISSION_MIN_LIMIT", 2),
+            max_limit=app.config.get("ADMISSION_MAX_LIMIT", 100),
+            latency_target=app.config.get("ADMISSION_LATENCY_TARGET", 0.25),
+            write_share=app.config.get("ADMISSION_WRITE_SHARE", 0.5),
+        )
+
+
+admission = Admission()
+
+
+def admit():
+    """Admission control decorator for routes, sheds excess requests with 503
+    Goes under requires_auth: the latency it adapts to is the handler's, not the
+    token verification's.
+    """
+
+    def admit_decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            if not admission.enabled:
+                return f(*args, **kwargs)
+
+            limiter = admission.limiter
+            if not limiter.try_acquire(write=request.method not in READ_METHODS):
+                raise Overloaded("Server is overloaded.", math.ceil(admission.retry_after))
+
+            start = time.monotonic()
+            failed = False
+            try:
+                response = f(*args, **kwargs)
+            except Exception as err:
+                failed = getattr(err, "code", None) in (500, 502)
+                raise
+            finally:
+                limiter.release(time.monotonic() - start, failed=failed)
+            return response
+
+        return wrapper
+
+    return admit_decorator
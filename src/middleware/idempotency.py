@@ -0,0 +1,181 @@
+"""Idempotency-Key support so POST retries replay the first response"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import Response, current_app, request
+
+from src.helpers.tenant import TENANT
+
+HEADER = "Idempotency-Key"
+PENDING = b""
+
+
+class IdempotencyError(Exception):
+    """IdempotencyError Exception
+    Raised when a key is reused for a different request or is still running
+    """
+
+    def __init__(self, description, code):
+        self.description = description
+        self.code = code
+
+
+class MemoryStore(object):
+    """Per process store of key -> (fingerprint, encoded response, expiry)"""
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def reserve(self, key, fingerprint, ttl):
+        """Claim a key for a running request
+        Returns:
+            None if the key was claimed, otherwise (fingerprint, stored response)
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] > now:
+                return entry[0], entry[1]
+            self._entries[key] = (fingerprint, PENDING, now + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+            return None
+
+    def save(self, key, fingerprint, response, ttl):
+        with self._lock:
+            self._entries[key] = (fingerprint, response, time.monotonic() + ttl)
+
+    def release(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class RedisStore(object):
+    """Store shared by every worker through a redis compatible client"""
+
+    def __init__(self, client, prefix="idempotency:"):
+        self.client = client
+        self.prefix = prefix
+
+    def reserve(self, key, fingerprint, ttl):
+        key = self.prefix + key
+        if self.client.set(key, fingerprint.encode() + b"\n", px=int(ttl * 1000), nx=True):
+            return None
+        stored = self.client.get(key) or b"\n"
+        stored_fingerprint, _, response = stored.partition(b"\n")
+        return stored_fingerprint.decode(), response
+
+    def save(self, key, fingerprint, response, ttl):
+        value = fingerprint.encode() + b"\n" + response
+        self.client.set(self.prefix + key, value, px=int(ttl * 1000))
+
+    def release(self, key):
+        self.client.delete(self.prefix + key)
+
+
+def encode_response(response):
+    """Pack status, content type and body into bytes"""
+    head = f"{response.status_code} {response.mimetype}\n".encode()
+    return head + response.get_data()
+
+
+def decode_response(data):
+    """Rebuild a response packed by encode_response"""
+    head, _, body = data.partition(b"\n")
+    status, mimetype = head.decode().split(" ", 1)
+    response = Response(body, status=int(status), mimetype=mimetype)
+    response.headers["Idempotent-Replayed"] = "true"
+    return response
+
+
+class Idempotency(object):
+    """
+    Idempotency
+    holds the response store and the replay window from the app configuration
+    """
+
+    def __init__(self, store=None):
+        self.store = store or MemoryStore()
+        self.ttl = 0
+
+    def init_app(self, app):
+        """Configure the store from the app configuration
+        Args:
+            app: Flask instance
+        """
+        self.ttl = app.config.get("IDEMPOTENCY_TTL", 0)
+        storage = app.config.get("IDEMPOTENCY_STORAGE_URL", "memory://")
+        if storage.startswith("memory://"):
+            self.store = MemoryStore(app.config.get("IDEMPOTENCY_MAX_KEYS", 10000))
+        else:
+            try:
+                import redis
+            except ImportError:
+                raise RuntimeError("IDEMPOTENCY_STORAGE_URL names redis, `pip install redis`")
+            self.store = RedisStore(redis.Redis.from_url(storage))
+
+
+idempotency = Idempotency()
+
+
+def request_keys(key, subject):
+    """Scope the client key to the verified subject and hash the request
+    The subject rather than the token, a refreshed token must still replay.
+    Returns:
+        (store key, request fingerprint)
+    """
+    scope = hashlib.sha256(
+        "\n".join([subject, request.method, request.path, key]).encode()
+    ).hexdigest()
+    fingerprint = hashlib.sha256(request.get_data()).hexdigest()
+    return scope, fingerprint
+
+
+def idempotent():
+    """Idempotency-Key decorator for POST routes, goes below requires_auth
+    Responses are only replayed to the subject that made the request, once its
+    token is verified. Without a verified subject the key is ignored.
+    """
+
+    def idempotent_decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            key = request.headers.get(HEADER)
+            subject = request.environ.get(TENANT)
+            if not key or not subject or idempotency.ttl <= 0:
+                return f(*args, **kwargs)
+
+            scope, fingerprint = request_keys(key, subject)
+            stored = idempotency.store.reserve(scope, fingerprint, idempotency.ttl)
+            if stored is not None:
+                stored_fingerprint, response = stored
+                if stored_fingerprint != fingerprint:
+                    raise IdempotencyError(
+                        "Idempotency-Key was used with a different payload.", 422
+                    )
+                if response == PENDING:
+                    raise IdempotencyError("A request with this key is in progress.", 409)
+                return decode_response(response)
+
+            try:
+                response = current_app.make_response(f(*args, **kwargs))
+            except BaseException:
+                idempotency.store.release(scope)
+                raise
+            if response.status_code >= 500:
+                idempotency.store.release(scope)
+            else:
+                idempotency.store.save(
+                    scope, fingerprint, encode_response(response), idempotency.ttl
+                )
+            return response
+
+        return wrapper
+
+    return idempotent_decorator
@@ -0,0 +1,209 @@
+"""Token bucket rate limiting per client ip and per jwt subject"""
+import math
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import has_request_context, request
+
+# environ key of the bucket name, charged again per subject once the token is verified
+BUCKET = "mothership.ratelimit"
+PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+
+class RateLimitExceeded(Exception):
+    """RateLimitExceeded Exception
+    Raised when a client used up its bucket, carries the seconds to wait
+    """
+
+    def __init__(self, description, retry_after, code=429):
+        self.description = description
+        self.retry_after = retry_after
+        self.code = code
+
+
+def parse_limit(limit: str):
+    """Parse a '<count>/<period>' limit
+    Args:
+        limit: e.g. '10/minute'
+    Returns:
+        (emission interval in seconds, burst size)
+    Raises:
+        ValueError: the count isn't a positive integer or the period is unknown
+    """
+    count, _, period = limit.partition("/")
+    try:
+        count = int(count)
+    except ValueError:
+        count = 0
+    if count <= 0 or period.strip() not in PERIODS:
+        raise ValueError(
+            f"Invalid rate limit {limit!r}, expected '<count>/<period>' with a positive count"
+            f" and a period in {', '.join(PERIODS)}"
+        )
+    return PERIODS[period.strip()] / count, count
+
+
+class MemoryStore(object):
+    """Per process buckets, kept as the theoretical arrival time (GCRA)"""
+
+    def __init__(self):
+        # key -> theoretical arrival time, least recently charged first
+        self._tats = OrderedDict()
+        self._lock = threading.Lock()
+
+    def consume(self, key, interval, burst, now=None):
+        """Take one token from the bucket
+        Args:
+            key: bucket name
+            interval: seconds needed to refill one token
+            burst: bucket capacity
+            now: current time, defaults to time.time()
+        Returns:
+            0 when allowed, otherwise seconds until a token is available
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            tat = max(self._tats.get(key, now), now)
+            retry_after = tat + interval - now - burst * interval
+            if retry_after > 0:
+                return retry_after
+            self._tats[key] = tat + interval
+            self._tats.move_to_end(key)
+            # Buckets refilled by now are as good as missing, drop them from the front
+            while next(iter(self._tats.values())) <= now:
+                self._tats.popitem(last=False)
+            return 0
+
+
+class RedisStore(object):
+    """Buckets shared by every worker through a redis compatible client"""
+
+    def __init__(self, client, prefix="ratelimit:"):
+        self.client = client
+        self.prefix = prefix
+        try:
+            from redis.exceptions import WatchError
+        except ImportError:  # only the local fake client, which never raises it
+            WatchError = ()
+        self.watch_error = WatchError
+
+    def consume(self, key, interval, burst, now=None):
+        """Same contract as MemoryStore.consume, atomic through WATCH/MULTI"""
+        key = self.prefix + key
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(key)
+                    now = time.time() if now is None else now
+                    stored = pipe.get(key)
+                    tat = max(float(stored), now) if stored else now
+                    retry_after = tat + interval - now - burst * interval
+                    if retry_after > 0:
+                        pipe.reset()
+                        return retry_after
+                    pipe.multi()
+                    pipe.set(key, tat + interval, px=math.ceil((tat + interval - now) * 1000))
+                    pipe.execute()
+                    return 0
+                except self.watch_error:
+                    now = None
+                    continue
+
+
+class RateLimiter(object):
+    """
+    RateLimiter
+    holds the bucket store and the limits read from the app configuration
+    """
+
+    def __init__(self, store=None):
+        self.store = store or MemoryStore()
+        self.enabled = False
+        self.default = None
+        self.rules = {}
+        self.trusted_proxies = 0
+
+    def init_app(self, app):
+        """Configure the limiter from the app configuration
+        Args:
+            app: Flask instance
+        """
+        self.enabled = app.config.get("RATELIMIT_ENABLED", False)
+        self.default = app.config.get("RATELIMIT_DEFAULT")
+        self.rules = app.config.get("RATELIMIT_RULES", {})
+        self.trusted_proxies = app.config.get("RATELIMIT_TRUSTED_PROXIES", 0)
+        # Fail at startup rather than on the first request hitting a bad limit
+        for limit in [self.default, *self.rules.values()]:
+            if limit:
+                parse_limit(limit)
+        storage = app.config.get("RATELIMIT_STORAGE_URL", "memory://")
+        if storage.startswith("memory://"):
+            self.store = MemoryStore()
+        else:
+            try:
+                import redis
+            except ImportError:
+                raise RuntimeError("RATELIMIT_STORAGE_URL names redis, `pip install redis`")
+            self.store = RedisStore(redis.Redis.from_url(storage))
+
+    def limit_for(self, name):
+        limit = self.rules.get(name, self.default)
+        return parse_limit(limit) if limit else None
+
+    def client_ip(self):
+        """Client address, skipping the configured number of proxies"""
+        if self.trusted_proxies and request.access_route:
+            route = request.access_route
+            return route[max(len(route) - self.trusted_proxies, 0)]
+        return request.remote_addr
+
+    def check(self, name):
+        """Consume a token for the caller ip
+        Args:
+            name: permission or endpoint the limit applies to
+        Raises:
+            RateLimitExceeded
+        """
+        self.consume(f"{name}:ip:{self.client_ip()}", name)
+
+    def check_subject(self, subject):
+        """Consume a token for the verified jwt subject, called by requires_auth
+        The bucket is the one rate_limit checked for the request, if any.
+        Raises:
+            RateLimitExceeded
+        """
+        name = request.environ.get(BUCKET) if has_request_context() else None
+        if self.enabled and name and subject:
+            self.consume(f"{name}:sub:{subject}", name)
+
+    def consume(self, key, name):
+        limit = self.limit_for(name)
+        if limit is None:
+            return
+        retry_after = self.store.consume(key, *limit)
+        if retry_after > 0:
+            raise RateLimitExceeded("Too many requests.", math.ceil(retry_after))
+
+
+limiter = RateLimiter()
+
+
+def rate_limit(permission=""):
+    """Rate limit decorator for routes, goes above requires_auth"""
+
+    def rate_limit_decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            if limiter.enabled:
+                name = permission or request.endpoint
+                # Unverified claims would let forged tokens drain a victim's bucket,
+                # the subject is charged by requires_auth after the RSA check
+                limiter.check(name)
+                request.environ[BUCKET] = name
+            return f(*args, **kwargs)
+
+        return wrapper
+
+    return rate_limit_decorator
@@ -1,118 +1,29 @@
 """App and api initialization"""
 import os
 import json
+import tempfile
 from collections import namedtuple
+from functools import lru_cache
 from urllib.request import urlopen
 from unittest.mock import patch, MagicMock
 
 import pytest
+from jose import jwt
 
 from src.api import create_app
+from src.database.ingredient import LatteIngredient
+from src.database.latte import Latte
+from src.database.memory import MemoryRepository
 from src.database.persistence import db
-from src.auth.auth import requires_auth, AUTH0_DOMAIN
-
-
-class DummyLatte:
-    def __init__(self, title, ingredients, id=1, ex=None):
-        self.id = id
-        self.title = title
-        self.ingredients = ingredients
-        self.ex = ex
-
-    @property
-    def query(self):
-        return self
-
-    def filter(self, expression):
-        if self.ex is not None:
-            raise self.ex
-        return self
-
-    def one(self):
-        if self.ex is not None:
-            raise self.ex
-        return self
-
-    def all(self):
-        if self.ex is not None:
-            raise self.ex
-        return [self]
-
-    def long(self):
-        return {"id": self.id, "title": self.title, "ingredients": self.ingredients}
-
-    def insert(self):
-        pass
-
-    def update(self):
-        pass
-
-    def delete(self):
-        pass
-
-
-class DummyProject:
-    def __init__(self, title, meta, description, image, git_repo, demo_link, id=1):
-        self.id = id
-        self.title = title
-        self.meta = meta
-        self.description = description
-        self.image = image
-        self.git_repo = git_repo
-        self.demo_link = demo_link
-
-    @property
-    def query(self):
-        return self
-
-    def filter(self, expression):
-        return self
-
-    def one(self):
-        return self
-
-    def all(self):
-        return [self]
-
-    @property
-    def to_json(self):
-        return {
-            "id": self.id,
-            "title": self.title,
-            "meta": self.meta,
-            "description": self.description,
-            "image": self.image,
-            "git_repo": self.git_repo,
-            "demo_link": self.demo_link,
-        }
-
-    def insert(self):
-        pass
-
-    def update(self, title, meta, description, image, git_repo, demo_link):
-        self.title = title
-        self.meta = meta
-        self.description = description
-        self.image = image
-        self.git_repo = git_repo
-        self.demo_link = demo_link
-
-    def delete(self):
-        pass
+from src.database.project import Project
+from src.database.stats import Stat
+from src.database.storage import storage
+from src.database.tombstone import horizon_table
+from src.auth.auth import requires_auth, reset_jwks_cache, AUTH0_DOMAIN
+from tests.auth0_token import LIVE_AUTH0, latte_token, local_auth0, project_token
 
 
 mocked_request = namedtuple("request", "headers")
-dummy_latte_instance = DummyLatte(
-    "test", "[{'color': 'black', 'name': 'testing', 'parts': 1}]"
-)
-dummy_project_instance = DummyProject(
-    "test",
-    '["meta", "testing"]',
-    "some testing",
-    "image.png",
-    "github.com",
-    "heroku.com",
-)
 project_payload_good = {
     "title": "test",
     "meta": ["meta", "testing"],
@@ -121,24 +32,34 @@ project_payload_good = {
     "git_repo": "github.com",
     "demo_link": "heroku.com",
 }
-dummy_payload = {"title": "test", "ingredients": "test", "id": 1}
 valid_payload = {
     "title": "testpayload",
     "ingredients": [{"color": "black", "name": "testingpayload", "parts": 2}],
 }
+latte_row = {
+    "title": "test",
+    "ingredients": json.dumps([{"color": "black", "name": "testing", "parts": 1}]),
+}
+project_row = dict(project_payload_good, meta=json.dumps(project_payload_good["meta"]))
+OAT = {"color": "white", "name": "oat milk", "parts": 2}
+ESPRESSO = {"color": "brown", "name": "espresso", "parts": 1.5}
 wrong_payload = {"bad": "payload"}
 invalid_payload = {"title": "not-so-good$", "ingredients": "not-so-good$-neither"}
 exp_latte_token = (
-    "eyJhbGciOiJSUzI1NiIsInR5cCI6IkpXVCIsImtpZCI6IktCaGRneWZrZVhwd1RjbnpfRUxRNSJ9."
-    "eyJpc3MiOiJodHRwczovL21vdGhlcnNoaXAtdjIudXMuYXV0aDAuY29tLyIsInN1YiI6IkxUYTV6V"
-    "EwwTEljNGlsQlZtc1lNdHhyVnVvWm85NlNRQGNsaWVudHMiLCJhdWQiOiJsYXR0ZSIsImlhdCI6MT"
-    "U5NTczMzQxNywiZXhwIjoxNTk1ODE5ODE3LCJhenAiOiJMVGE1elRMMExJYzRpbEJWbXNZTXR4clZ"
-    "1b1pvOTZTUSIsInNjb3BlIjoiZ2V0OmxhdHRlIHBvc3Q6bGF0dGUgcGF0Y2g6bGF0dGUgZGVsZXRl"
-    "OmxhdHRlIiwiZ3R5IjoiY2xpZW50LWNyZWRlbnRpYWxzIn0.pynwhfRghIZf_xkdmF76nu0BVFJkA"
-    "988XTXlxJ7bOAjAOR7jjPQ7WJ9ZmcqG_Fz0SRbcZ0u9PG8ZFRD6o7nVcoOdos8K_9_T-qDlhrvPizM"
-    "8Dw-8-hhvg3Pe9ksxw-qwnRbj1gf7wveohuLBKVjdA_KqAbIg89uGRcYu7hrueCJO7W8dJ5NWjfE1b"
-    "VeEPLYNZY7MgE6Xc5uZX-U0OOuza0Ee9JUjHbSkax-ZG3tv_rLL5YyWePswS_8MTwiq3aL6vy5Noow"
-    "aLOY40F7lPGl58T33Xp2XW5nFbG6tkXgQuN7E1-QlCg-xich6mS5jR95MLyfIPToxMQ6y1qcfvS-K5w"
+    (
+        "eyJhbGciOiJSUzI1NiIsInR5cCI6IkpXVCIsImtpZCI6IktCaGRneWZrZVhwd1RjbnpfRUxRNSJ9."
+        "eyJpc3MiOiJodHRwczovL21vdGhlcnNoaXAtdjIudXMuYXV0aDAuY29tLyIsInN1YiI6IkxUYTV6V"
+        "EwwTEljNGlsQlZtc1lNdHhyVnVvWm85NlNRQGNsaWVudHMiLCJhdWQiOiJsYXR0ZSIsImlhdCI6MT"
+        "U5NTczMzQxNywiZXhwIjoxNTk1ODE5ODE3LCJhenAiOiJMVGE1elRMMExJYzRpbEJWbXNZTXR4clZ"
+        "1b1pvOTZTUSIsInNjb3BlIjoiZ2V0OmxhdHRlIHBvc3Q6bGF0dGUgcGF0Y2g6bGF0dGUgZGVsZXRl"
+        "OmxhdHRlIiwiZ3R5IjoiY2xpZW50LWNyZWRlbnRpYWxzIn0.pynwhfRghIZf_xkdmF76nu0BVFJkA"
+        "988XTXlxJ7bOAjAOR7jjPQ7WJ9ZmcqG_Fz0SRbcZ0u9PG8ZFRD6o7nVcoOdos8K_9_T-qDlhrvPizM"
+        "8Dw-8-hhvg3Pe9ksxw-qwnRbj1gf7wveohuLBKVjdA_KqAbIg89uGRcYu7hrueCJO7W8dJ5NWjfE1b"
+        "VeEPLYNZY7MgE6Xc5uZX-U0OOuza0Ee9JUjHbSkax-ZG3tv_rLL5YyWePswS_8MTwiq3aL6vy5Noow"
+        "aLOY40F7lPGl58T33Xp2XW5nFbG6tkXgQuN7E1-QlCg-xich6mS5jR95MLyfIPToxMQ6y1qcfvS-K5w"
+    )
+    if LIVE_AUTH0
+    else local_auth0.mint("latte", expires_in=-60)
 )
 exp_project_token = (
     "eyJhbGciOiJSUzI1NiIsInR5cCI6IkpXVCIsImtpZCI6IktCaGRneWZrZVhwd1RjbnpfRUxRNSJ9."
@@ -155,8 +76,13 @@ exp_project_token = (
     "mG0NvbkVch9f26sWqQejLQHx5xh22V8j5DH0bQDbvsMnw"
 )
 
-jsonurl = urlopen(f"https://{AUTH0_DOMAIN}/.well-known/jwks.json")
-jwks = {"loads.return_value": json.loads(jsonurl.read())}
+if LIVE_AUTH0:
+    jsonurl = urlopen(f"https://{AUTH0_DOMAIN}/.well-known/jwks.json")
+    jwks = {"loads.return_value": json.loads(jsonurl.read())}
+else:
+    jwks = {"loads.return_value": local_auth0.jwks}
+    jwks_path = local_auth0.write_jwks(os.path.join(tempfile.mkdtemp(), "jwks.json"))
+    os.environ["AUTH0_JWKS_URL"] = f"file://{jwks_path}"
 
 
 def get_access(permission, audiente):
@@ -167,6 +93,13 @@ def get_access(permission, audiente):
     return deco
 
 
+@pytest.fixture(autouse=True)
+def fresh_jwks():
+    """Tests patch the JWKS fetch, so never reuse keys between them"""
+    reset_jwks_cache()
+    yield
+
+
 @pytest.fixture(scope="module")
 @patch("src.api.db", MagicMock())
 @patch("src.api.migrate", MagicMock())
@@ -183,3 +116,57 @@ def db_testing():
         db.create_all()
         yield app
         db.drop_all()
+
+
+@lru_cache()
+def token_subject(audience):
+    """Tenant of the test tokens of an audience"""
+    token = latte_token() if audience == "latte" else project_token()
+    return jwt.get_unverified_claims(token)["sub"]
+
+
+# Tenant of the latte test tokens, the owner of the rows the tests write with them
+OWNER = token_subject("latte")
+
+
+@pytest.fixture
+def tables(db_testing):
+    """The database app, the lattes, projects, counters and purges of a test are undone after it"""
+    yield db_testing
+    # A refused write leaves the session of the module's app context rolled back
+    db.session.rollback()
+    db.session.query(LatteIngredient).delete()
+    db.session.query(Latte).delete()
+    db.session.query(Project).delete()
+    db.session.query(Stat).delete()
+    db.session.execute(horizon_table.delete())
+    db.session.commit()
+
+
+def memory_storage(app, name, model, audience, values):
+    """Put an in-memory repository holding one row in place of the database
+    The row belongs to the tenant of the test tokens, public reads default to it
+    """
+    owner = token_subject(audience)
+    repository = MemoryRepository(model)
+    repository.add(owner=owner, **values)
+    with patch.object(storage, name, repository), patch.dict(app.config, DEFAULT_TENANT=owner):
+        yield repository
+
+
+def failing_storage(error):
+    """Repository whose every call raises error"""
+    methods = ("list", "get", "get_many", "changes", "add", "update", "delete")
+    return MagicMock(**{f"{method}.side_effect": error for method in methods})
+
+
+@pytest.fixture
+def lattes(app):
+    """Latte storage in memory, holding latte 1 'test'"""
+    yield from memory_storage(app, "lattes", Latte, "latte", latte_row)
+
+
+@pytest.fixture
+def projects(app):
+    """Project storage in memory, holding project 1 'test'"""
+    yield from memory_storage(app, "projects", Project, "project", project_row)
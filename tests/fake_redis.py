@@ -0,0 +1,63 @@
+"""Single process stand-in for the few redis commands the app uses"""
+import time
+
+
+class FakeRedis:
+    def __init__(self):
+        self.data = {}
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+    def get(self, key):
+        value, expires = self.data.get(key, (None, None))
+        if expires is not None and expires <= time.time():
+            self.data.pop(key, None)
+            return None
+        return value
+
+    def set(self, key, value, px=None, nx=False):
+        if nx and self.get(key) is not None:
+            return None
+        expires = time.time() + px / 1000 if px else None
+        if not isinstance(value, bytes):
+            value = str(value).encode()
+        self.data[key] = (value, expires)
+        return True
+
+    def delete(self, key):
+        return 1 if self.data.pop(key, None) else 0
+
+
+class FakePipeline:
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+        self.buffering = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.reset()
+
+    def watch(self, *keys):
+        pass
+
+    def multi(self):
+        self.buffering = True
+
+    def reset(self):
+        self.commands = []
+        self.buffering = False
+
+    def get(self, key):
+        return self.client.get(key)
+
+    def set(self, key, value, px=None):
+        self.commands.append((key, value, px))
+
+    def execute(self):
+        for key, value, px in self.commands:
+            self.client.set(key, value, px=px)
+        self.reset()
@@ -0,0 +1,127 @@
+"""Tests for admission control, with a harness that slows down the local database"""
+import threading
+import time
+from contextlib import contextmanager
+from unittest.mock import patch
+
+from sqlalchemy import event
+
+from src.database.latte import Latte
+from src.database.persistence import db
+from src.middleware.admission import AdaptiveLimiter, admission
+from tests.conftest import token_subject
+
+
+@contextmanager
+def slow_database(delay):
+    """Make every statement on the test database take at least delay seconds"""
+
+    def sleep(*args):
+        time.sleep(delay)
+
+    event.listen(db.engine, "before_cursor_execute", sleep)
+    try:
+        yield
+    finally:
+        event.remove(db.engine, "before_cursor_execute", sleep)
+
+
+def concurrent_requests(app, calls):
+    """Fire (method, url) calls at the same time, return the responses in order"""
+    responses = [None] * len(calls)
+    barrier = threading.Barrier(len(calls))
+
+    def run(index, method, url):
+        with app.test_client() as client:
+            barrier.wait()
+            responses[index] = client.open(url, method=method)
+
+    threads = [
+        threading.Thread(target=run, args=(i, method, url))
+        for i, (method, url) in enumerate(calls)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return responses
+
+
+def test_limiter_writes_use_part_of_the_limit():
+    """Test reads keep headroom once writes reach their share"""
+    limiter = AdaptiveLimiter(limit=4, write_share=0.5)
+
+    assert limiter.try_acquire(write=True)
+    assert limiter.try_acquire(write=True)
+    assert not limiter.try_acquire(write=True)
+    assert limiter.try_acquire()
+    assert limiter.try_acquire()
+    assert not limiter.try_acquire()
+
+
+def test_limiter_additive_increase():
+    """Test fast responses grow a fully used limit"""
+    limiter = AdaptiveLimiter(limit=2, max_limit=10, latency_target=0.1)
+    for _ in range(20):
+        limiter.try_acquire()
+        limiter.try_acquire()
+        limiter.release(0.01)
+        limiter.release(0.01)
+
+    assert 2 < limiter.limit <= 10
+
+
+def test_limiter_multiplicative_decrease():
+    """Test slow responses shrink the limit, once per target interval"""
+    limiter = AdaptiveLimiter(limit=10, min_limit=2, latency_target=0.1, backoff=0.5)
+    limiter.try_acquire()
+    limiter.release(1.0, now=100)
+    limiter.try_acquire()
+    limiter.release(1.0, now=100.01)
+
+    assert limiter.limit == 5
+    for step in range(10):
+        limiter.try_acquire()
+        limiter.release(0.01, failed=True, now=101 + step)
+    assert limiter.limit == 2
+
+
+def test_503_api_latte_slow_database(db_testing):
+    """Test requests past the limit are shed while the database is slow"""
+    Latte(title="slow", ingredients='[{"name": "milk"}]').insert()
+    limiter = AdaptiveLimiter(limit=2, min_limit=1, max_limit=2, latency_target=0.05)
+
+    with patch.object(admission, "enabled", True), patch.object(
+        admission, "limiter", limiter
+    ), slow_database(0.2):
+        responses = concurrent_requests(db_testing, [("GET", "/api/latte")] * 6)
+    statuses = sorted(res.status_code for res in responses)
+    shed = [res for res in responses if res.status_code == 503]
+
+    assert statuses.count(200) == 2
+    assert statuses.count(503) == 4
+    assert all(res.headers["Retry-After"] == "1" for res in shed)
+    assert shed[0].get_json()["success"] is False
+    assert limiter.limit < 2
+    assert limiter.in_flight == 0
+
+
+@patch("src.auth.auth.verify_decode_jwt")
+def test_token_checks_are_not_timed(verify, app, lattes):
+    """Test a slow identity provider neither takes a slot nor shrinks the limit"""
+
+    def slow_verify(token, audience):
+        time.sleep(0.1)
+        return {"permissions": ["delete:latte"], "sub": token_subject("latte")}
+
+    verify.side_effect = slow_verify
+    limiter = AdaptiveLimiter(limit=2, min_limit=1, max_limit=2, latency_target=0.05)
+    headers = {"Authorization": "Bearer a.b.c"}
+    with patch.object(admission, "enabled", True), patch.object(admission, "limiter", limiter):
+        with patch.object(limiter, "release", wraps=limiter.release) as release:
+            with app.test_client() as client:
+                assert client.delete("/api/latte/1", headers=headers).status_code == 200
+
+    (latency,), _ = release.call_args
+    assert latency < 0.05
+    assert limiter.limit == 2
@@ -1,15 +1,13 @@
 """Testing module for latte api endpoints"""
-from unittest.mock import MagicMock, patch
+from unittest.mock import patch
 
-from sqlalchemy.exc import OperationalError, IntegrityError
-from sqlalchemy.orm.exc import NoResultFound
+from sqlalchemy.exc import OperationalError
 
+from src.database.storage import storage
 from tests.auth0_token import latte_token
 from tests.conftest import (
-    DummyLatte,
+    failing_storage,
     invalid_payload,
-    dummy_latte_instance,
-    dummy_payload,
     wrong_payload,
     valid_payload,
 )
@@ -25,8 +23,7 @@ def test_server_running(app):
     assert "running" in json_data["status"]
 
 
-@patch("src.apis.lattes.Latte", dummy_latte_instance)
-def test_api_latte_get(app):
+def test_api_latte_get(app, lattes):
     """Test GET /api/latte endpoint"""
     with app.test_client() as client:
         res = client.get("/api/latte")
@@ -34,18 +31,17 @@ def test_api_latte_get(app):
     assert len(json_data["lattes"]) == 1
     assert json_data["lattes"][0]["title"] == "test"
     assert json_data["lattes"][0]["id"] == 1
-    assert "testing" in json_data["lattes"][0]["ingredients"]
+    assert json_data["lattes"][0]["ingredients"][0]["name"] == "testing"
 
 
-@patch("src.apis.lattes.Latte", dummy_latte_instance)
-def test_api_latte_get_id(app):
+def test_api_latte_get_id(app, lattes):
     """Test GET /api/latte/id endpoint"""
     with app.test_client() as client:
         res = client.get("/api/latte/1")
     json_data = res.get_json()
     assert json_data["lattes"]["title"] == "test"
     assert json_data["lattes"]["id"] == 1
-    assert "testing" in json_data["lattes"]["ingredients"]
+    assert json_data["lattes"]["ingredients"][0]["name"] == "testing"
 
 
 def test_401_api_latte_post(app):
@@ -58,8 +54,7 @@ def test_401_api_latte_post(app):
     assert "Missing mandatory headers" in json_data["message"]
 
 
-@patch("src.apis.lattes.Latte", DummyLatte)
-def test_201_api_latte_post(app):
+def test_201_api_latte_post(app, lattes):
     """Test POST /api/latte endpoint with auth token"""
     with app.test_client() as client:
         res = client.post(
@@ -70,10 +65,11 @@ def test_201_api_latte_post(app):
     json_data = res.get_json()
     assert res.status_code == 201
     assert json_data["success"] is True
+    assert json_data["lattes"][0]["title"] == "testpayload"
+    assert lattes.get(json_data["lattes"][0]["id"]).title == "testpayload"
 
 
-@patch("src.apis.lattes.Latte", DummyLatte)
-def test_400_api_latte_post(app):
+def test_400_api_latte_post(app, lattes):
     """Test POST /api/latte endpoint with auth token bad payload"""
     with app.test_client() as client:
         res = client.post(
@@ -86,15 +82,12 @@ def test_400_api_latte_post(app):
     assert json_data["success"] is False
 
 
-@patch(
-    "src.apis.lattes.Latte", MagicMock(side_effect=IntegrityError("err", "err", "err"))
-)
-def test_409_api_latte_post(app):
+def test_409_api_latte_post(app, lattes):
     """Test POST /api/latte endpoint duplicate payload"""
     with app.test_client() as client:
         res = client.post(
             "/api/latte",
-            json=valid_payload,
+            json=dict(valid_payload, title="test"),
             headers={"Authorization": f"Bearer {latte_token}"},
         )
     json_data = res.get_json()
@@ -102,8 +95,7 @@ def test_409_api_latte_post(app):
     assert json_data["success"] is False
 
 
-@patch("src.apis.lattes.Latte", dummy_latte_instance)
-def test_200_api_latte_patch(app):
+def test_200_api_latte_patch(app, lattes):
     """Test PATCH /api/latte/1 endpoint"""
     with app.test_client() as client:
         res = client.patch(
@@ -114,12 +106,11 @@ def test_200_api_latte_patch(app):
     json_data = res.get_json()
     assert res.status_code == 200
     assert json_data["success"] is True
+    assert json_data["lattes"][0]["title"] == "testpayload"
+    assert lattes.get(1).ingredients == valid_payload["ingredients"]
 
 
-@patch(
-    "src.apis.lattes.Latte", MagicMock(**{"query.filter.side_effect": NoResultFound})
-)
-def test_404_api_latte_id(app):
+def test_404_api_latte_id(app, lattes):
     """Test GET /api/latte/1 endpoint not found latte"""
     with app.test_client() as client:
         res = client.get(
@@ -130,10 +121,7 @@ def test_404_api_latte_id(app):
     assert json_data["success"] is False
 
 
-@patch(
-    "src.apis.lattes.Latte", MagicMock(**{"query.filter.side_effect": NoResultFound})
-)
-def test_404_api_latte_patch(app):
+def test_404_api_latte_patch(app, lattes):
     """Test PATCH /api/latte/1 endpoint not found latte"""
     with app.test_client() as client:
         res = client.patch(
@@ -146,8 +134,7 @@ def test_404_api_latte_patch(app):
     assert json_data["success"] is False
 
 
-@patch("src.apis.lattes.Latte", DummyLatte(**dummy_payload))
-def test_400_api_latte_patch(app):
+def test_400_api_latte_patch(app, lattes):
     """Test PATCH /api/latte endpoint with auth token bad payload"""
     with app.test_client() as client:
         res = client.patch(
@@ -160,8 +147,7 @@ def test_400_api_latte_patch(app):
     assert json_data["success"] is False
 
 
-@patch("src.apis.lattes.Latte", dummy_latte_instance)
-def test_200_api_latte_delete(app):
+def test_200_api_latte_delete(app, lattes):
     """Test DELETE /api/latte/1 endpoint"""
     with app.test_client() as client:
         res = client.delete(
@@ -170,12 +156,10 @@ def test_200_api_latte_delete(app):
     json_data = res.get_json()
     assert res.status_code == 200
     assert json_data["success"] is True
+    assert lattes.get_many([1]) == ([], [1])
 
 
-@patch(
-    "src.apis.lattes.Latte", MagicMock(**{"query.filter.side_effect": NoResultFound})
-)
-def test_404_api_latte_delete(app):
+def test_404_api_latte_delete(app, lattes):
     """Test DELETE /api/latte/1 endpoint not found"""
     with app.test_client() as client:
         res = client.delete(
@@ -202,7 +186,9 @@ def test_500_api_latte(app):
 
     with app.test_client() as client:
         res = client.post(
-            "/api/latte", headers={"Authorization": f"Bearer {latte_token}"},
+            "/api/latte",
+            headers={"Authorization": f"Bearer {latte_token}"},
+            json=valid_payload,
         )
     json_data = res.get_json()
     assert json_data["error"] == 500
@@ -210,7 +196,9 @@ def test_500_api_latte(app):
 
     with app.test_client() as client:
         res = client.patch(
-            "/api/latte/1", headers={"Authorization": f"Bearer {latte_token}"},
+            "/api/latte/1",
+            headers={"Authorization": f"Bearer {latte_token}"},
+            json=valid_payload,
         )
     json_data = res.get_json()
     assert json_data["error"] == 500
@@ -225,15 +213,7 @@ def test_500_api_latte(app):
     assert json_data["success"] is False
 
 
-@patch(
-    "src.apis.lattes.Latte",
-    MagicMock(
-        **{
-            "query.all.side_effect": OperationalError("err", "err", "err"),
-            "query.filter.side_effect": OperationalError("err", "err", "err"),
-        }
-    ),
-)
+@patch.object(storage, "lattes", failing_storage(OperationalError("err", "err", "err")))
 def test_502_api_latte_get_delete_patch(app):
     """Test 502 for gets, patch, and delete methods endpoint"""
     with app.test_client() as client:
@@ -267,16 +247,13 @@ def test_502_api_latte_get_delete_patch(app):
     assert json_data["success"] is False
 
 
-@patch(
-    "src.apis.lattes.Latte",
-    MagicMock(side_effect=OperationalError("err", "err", "err")),
-)
+@patch.object(storage, "lattes", failing_storage(OperationalError("err", "err", "err")))
 def test_502_api_latte_post(app):
     """Test 502 for post method endpoint"""
     with app.test_client() as client:
         res = client.post(
             "/api/latte",
-            json=dummy_payload,
+            json=valid_payload,
             headers={"Authorization": f"Bearer {latte_token}"},
         )
     json_data = res.get_json()
@@ -1,14 +1,12 @@
 """Testing module for latte api endpoints"""
-import json
 from unittest.mock import MagicMock, patch
 
-from sqlalchemy.exc import IntegrityError, OperationalError
-from sqlalchemy.orm.exc import NoResultFound
+from sqlalchemy.exc import OperationalError
 
+from src.database.storage import storage
 from tests.auth0_token import project_token
 from tests.conftest import (
-    DummyProject,
-    dummy_project_instance,
+    failing_storage,
     invalid_payload,
     project_payload_good,
 )
@@ -16,8 +14,7 @@ from tests.conftest import (
 project_token = project_token()
 
 
-@patch("src.apis.projects.Project", dummy_project_instance)
-def test_api_project_get(app):
+def test_api_project_get(app, projects):
     """Test api GET /api/project endpoint"""
     with app.test_client() as client:
         res = client.get("/api/project")
@@ -25,8 +22,7 @@ def test_api_project_get(app):
 
     assert json_data["id"] == 1
     assert json_data["title"] == "test"
-    assert json_data["meta"] == '["meta", "testing"]'
-    assert json.loads(json_data["meta"]) == ["meta", "testing"]
+    assert json_data["meta"] == ["meta", "testing"]
     assert json_data["description"] == "some testing"
     assert json_data["image"] == "image.png"
     assert json_data["git_repo"] == "github.com"
@@ -34,21 +30,19 @@ def test_api_project_get(app):
     assert res.status_code == 200
 
 
-@patch("src.apis.projects.Project", DummyProject)
-def test_api_project_post(app):
+def test_api_project_post(app, projects):
     """Test api POST /api/project endpoint"""
     with app.test_client() as client:
         res = client.post(
             "/api/project",
-            json=project_payload_good,
+            json=dict(project_payload_good, title="other"),
             headers={"Authorization": f"Bearer {project_token}"},
         )
     json_data = res.get_json()
 
-    assert json_data["id"] == 1
-    assert json_data["title"] == "test"
-    assert json_data["meta"] == '["meta", "testing"]'
-    assert json.loads(json_data["meta"]) == ["meta", "testing"]
+    assert json_data["id"] == 2
+    assert json_data["title"] == "other"
+    assert json_data["meta"] == ["meta", "testing"]
     assert json_data["description"] == "some testing"
     assert json_data["image"] == "image.png"
     assert json_data["git_repo"] == "github.com"
@@ -56,30 +50,28 @@ def test_api_project_post(app):
     assert res.status_code == 201
 
 
-@patch("src.apis.projects.Project", dummy_project_instance)
-def test_api_project_patch(app):
+def test_api_project_patch(app, projects):
     """Test api PATCH /api/project/1 endpoint"""
     with app.test_client() as client:
         res = client.patch(
             "/api/project/1",
-            json=project_payload_good,
+            json=dict(project_payload_good, description="patched"),
             headers={"Authorization": f"Bearer {project_token}"},
         )
     json_data = res.get_json()
 
     assert json_data["id"] == 1
     assert json_data["title"] == "test"
-    assert json_data["meta"] == '["meta", "testing"]'
-    assert json.loads(json_data["meta"]) == ["meta", "testing"]
-    assert json_data["description"] == "some testing"
+    assert json_data["meta"] == ["meta", "testing"]
+    assert json_data["description"] == "patched"
     assert json_data["image"] == "image.png"
     assert json_data["git_repo"] == "github.com"
     assert json_data["demo_link"] == "heroku.com"
     assert res.status_code == 200
+    assert projects.get(1).description == "patched"
 
 
-@patch("src.apis.projects.Project", MagicMock())
-def test_api_project_delete(app):
+def test_api_project_delete(app, projects):
     """Test api DELETE /api/project/1 endpoint"""
     with app.test_client() as client:
         res = client.delete("/api/project/1", headers={"Authorization": f"Bearer {project_token}"},)
@@ -88,10 +80,10 @@ def test_api_project_delete(app):
     assert json_data["success"] is True
     assert json_data["project_id"] == 1
     assert res.status_code == 200
+    assert projects.get_many([1]) == ([], [1])
 
 
-@patch("src.apis.projects.Project", dummy_project_instance)
-def test_api_project_get_by_id(app):
+def test_api_project_get_by_id(app, projects):
     """Test api GET /api/project/1 endpoint"""
     with app.test_client() as client:
         res = client.get("/api/project/1")
@@ -99,8 +91,7 @@ def test_api_project_get_by_id(app):
 
     assert json_data["id"] == 1
     assert json_data["title"] == "test"
-    assert json_data["meta"] == '["meta", "testing"]'
-    assert json.loads(json_data["meta"]) == ["meta", "testing"]
+    assert json_data["meta"] == ["meta", "testing"]
     assert json_data["description"] == "some testing"
     assert json_data["image"] == "image.png"
     assert json_data["git_repo"] == "github.com"
@@ -108,10 +99,7 @@ def test_api_project_get_by_id(app):
     assert res.status_code == 200
 
 
-@patch(
-    "src.apis.projects.Project",
-    MagicMock(**{"query.all.side_effect": OperationalError("err", "err", "err")}),
-)
+@patch.object(storage, "projects", failing_storage(OperationalError("err", "err", "err")))
 def test_api_project_get_db_error(app):
     """Test api GET /api/project endpoint db error"""
     with app.test_client() as client:
@@ -123,9 +111,7 @@ def test_api_project_get_db_error(app):
     assert "invalid response from an upstream server" in json_data["message"]
 
 
-@patch(
-    "src.apis.projects.Project", MagicMock(**{"query.all.side_effect": Exception}),
-)
+@patch.object(storage, "projects", failing_storage(Exception))
 def test_api_project_get_exception(app):
     """Test api GET /api/project endpoint exception"""
     with app.test_client() as client:
@@ -137,13 +123,10 @@ def test_api_project_get_exception(app):
     assert "The server encountered an internal error" in json_data["message"]
 
 
-@patch(
-    "src.apis.projects.Project", MagicMock(**{"query.filter.side_effect": NoResultFound}),
-)
-def test_api_project_get__id_not_found(app):
-    """Test api GET /api/project/1 endpoint not found"""
+def test_api_project_get__id_not_found(app, projects):
+    """Test api GET /api/project/2 endpoint not found"""
     with app.test_client() as client:
-        res = client.get("/api/project/1")
+        res = client.get("/api/project/2")
     json_data = res.get_json()
 
     assert json_data["success"] is False
@@ -151,10 +134,7 @@ def test_api_project_get__id_not_found(app):
     assert "The requested URL was not found on the server" in json_data["message"]
 
 
-@patch(
-    "src.apis.projects.Project",
-    MagicMock(**{"query.filter.side_effect": OperationalError("err", "err", "err")}),
-)
+@patch.object(storage, "projects", failing_storage(OperationalError("err", "err", "err")))
 def test_api_project_get_by_id_db_error(app):
     """Test api GET /api/project/1 endpoint db error"""
     with app.test_client() as client:
@@ -166,9 +146,7 @@ def test_api_project_get_by_id_db_error(app):
     assert "invalid response from an upstream server" in json_data["message"]
 
 
-@patch(
-    "src.apis.projects.Project", MagicMock(**{"query.filter.side_effect": Exception}),
-)
+@patch.object(storage, "projects", failing_storage(Exception))
 def test_api_project_get_by_id_exception(app):
     """Test api GET /api/project/1 endpoint exception"""
     with app.test_client() as client:
@@ -232,10 +210,7 @@ def test_api_project_post_incomplete_payload(app):
     assert "sent a request that this server could not understand" in json_data["message"]
 
 
-@patch(
-    "src.apis.projects.Project", MagicMock(side_effect=IntegrityError("err", "err", "err")),
-)
-def test_api_project_post_duplicated(app):
+def test_api_project_post_duplicated(app, projects):
     """Test api POST /api/project endpoint duplicated"""
     with app.test_client() as client:
         res = client.post(
@@ -250,9 +225,7 @@ def test_api_project_post_duplicated(app):
     assert "A conflict happened while processing the request" in json_data["message"]
 
 
-@patch(
-    "src.apis.projects.Project", MagicMock(side_effect=OperationalError("err", "err", "err")),
-)
+@patch.object(storage, "projects", failing_storage(OperationalError("err", "err", "err")))
 def test_api_project_post_db_error(app):
     """Test api POST /api/project endpoint db error"""
     with app.test_client() as client:
@@ -268,9 +241,7 @@ def test_api_project_post_db_error(app):
     assert "invalid response from an upstream server" in json_data["message"]
 
 
-@patch(
-    "src.apis.projects.Project", MagicMock(side_effect=Exception),
-)
+@patch.object(storage, "projects", failing_storage(Exception))
 def test_api_project_post_exception(app):
     """Test api POST /api/project endpoint exception"""
     with app.test_client() as client:
@@ -286,9 +257,7 @@ def test_api_project_post_exception(app):
     assert "The server encountered an internal error" in json_data["message"]
 
 
-@patch(
-    "src.apis.projects.Project", MagicMock(),
-)
+@patch.object(storage, "projects", MagicMock())
 def test_api_project_patch_incomplete_payload(app):
     """Test api PATCH /api/project endpoint incomplete payload"""
     with app.test_client() as client:
@@ -304,13 +273,14 @@ def test_api_project_patch_incomplete_payload(app):
     assert "sent a request that this server could not understand" in json_data["message"]
 
 
-@patch(
-    "src.apis.projects.Project", MagicMock(**{"query.filter.side_effect": NoResultFound}),
-)
-def test_api_project_patch_id_not_found(app):
+def test_api_project_patch_id_not_found(app, projects):
     """Test api PATCH /api/project/wrong endpoint not found"""
     with app.test_client() as client:
-        res = client.patch("/api/project/2", headers={"Authorization": f"Bearer {project_token}"},)
+        res = client.patch(
+            "/api/project/2",
+            headers={"Authorization": f"Bearer {project_token}"},
+            json=project_payload_good,
+        )
     json_data = res.get_json()
 
     assert json_data["success"] is False
@@ -331,10 +301,7 @@ def test_api_project_patch_id_not_int(app):
     assert "The requested URL was not found on the server" in json_data["message"]
 
 
-@patch(
-    "src.apis.projects.Project",
-    MagicMock(**{"query.filter.side_effect": OperationalError("err", "err", "err")}),
-)
+@patch.object(storage, "projects", failing_storage(OperationalError("err", "err", "err")))
 def test_api_project_patch_db_error(app):
     """Test api PATCH /api/project endpoint db error"""
     with app.test_client() as client:
@@ -350,13 +317,15 @@ def test_api_project_patch_db_error(app):
     assert "invalid response from an upstream server" in json_data["message"]
 
 
-@patch(
-    "src.apis.projects.Project", MagicMock(**{"query.filter.side_effect": Exception}),
-)
+@patch.object(storage, "projects", failing_storage(Exception))
 def test_api_project_patch_by_id_exception(app):
     """Test api PATCH /api/project/1 endpoint exception"""
     with app.test_client() as client:
-        res = client.patch("/api/project/1", headers={"Authorization": f"Bearer {project_token}"},)
+        res = client.patch(
+            "/api/project/1",
+            headers={"Authorization": f"Bearer {project_token}"},
+            json=project_payload_good,
+        )
     json_data = res.get_json()
 
     assert json_data["success"] is False
@@ -364,10 +333,7 @@ def test_api_project_patch_by_id_exception(app):
     assert "The server encountered an internal error" in json_data["message"]
 
 
-@patch(
-    "src.apis.projects.Project", MagicMock(**{"query.filter.side_effect": NoResultFound}),
-)
-def test_api_project_delete_by_id_not_found(app):
+def test_api_project_delete_by_id_not_found(app, projects):
     """Test api DELETE /api/project/1 endpoint exception"""
     with app.test_client() as client:
         res = client.delete("/api/project/2", headers={"Authorization": f"Bearer {project_token}"},)
@@ -378,9 +344,7 @@ def test_api_project_delete_by_id_not_found(app):
     assert "The requested URL was not found on the server" in json_data["message"]
 
 
-@patch(
-    "src.apis.projects.Project", MagicMock(**{"query.filter.side_effect": Exception}),
-)
+@patch.object(storage, "projects", failing_storage(Exception))
 def test_api_project_delete_by_id_exception(app):
     """Test api DELETE /api/project/1 endpoint exception"""
     with app.test_client() as client:
@@ -392,10 +356,7 @@ def test_api_project_delete_by_id_exception(app):
     assert "The server encountered an internal error" in json_data["message"]
 
 
-@patch(
-    "src.apis.projects.Project",
-    MagicMock(**{"query.filter.side_effect": OperationalError("err", "err", "err")}),
-)
+@patch.object(storage, "projects", failing_storage(OperationalError("err", "err", "err")))
 def test_api_project_delete_by_id_db_error(app):
     """Test api DELETE /api/project/1 endpoint db error"""
     with app.test_client() as client:
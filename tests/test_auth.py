@@ -9,7 +9,7 @@ from src.auth.auth import (
     check_permissions,
     verify_decode_jwt,
 )
-from tests.auth0_token import latte_token, project_token
+from tests.auth0_token import LIVE_AUTH0, latte_token, project_token
 from tests.conftest import (
     exp_latte_token,
     get_access,
@@ -151,7 +151,7 @@ def test_verify_decode_jwt_malformed_authorization():
     assert err.value.description == "Authorization malformed."
 
 
-@pytest.mark.skip(reason="need an expired test token")
+@pytest.mark.skipif(LIVE_AUTH0, reason="need an expired test token")
 @patch("src.auth.auth.urlopen", MagicMock())
 @patch("src.auth.auth.json", MagicMock(method="loads", **jwks))
 def test_verify_decode_jwt_expired():
@@ -197,6 +197,29 @@ def test_verify_decode_jwt_bad_jwks():
     assert err.value.description == "Unable to find the appropriate key."
 
 
+@patch("src.auth.auth.urlopen", MagicMock())
+def test_verify_decode_jwt_unknown_kid_refetches_jwks():
+    """Test a key missing from the cached JWKS forces one fetch"""
+    with patch("src.auth.auth.json") as json:
+        json.loads.side_effect = [{"keys": []}, jwks["loads.return_value"]]
+        assert verify_decode_jwt(latte_token, "latte")["aud"] == "latte"
+
+    assert json.loads.call_count == 2
+
+
+@patch("src.auth.auth.urlopen", MagicMock())
+@patch("src.auth.auth.json")
+def test_verify_decode_jwt_unknown_kid_refetch_rate_limited(json):
+    """Test tokens with unknown keys don't refetch the JWKS on every request"""
+    json.loads.return_value = {"keys": []}
+    for _ in range(3):
+        with pytest.raises(AuthError) as err:
+            verify_decode_jwt(latte_token, "latte")
+
+    assert err.value.description == "Unable to find the appropriate key."
+    assert json.loads.call_count == 2
+
+
 @patch("src.auth.auth.request", request(headers={"Authorization": f"Bearer {latte_token}"}))
 @patch("src.auth.auth.urlopen", MagicMock())
 @patch("src.auth.auth.json", MagicMock(method="loads", **jwks))
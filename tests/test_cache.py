@@ -0,0 +1,194 @@
+"""Tests for the identity cache"""
+import threading
+from unittest.mock import MagicMock, patch
+
+import pytest
+from sqlalchemy.orm.exc import NoResultFound
+
+from src.database.cache import IdentityCache, listen_for_changes
+from src.database.latte import Latte, LatteSnapshot
+from src.database.project import Project, ProjectSnapshot
+
+
+def test_cache_disabled_by_default():
+    """Test a zero sized cache never stores rows"""
+    cache = IdentityCache()
+    cache.put("latte", 1, "row")
+
+    assert cache.get("latte", 1) is None
+    assert len(cache) == 0
+
+
+def test_cache_evicts_least_recently_used():
+    """Test the cache stays within its size bound"""
+    cache = IdentityCache(maxsize=2)
+    cache.put("latte", 1, "one")
+    cache.put("latte", 2, "two")
+    cache.get("latte", 1)
+    cache.put("project", 1, "three")
+
+    assert len(cache) == 2
+    assert cache.get("latte", 1) == "one"
+    assert cache.get("latte", 2) is None
+    assert cache.get("project", 1) == "three"
+
+
+def test_cache_fetch_uses_loader_once():
+    """Test fetch only calls the loader on a miss"""
+    cache = IdentityCache(maxsize=8)
+    loader = MagicMock(**{"return_value.snapshot.return_value": "snap"})
+
+    assert cache.fetch("latte", 1, loader) == "snap"
+    assert cache.fetch("latte", 1, loader) == "snap"
+    assert loader.call_count == 1
+
+
+def test_cache_fetch_propagates_misses():
+    """Test fetch does not swallow missing rows"""
+    cache = IdentityCache(maxsize=8)
+
+    with pytest.raises(NoResultFound):
+        cache.fetch("latte", 1, MagicMock(side_effect=NoResultFound))
+    assert len(cache) == 0
+
+
+def test_cache_fetch_many_loads_misses_at_once():
+    """Test fetch_many keeps the requested order and only loads uncached rows"""
+    cache = IdentityCache(maxsize=8, negative_ttl=60)
+    cache.put("latte", 5, "five")
+    nine = MagicMock(id=9, **{"snapshot.return_value": "nine"})
+    loader = MagicMock(return_value=[nine])
+
+    assert cache.fetch_many("latte", [9, 5, 1], loader) == (["nine", "five"], [1])
+    loader.assert_called_once_with([9, 1])
+    assert cache.fetch_many("latte", [1, 9], loader) == (["nine"], [1])
+    assert loader.call_count == 1
+
+
+def test_cache_handle_notification():
+    """Test change notifications invalidate the matching entry"""
+    cache = IdentityCache(maxsize=8)
+    cache.put("latte", 1, "one")
+    cache.put("project", 1, "two")
+    cache.handle_notification("latte:1")
+    cache.handle_notification("garbage")
+
+    assert cache.get("latte", 1) is None
+    assert cache.get("project", 1) == "two"
+
+
+def test_snapshots_render_like_models():
+    """Test snapshots serialize the same way as their models"""
+    latte = Latte(id=1, title="test", ingredients='[{"name": "milk"}]')
+    project = Project(
+        id=1,
+        title="test",
+        meta='["meta"]',
+        description="some testing",
+        image="image.png",
+        git_repo="github.com",
+        demo_link="heroku.com",
+    )
+
+    assert isinstance(latte.snapshot(), LatteSnapshot)
+    assert latte.snapshot().long() == latte.long()
+    assert isinstance(project.snapshot(), ProjectSnapshot)
+    assert project.snapshot().to_json == project.to_json
+
+
+def test_cache_remembers_misses():
+    """Test known misses are answered without calling the loader"""
+    cache = IdentityCache(maxsize=8, negative_ttl=60)
+    loader = MagicMock(side_effect=NoResultFound)
+
+    for _ in range(3):
+        with pytest.raises(NoResultFound):
+            cache.fetch("latte", 42, loader)
+    assert loader.call_count == 1
+    assert cache.is_missing("latte", 42)
+
+
+def test_misses_cached_without_rows():
+    """Test misses are remembered with the row cache off, and forgotten once the row exists"""
+    cache = IdentityCache(maxsize=0, negative_ttl=60, negative_size=8)
+    loader = MagicMock(side_effect=NoResultFound)
+
+    for _ in range(2):
+        with pytest.raises(NoResultFound):
+            cache.fetch("latte", 42, loader)
+    assert loader.call_count == 1
+    cache.put("latte", 42, "row")
+    assert not cache.is_missing("latte", 42)
+    assert len(cache) == 0
+
+
+@patch("src.database.cache.time.monotonic")
+def test_cache_misses_expire(monotonic):
+    """Test miss records are dropped after their ttl"""
+    cache = IdentityCache(maxsize=8, negative_ttl=5)
+    monotonic.return_value = 100
+    cache.mark_missing("latte", 42)
+
+    assert cache.is_missing("latte", 42)
+    monotonic.return_value = 106
+    assert not cache.is_missing("latte", 42)
+
+
+def test_cache_put_clears_miss():
+    """Test inserting a row forgets that it was missing"""
+    cache = IdentityCache(maxsize=8, negative_ttl=60)
+    cache.mark_missing("project", 7)
+    cache.put("project", 7, "row")
+
+    assert not cache.is_missing("project", 7)
+    assert cache.fetch("project", 7, MagicMock(side_effect=NoResultFound)) == "row"
+
+
+@patch("src.database.cache.time.monotonic")
+def test_cache_rows_expire(monotonic):
+    """Test snapshots are dropped after their ttl"""
+    cache = IdentityCache(maxsize=8, ttl=30)
+    monotonic.return_value = 100
+    cache.put("latte", 1, "one")
+
+    monotonic.return_value = 129
+    assert cache.get("latte", 1) == "one"
+    monotonic.return_value = 131
+    assert cache.get("latte", 1) is None
+    assert len(cache) == 0
+
+
+def test_cache_skips_rows_read_before_a_write():
+    """Test a row loaded while a write invalidated it isn't stored"""
+    cache = IdentityCache(maxsize=8)
+
+    def loader():
+        # The write commits and invalidates between the read and the put
+        cache.invalidate("latte", 1)
+        return MagicMock(**{"snapshot.return_value": "stale"})
+
+    assert cache.fetch("latte", 1, loader) == "stale"
+    assert cache.get("latte", 1) is None
+    cache.put("latte", 1, "fresh")
+    assert cache.get("latte", 1) == "fresh"
+
+
+def test_listener_reconnects_and_clears_cache():
+    """Test a failing listener connection is retried and the cache emptied"""
+    cache = IdentityCache(maxsize=8)
+    cache.put("latte", 1, "one")
+    engine = MagicMock(**{"raw_connection.side_effect": OSError("connection refused")})
+    logger, retried = MagicMock(), threading.Event()
+
+    def sleep(seconds):
+        if engine.raw_connection.call_count >= 2:
+            retried.set()
+            # Park the listener for the rest of the test run
+            threading.Event().wait()
+
+    with patch("src.database.cache.time.sleep", side_effect=sleep):
+        listen_for_changes(engine, cache, logger=logger)
+        assert retried.wait(5)
+
+    assert cache.get("latte", 1) is None
+    assert logger.error.call_count == 2
@@ -0,0 +1,71 @@
+"""Tests for sparse fieldsets"""
+import json
+
+import pytest
+from sqlalchemy import event
+
+from src.database.latte import Latte
+from src.database.persistence import db
+from src.database.project import Project
+from tests.conftest import OAT, OWNER
+
+
+@pytest.fixture
+def client(tables):
+    for i in range(3):
+        Latte(owner=OWNER, title=f"latte {i}", ingredients=json.dumps([OAT])).insert()
+        Project(owner=OWNER, title=f"project {i}", meta="[]", description="long " * 50).insert()
+    db.session.expunge_all()
+    with tables.test_client() as client:
+        yield client
+
+
+@pytest.fixture
+def selects():
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            statements.append(" ".join(statement.split()))
+
+    event.listen(db.engine, "before_cursor_execute", record)
+    yield statements
+    event.remove(db.engine, "before_cursor_execute", record)
+
+
+def test_only_requested_columns_are_selected(client, selects):
+    """Test a sparse page selects its columns and skips the ingredient rows"""
+    query = {"owner": OWNER, "fields": "title", "sort": "-updated_at", "limit": 2}
+    body = client.get("/api/latte", query_string=query).get_json()
+
+    assert [set(_) for _ in body["lattes"]] == [{"id", "title"}] * 2
+    assert [_["title"] for _ in body["lattes"]] == ["latte 2", "latte 1"]
+    assert body["next"]
+    assert len(selects) == 1
+    assert "ingredients" not in selects[0]
+    assert "latte.updated_at" in selects[0]
+
+
+def test_nested_rows_load_in_one_query(client, selects):
+    """Test the ingredients of a whole page are loaded together, not per latte"""
+    query = {"owner": OWNER, "fields": "ingredients"}
+    body = client.get("/api/latte", query_string=query).get_json()
+
+    assert [set(_) for _ in body["lattes"]] == [{"id", "ingredients"}] * 3
+    assert body["lattes"][0]["ingredients"] == [OAT]
+    assert len(selects) == 2
+    assert "latte.title" not in selects[0]
+
+
+def test_project_fields(client, selects):
+    """Test projects render only their requested fields, image variants included"""
+    project = Project.query.filter(Project.title == "project 1").one().id
+    query = {"owner": OWNER, "fields": "title,image_variants"}
+    projects = client.get("/api/project", query_string=query).get_json()
+    single = client.get(f"/api/project/{project}", query_string=query).get_json()
+
+    assert projects[1] == single == {"id": project, "title": "project 1", "image_variants": None}
+    assert "description" not in selects[-2]
+    res = client.get("/api/project", query_string={"fields": "title,secret"})
+    assert res.status_code == 400
+    assert "fields" in res.get_json()["errors"]
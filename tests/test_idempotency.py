@@ -0,0 +1,86 @@
+"""Tests for the Idempotency-Key middleware"""
+from unittest.mock import patch
+
+import pytest
+
+from src.middleware.idempotency import PENDING, MemoryStore, RedisStore, idempotency
+from tests.auth0_token import latte_token, local_auth0
+from tests.conftest import valid_payload
+from tests.fake_redis import FakeRedis
+
+latte_token = latte_token()
+
+
+def post_latte(client, payload, key="abc", token=latte_token):
+    return client.post(
+        "/api/latte",
+        json=payload,
+        headers={"Authorization": f"Bearer {token}", "Idempotency-Key": key},
+    )
+
+
+def test_stores_reserve_then_replay():
+    """Test both stores hand back the saved response"""
+    for store in (MemoryStore(), RedisStore(FakeRedis())):
+        assert store.reserve("k", "fp", 60) is None
+        assert store.reserve("k", "fp", 60) == ("fp", PENDING)
+        store.save("k", "fp", b"201 application/json\n{}", 60)
+        assert store.reserve("k", "fp", 60) == ("fp", b"201 application/json\n{}")
+        store.release("k")
+        assert store.reserve("k", "fp", 60) is None
+
+
+@patch.object(idempotency, "store", MemoryStore())
+def test_201_api_latte_post_replayed(app, lattes):
+    """Test a retried POST /api/latte is served from the store"""
+    with patch.object(lattes, "add", wraps=lattes.add) as add, app.test_client() as client:
+        first = post_latte(client, valid_payload)
+        second = post_latte(client, valid_payload)
+
+    assert add.call_count == 1
+    assert first.status_code == second.status_code == 201
+    assert first.get_data() == second.get_data()
+    assert second.headers["Idempotent-Replayed"] == "true"
+
+
+@patch.object(idempotency, "store", MemoryStore())
+def test_422_api_latte_post_key_reused(app, lattes):
+    """Test reusing a key with another payload is rejected"""
+    with app.test_client() as client:
+        post_latte(client, valid_payload)
+        res = post_latte(client, dict(valid_payload, title="other"))
+    json_data = res.get_json()
+
+    assert json_data["error"] == 422
+    assert json_data["success"] is False
+
+
+@patch.object(idempotency, "store", MemoryStore())
+def test_400_api_latte_post_not_stored(app, lattes):
+    """Test failed requests release the key so they can be retried"""
+    with app.test_client() as client:
+        res = post_latte(client, {"bad": "payload"})
+        retry = post_latte(client, {"bad": "payload"})
+
+    assert res.status_code == retry.status_code == 400
+    assert "Idempotent-Replayed" not in retry.headers
+
+
+@pytest.mark.skipif(local_auth0 is None, reason="needs locally signed tokens")
+@patch.object(idempotency, "store", MemoryStore())
+def test_201_api_latte_post_replayed_per_subject(app, lattes):
+    """Test a refreshed token replays, another subject or a bad token doesn't"""
+    refreshed = local_auth0.mint("latte", expires_in=7200)
+    other = local_auth0.mint("latte", subject="other@clients")
+    with patch.object(lattes, "add", wraps=lattes.add) as add, app.test_client() as client:
+        first = post_latte(client, valid_payload)
+        retry = post_latte(client, valid_payload, token=refreshed)
+        forged = post_latte(client, valid_payload, token="a.b.c")
+        foreign = post_latte(client, valid_payload, token=other)
+
+    assert add.call_count == 2
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert retry.get_data() == first.get_data()
+    assert forged.status_code == 401
+    assert foreign.status_code == 201
+    assert "Idempotent-Replayed" not in foreign.headers
@@ -0,0 +1,201 @@
+"""Tests for the project image pipeline"""
+import os
+import shutil
+import socket
+import threading
+from unittest.mock import MagicMock, patch
+from urllib.request import Request
+
+import pytest
+
+from src.api import create_app
+from src.database.project import Project
+from src.helpers.images import (
+    PublicHTTPSConnection,
+    PublicRedirectHandler,
+    blurhash,
+    fetch,
+    images,
+)
+
+Image = pytest.importorskip("PIL.Image")
+
+
+@pytest.fixture
+def pipeline(tmp_path):
+    os.environ["DATABASE_URL"] = "sqlite:///test.db"
+    app = create_app("testing")
+    app.config.update(
+        IMAGE_CACHE_DIR=str(tmp_path / "cache"),
+        IMAGE_WIDTHS=[160, 480, 960],
+        IMAGE_SCHEMES=["file"],
+    )
+    images.init_app(app)
+    yield app
+    images.wait()
+    app.config["IMAGE_CACHE_DIR"] = None
+    images.init_app(app)
+
+
+@pytest.fixture
+def image_url(tmp_path):
+    path = tmp_path / "cover.png"
+    Image.new("RGB", (600, 300), (200, 40, 40)).save(path)
+    return f"file://{path}"
+
+
+def test_blurhash_of_a_solid_color():
+    """Test the encoding matches the reference implementation"""
+    assert blurhash(Image.new("RGB", (20, 10), (255, 0, 0))) == "LWTI:j,YfQ,Y|co1fQo1fQfQfQfQ"
+
+
+def test_variants_are_built_in_the_background(pipeline, image_url):
+    """Test the first read schedules the work and later reads get the manifest"""
+    assert images.variants(image_url) is None
+    images.wait()
+    manifest = images.variants(image_url)
+
+    assert (manifest["width"], manifest["height"]) == (600, 300)
+    assert [(t["width"], t["height"]) for t in manifest["thumbnails"]] == [(160, 80), (480, 240)]
+    assert len(manifest["blurhash"]) == 28
+
+    with pipeline.test_client() as client:
+        res = client.get(manifest["thumbnails"][0]["url"])
+        assert res.status_code == 200
+        assert "immutable" in res.headers["Cache-Control"]
+        assert client.get("/api/image/" + "0" * 64 + "/160.webp").status_code == 404
+        assert client.get("/api/image/x/..%2Fmanifest.json").status_code == 404
+
+
+def test_cache_is_content_addressed(pipeline, image_url, tmp_path):
+    """Test another url with the same bytes reuses the files on disk"""
+    copy = tmp_path / "copy.png"
+    shutil.copy(image_url[len("file://"):], copy)
+    images.variants(image_url)
+    images.variants(f"file://{copy}")
+    images.wait()
+
+    first, second = images.variants(image_url), images.variants(f"file://{copy}")
+    assert first == second
+    assert len([_ for _ in os.listdir(images.directory) if _ != "urls"]) == 1
+
+
+def test_manifest_survives_a_restart(pipeline, image_url):
+    """Test a new process reads the manifest from disk instead of rebuilding it"""
+    images.variants(image_url)
+    images.wait()
+    images.init_app(pipeline)
+
+    with patch("src.helpers.images.fetch") as fetch_:
+        assert images.variants(image_url) is None
+        images.wait()
+    assert images.variants(image_url)["width"] == 600
+    assert not fetch_.called
+
+
+def test_variants_never_read_the_disk(pipeline, image_url):
+    """Test reads are served from the manifests in memory, only the worker opens files"""
+    images.variants(image_url)
+    images.wait()
+    images.init_app(pipeline)
+    reader, real_open = threading.get_ident(), open
+
+    def guarded_open(*args, **kwargs):
+        assert threading.get_ident() != reader, "disk read on the request path"
+        return real_open(*args, **kwargs)
+
+    with patch("builtins.open", guarded_open):
+        assert images.variants(image_url) is None
+        images.wait()
+        assert images.variants(image_url)["width"] == 600
+
+
+def test_failures_are_not_retried_at_once(pipeline, tmp_path):
+    """Test a broken image is remembered instead of refetched on every read"""
+    url = f"file://{tmp_path / 'missing.png'}"
+    images.variants(url)
+    images.wait()
+
+    assert images.variants(url) is None
+    assert url not in images._pending
+
+
+def test_project_to_json_exposes_variants(pipeline, image_url):
+    """Test projects carry the variants once ready and null before"""
+    project = Project(title="cover", meta="[]", image=image_url)
+    assert project.to_json["image_variants"] is None
+    images.wait()
+
+    assert project.to_json["image_variants"]["thumbnails"]
+    assert Project(title="other", meta="[]", image="file.png").to_json["image_variants"] is None
+
+
+@pytest.mark.parametrize(
+    "url",
+    [
+        "http://127.0.0.1/cover.png",
+        "http://localhost/cover.png",
+        "http://169.254.169.254/latest/meta-data",
+        "http://10.0.0.7/cover.png",
+        "http://[::ffff:192.168.0.1]/cover.png",
+        "http:///cover.png",
+    ],
+)
+def test_fetch_refuses_private_hosts(url):
+    """Test image urls can't reach the internal network"""
+    with patch("socket.create_connection") as connect, pytest.raises(ValueError):
+        fetch(url, 1024, 1)
+
+    assert not connect.called
+
+
+def test_fetch_connects_to_the_checked_address():
+    """Test a rebinding host can't pass the check and then connect to a private address"""
+    answers = iter(["93.184.216.34", "127.0.0.1"])
+
+    def getaddrinfo(host, port, *args, **kwargs):
+        return [(socket.AF_INET, socket.SOCK_STREAM, 6, "", (next(answers), port))]
+
+    with patch("socket.getaddrinfo", getaddrinfo), patch(
+        "socket.create_connection", side_effect=OSError("refused")
+    ) as connect, pytest.raises(OSError):
+        fetch("http://rebind.example/cover.png", 1024, 1)
+
+    assert connect.call_args[0][0] == ("93.184.216.34", 80)
+
+
+def test_https_keeps_the_hostname():
+    """Test TLS is verified against the hostname while the socket goes to the address"""
+    context = MagicMock()
+    conn = PublicHTTPSConnection("rebind.example", context=context)
+    answer = [(socket.AF_INET, socket.SOCK_STREAM, 6, "", ("93.184.216.34", 443))]
+    with patch("socket.getaddrinfo", return_value=answer), patch(
+        "socket.create_connection"
+    ) as connect:
+        conn.connect()
+
+    assert connect.call_args[0][0] == ("93.184.216.34", 443)
+    assert context.wrap_socket.call_args[1]["server_hostname"] == "rebind.example"
+
+
+@pytest.mark.parametrize("url", ["http://169.254.169.254/", "file:///etc/passwd"])
+def test_redirects_to_private_hosts_are_refused(url):
+    """Test a public image can't redirect to the internal network"""
+    request = Request("http://93.184.216.34/cover.png")
+    with pytest.raises(ValueError):
+        PublicRedirectHandler().redirect_request(request, None, 302, "Found", {}, url)
+
+
+def test_manifests_are_bounded(pipeline, image_url):
+    """Test the manifests in memory are an LRU of IMAGE_MANIFEST_CACHE_SIZE"""
+    images.manifest_cache_size = 2
+    images.variants(image_url)
+    images.wait()
+    for i in range(3):
+        images._remember(f"file:///{i}.png", {"width": i})
+
+    assert list(images._manifests) == ["file:///1.png", "file:///2.png"]
+    assert images.variants(image_url) is None
+    images.wait()
+    assert images.variants(image_url)["width"] == 600
+    assert list(images._manifests) == ["file:///2.png", image_url]
@@ -0,0 +1,75 @@
+"""Tests for structured, sampled and non-blocking logging"""
+import json
+import logging
+import queue
+import time
+from logging.handlers import QueueListener
+from unittest.mock import patch
+
+from src.helpers.logs import DroppingQueueHandler, JsonFormatter, SamplingFilter
+
+
+def make_record(msg, level=logging.ERROR):
+    return logging.LogRecord("app", level, __file__, 1, msg, None, None)
+
+
+@patch("src.helpers.logs.time.monotonic")
+def test_sampling_filter_limits_each_message_type(monotonic):
+    """Test a storm of one error is capped without hiding other errors"""
+    monotonic.return_value = 0
+    sampler = SamplingFilter(limit=2, interval=60)
+    storm = [sampler.filter(make_record(KeyError("title"))) for _ in range(5)]
+    other = sampler.filter(make_record(ValueError("other")))
+
+    assert storm == [True, True, False, False, False]
+    assert other is True
+
+    monotonic.return_value = 61
+    record = make_record(KeyError("title"))
+    assert sampler.filter(record) is True
+    assert record.suppressed == 3
+
+
+def test_json_formatter():
+    """Test records are rendered as one JSON object"""
+    record = make_record("Auth failure %s", logging.INFO)
+    record.args = (401,)
+    record.request_id = "abc"
+    entry = json.loads(JsonFormatter().format(record))
+
+    assert entry["message"] == "Auth failure 401"
+    assert entry["level"] == "INFO"
+    assert entry["request_id"] == "abc"
+
+
+def test_queue_handler_does_not_block_on_slow_output():
+    """Test logging returns immediately even when the writer is slow"""
+
+    class SlowHandler(logging.Handler):
+        def emit(self, record):
+            time.sleep(0.05)
+
+    log_queue = queue.Queue(5)
+    handler = DroppingQueueHandler(log_queue)
+    listener = QueueListener(log_queue, SlowHandler())
+    listener.start()
+    start = time.perf_counter()
+    for i in range(50):
+        handler.handle(make_record(f"record {i}"))
+    elapsed = time.perf_counter() - start
+    while not log_queue.empty():
+        time.sleep(0.01)
+    listener.stop()
+
+    assert elapsed < 0.05
+    assert handler.dropped > 0
+
+
+def test_request_id_header(app):
+    """Test responses carry the incoming or a generated request id"""
+    with app.test_client() as client:
+        given = client.get("/", headers={"X-Request-ID": "req-1"})
+        generated = client.get("/")
+
+    assert given.headers["X-Request-ID"] == "req-1"
+    assert len(generated.headers["X-Request-ID"]) == 32
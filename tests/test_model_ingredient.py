@@ -0,0 +1,69 @@
+"""Tests for the normalized latte ingredients"""
+import json
+
+import pytest
+
+from src.database.ingredient import LatteIngredient, parse_blob
+from src.database.latte import Latte
+from src.database.persistence import db
+from tests.conftest import ESPRESSO, OAT
+
+
+@pytest.fixture
+def lattes(tables):
+    Latte(title="oat latte", ingredients=json.dumps([OAT, ESPRESSO])).insert()
+    Latte(title="oat only", ingredients=json.dumps([OAT])).insert()
+    Latte(title="legacy", ingredients='{"some": "thing"}').insert()
+    yield tables
+
+
+def test_parse_blob():
+    """Test only lists of objects are normalized"""
+    assert parse_blob(json.dumps([OAT])) == [dict(OAT, position=0)]
+    assert parse_blob('{"some": "thing"}') == []
+    assert parse_blob(json.dumps([{"name": 3, "parts": "2"}])) == [
+        {"position": 0, "color": None, "name": None, "parts": None}
+    ]
+
+
+def test_rows_follow_the_blob(lattes):
+    """Test rows are written on insert, replaced on update and cascade on delete"""
+    latte = Latte.query.filter(Latte.title == "oat latte").one()
+    assert [row.name for row in latte.ingredient_rows] == ["oat milk", "espresso"]
+    assert latte.long()["ingredients"] == [OAT, ESPRESSO]
+
+    latte.ingredients = json.dumps([ESPRESSO])
+    latte.update()
+    assert LatteIngredient.query.filter(LatteIngredient.latte_id == latte.id).count() == 1
+
+    latte_id = latte.id
+    db.session.query(Latte).filter(Latte.id == latte_id).delete()
+    db.session.commit()
+    assert LatteIngredient.query.filter(LatteIngredient.latte_id == latte_id).count() == 0
+
+
+def test_legacy_blob_reads_back(lattes):
+    """Test blobs of another shape are still served as stored"""
+    latte = Latte.query.filter(Latte.title == "legacy").one()
+    assert latte.long()["ingredients"] == {"some": "thing"}
+    assert latte.snapshot().long() == latte.long()
+
+
+def test_usage(lattes):
+    """Test usage counts lattes and sums parts per ingredient in SQL"""
+    assert LatteIngredient.usage() == [
+        {"name": "oat milk", "lattes": 2, "parts": 4},
+        {"name": "espresso", "lattes": 1, "parts": 1.5},
+    ]
+
+
+def test_api_ingredient_endpoints(lattes):
+    """Test the aggregate endpoints read the normalized rows"""
+    with lattes.test_client() as client:
+        usage = client.get("/api/ingredient").get_json()
+        by_name = client.get("/api/ingredient/espresso/latte").get_json()
+        missing = client.get("/api/ingredient/chai/latte").get_json()
+
+    assert usage["ingredients"][0]["name"] == "oat milk"
+    assert [_["title"] for _ in by_name["lattes"]] == ["oat latte"]
+    assert missing == {"lattes": []}
@@ -0,0 +1,153 @@
+"""Tests for the online migration steps"""
+import pytest
+from sqlalchemy import Column, Integer, String, Text, inspect, text
+
+from src.database.online import (
+    MIGRATIONS,
+    AddColumn,
+    AlterType,
+    Backfill,
+    CreateIndex,
+    DropColumn,
+    OnlineMigration,
+    Step,
+    progress_table,
+)
+from src.database.persistence import db
+from src.database.project import Project
+
+
+class Interrupted(Exception):
+    pass
+
+
+@pytest.fixture
+def projects(db_testing):
+    for i in range(5):
+        db.session.add(Project(title=f"project {i}", meta="[]"))
+    db.session.commit()
+    yield db.engine
+    db.session.query(Project).delete()
+    db.session.commit()
+    if "title_upper" in columns(db.engine, "project"):
+        OnlineMigration("cleanup", [DropColumn("project", "title_upper")]).run(db.engine)
+
+
+def columns(engine, table):
+    return [c["name"] for c in inspect(engine).get_columns(table)]
+
+
+def titles(engine):
+    with engine.connect() as conn:
+        return [r[0] for r in conn.execute(text("SELECT title_upper FROM project ORDER BY id"))]
+
+
+def test_dry_run_reports_locks(projects):
+    """Test the plan estimates every step without changing the schema"""
+    migration = OnlineMigration(
+        "plan",
+        [
+            AddColumn("project", Column("title_upper", String(80))),
+            Backfill("project", "title_upper = upper(title)", batch_size=2),
+            CreateIndex("ix_project_title", "project", ["title"]),
+        ],
+    )
+    plan = migration.plan(projects)
+
+    assert [step["action"] for step in plan] == [
+        "add column project.title_upper",
+        "backfill project set title_upper = upper(title)",
+        "create index ix_project_title on project (title)",
+    ]
+    assert {step["rows"] for step in plan} == {5}
+    assert plan[1]["lock"] == "ROW EXCLUSIVE"
+    assert plan[2]["blocks"] == "writes"
+    assert all(step["lock_seconds"] <= step["seconds"] for step in plan)
+    assert "title_upper" not in columns(projects, "project")
+
+
+def test_expand_backfill_contract(projects):
+    """Test a column is added, backfilled in batches and dropped again"""
+    OnlineMigration(
+        "expand",
+        [
+            AddColumn("project", Column("title_upper", String(80))),
+            Backfill("project", "title_upper = upper(title)", batch_size=2, throttle=0),
+        ],
+    ).run(projects)
+    assert titles(projects) == [f"PROJECT {i}" for i in range(5)]
+
+    OnlineMigration("contract", [DropColumn("project", "title_upper")]).run(projects)
+    assert "title_upper" not in columns(projects, "project")
+
+
+def test_backfill_resumes(projects):
+    """Test an interrupted backfill continues after the last committed batch"""
+    OnlineMigration("add", [AddColumn("project", Column("title_upper", String(80)))]).run(projects)
+    migration = OnlineMigration(
+        "resume", [Backfill("project", "title_upper = upper(title)", batch_size=2, throttle=0)]
+    )
+    messages = []
+
+    def interrupt(message):
+        if message.startswith("project:"):
+            raise Interrupted
+
+    with pytest.raises(Interrupted):
+        migration.run(projects, report=interrupt)
+    assert titles(projects) == ["PROJECT 0", "PROJECT 1", None, None, None]
+    with projects.connect() as conn:
+        assert conn.execute(progress_table.select()).first()["rows"] == 2
+
+    with projects.begin() as conn:
+        # Rows done before the restart are not updated again
+        conn.execute(text("UPDATE project SET title_upper = 'kept' WHERE title = 'project 0'"))
+    migration.run(projects, report=messages.append)
+
+    assert titles(projects) == ["kept", "PROJECT 1", "PROJECT 2", "PROJECT 3", "PROJECT 4"]
+    assert messages[-1].startswith("project: 5 rows updated")
+    with projects.connect() as conn:
+        assert conn.execute(progress_table.select()).first() is None
+
+
+@pytest.mark.filterwarnings("ignore:Skipped unsupported reflection of expression-based index")
+def test_create_index_is_idempotent(projects):
+    """Test rerunning an index build leaves the existing index alone"""
+    migration = OnlineMigration("index", [CreateIndex("ix_project_title", "project", ["title"])])
+    migration.run(projects)
+    migration.run(projects)
+
+    indexes = [i["name"] for i in inspect(projects).get_indexes("project")]
+    assert indexes.count("ix_project_title") == 1
+    with projects.begin() as conn:
+        conn.execute(text("DROP INDEX ix_project_title"))
+
+
+def test_unsafe_steps_are_refused(projects):
+    """Test steps that would lock or rewrite the table are rejected"""
+    with pytest.raises(ValueError):
+        AddColumn("project", Column("rank", Integer, nullable=False))
+
+    rewrite = AlterType("project", "title", Integer())
+    widen = AlterType("project", "title", Text())
+    assert rewrite.rewrites(projects) and not widen.rewrites(projects)
+    with pytest.raises(RuntimeError):
+        OnlineMigration("rewrite", [rewrite]).run(projects)
+    OnlineMigration("widen", [widen]).run(projects)
+
+
+def test_steps_must_describe_and_run():
+    """Test a step missing describe() or run() fails when built, not mid-migration"""
+
+    class Vacuum(Step):
+        def describe(self):
+            return "vacuum"
+
+    with pytest.raises(TypeError):
+        Vacuum()
+
+
+def test_registered_migrations_plan(projects):
+    """Test every registered migration can be dry run against the schema"""
+    for migration in MIGRATIONS.values():
+        assert migration.plan(projects)
@@ -0,0 +1,137 @@
+"""Tests for sorted collections paged with cursors"""
+import base64
+import json
+
+import pytest
+
+from src.database.latte import Latte
+from src.database.project import Project
+from tests.conftest import OWNER
+
+TITLES = ["mocha", "americano", "latte", "cortado", "flat white"]
+
+
+@pytest.fixture
+def client(tables):
+    for title in TITLES:
+        Latte(owner=OWNER, title=title, ingredients="[]").insert()
+        Project(owner=OWNER, title=title, meta="{}").insert()
+    with tables.test_client() as client:
+        yield client
+
+
+def pages(client, **query):
+    query["owner"] = OWNER
+    while True:
+        body = client.get("/api/latte", query_string=query).get_json()
+        yield [_["title"] for _ in body["lattes"]]
+        if body["next"] is None:
+            return
+        query["cursor"] = body["next"]
+
+
+def test_pages_follow_the_sort(client):
+    """Test paging through every row in ascending and descending order"""
+    assert list(pages(client, sort="title", limit=2)) == [
+        ["americano", "cortado"],
+        ["flat white", "latte"],
+        ["mocha"],
+    ]
+    assert list(pages(client, sort="-id", limit=3)) == [TITLES[:1:-1], TITLES[1::-1]]
+    assert sum(pages(client, sort="-updated_at", limit=4), []) == TITLES[::-1]
+
+
+def test_cursor_stable_under_inserts(client):
+    """Test rows inserted before the cursor don't shift the next page"""
+    query = {"owner": OWNER, "sort": "title", "limit": 2}
+    body = client.get("/api/latte", query_string=query).get_json()
+    Latte(owner=OWNER, title="affogato", ingredients=json.dumps([])).insert()
+    query["cursor"] = body["next"]
+    body = client.get("/api/latte", query_string=query).get_json()
+
+    assert [_["title"] for _ in body["lattes"]] == ["flat white", "latte"]
+
+
+def test_whole_collection_without_limit(client):
+    """Test a request without limit still returns every row, ordered by id"""
+    body = client.get("/api/latte", query_string={"owner": OWNER}).get_json()
+
+    assert [_["title"] for _ in body["lattes"]] == TITLES
+    assert "next" not in body
+
+
+def test_projects_cursor_header(client):
+    """Test the project list, a bare array, sends its cursor in a header"""
+    query = {"owner": OWNER, "sort": "-title", "limit": 3}
+    res = client.get("/api/project", query_string=query)
+    assert [_["title"] for _ in res.get_json()] == ["mocha", "latte", "flat white"]
+    query["cursor"] = res.headers["X-Next-Cursor"]
+    res = client.get("/api/project", query_string=query)
+
+    assert [_["title"] for _ in res.get_json()] == ["cortado", "americano"]
+    assert "X-Next-Cursor" not in res.headers
+
+
+def test_multi_get_by_ids(client):
+    """Test ids are resolved in the requested order, with the missing ones reported"""
+    ids = [_.id for _ in Latte.query.order_by(Latte.id)]
+    query = {"owner": OWNER, "ids": f"{ids[3]},{ids[0]},0,{ids[3]}"}
+    body = client.get("/api/latte", query_string=query).get_json()
+
+    assert [_["title"] for _ in body["lattes"]] == ["cortado", "mocha"]
+    assert body["missing"] == [0]
+    res = client.get("/api/project", query_string=dict(query, owner="other@clients"))
+    assert res.get_json() == []
+    assert res.headers["X-Missing-Ids"] == f"{ids[3]},{ids[0]},0"
+    res = client.get("/api/latte", query_string=dict(query, sort="title"))
+    assert res.get_json()["errors"] == {"ids": "can't be combined with sort, limit or cursor"}
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        {"ids": "1,two"},
+        {"ids": ",".join(["1"] * 101)},
+        {"sort": "price"},
+        {"limit": "0"},
+        {"limit": "101"},
+        {"limit": "ten"},
+        {"cursor": "not a cursor"},
+    ],
+)
+def test_invalid_page_parameters(client, query):
+    """Test unknown sorts, out of range limits and bad cursors are refused"""
+    res = client.get("/api/latte", query_string=query)
+
+    assert res.status_code == 400
+    assert set(res.get_json()["errors"]) == set(query)
+
+
+def test_cursor_bound_to_its_sort(client):
+    """Test a cursor can't be replayed with another sort"""
+    query = {"owner": OWNER, "sort": "title", "limit": 2}
+    query["cursor"] = client.get("/api/latte", query_string=query).get_json()["next"]
+    query["sort"] = "-title"
+
+    assert client.get("/api/latte", query_string=query).status_code == 400
+
+
+@pytest.mark.parametrize(
+    "key",
+    [
+        ["title", False, ["mocha"], 1],
+        ["title", False, "mocha", "1"],
+        ["title", False, None, 1],
+        ["id", False, 1, 1.5],
+        ["id", False, True, 1],
+        ["updated_at", False, "yesterday", 1],
+        ["updated_at", False, float("nan"), 1],
+    ],
+)
+def test_cursor_values_match_the_sort(client, key):
+    """Test forged cursors with values of another type are refused like malformed ones"""
+    cursor = base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+    res = client.get("/api/latte", query_string={"sort": key[0], "cursor": cursor})
+
+    assert res.status_code == 400
+    assert res.get_json()["errors"] == {"cursor": "must be a cursor returned by a previous page"}
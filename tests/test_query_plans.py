@@ -0,0 +1,214 @@
+"""Query plan regression tests
+
+Every query the blueprints issue is captured and explained, a filtered query
+that reads a whole table of more than PLAN_SCAN_ROWS rows fails the test.
+Unfiltered reads, like listing every live latte, are expected to scan.
+"""
+import json
+import os
+import re
+import time
+
+import pytest
+from sqlalchemy import event
+
+from src.database.latte import Latte
+from src.database.persistence import db
+from src.database.project import Project
+from src.database.task import Task
+from src.helpers.tasks import tasks
+from tests.auth0_token import latte_token, project_token
+from tests.conftest import project_payload_good, token_subject, valid_payload
+
+SCAN_ROWS = int(os.getenv("PLAN_SCAN_ROWS", "100"))
+WHERE = re.compile(r"\bWHERE\b", re.IGNORECASE)
+# Leaving out the tombstones alone does not make a read filtered
+LIVE_ONLY = re.compile(r"\bWHERE \w+\.deleted_at IS NULL\s*(ORDER|GROUP|LIMIT|$)")
+latte_token = latte_token()
+project_token = project_token()
+# Rows are owned by the subjects of the tokens so they can write them
+LATTE_OWNER = token_subject("latte")
+PROJECT_OWNER = token_subject("project")
+
+
+@pytest.fixture(scope="module")
+def seeded(db_testing):
+    rows = SCAN_ROWS + 50
+    for i in range(rows):
+        ingredients = [
+            {"color": "brown", "name": "espresso", "parts": 1},
+            {"color": "white", "name": f"milk {i % 7}", "parts": 1 + i % 3},
+        ]
+        db.session.add(
+            Latte(owner=LATTE_OWNER, title=f"latte {i}", ingredients=json.dumps(ingredients))
+        )
+        db.session.add(
+            Project(owner=PROJECT_OWNER, title=f"project {i}", meta='["plan"]', image="image.png")
+        )
+    db.session.commit()
+    yield db_testing
+    db.session.query(Latte).delete()
+    db.session.query(Project).delete()
+    db.session.commit()
+
+
+def capture(engine):
+    """Collect the statements run on an engine, returns the list and a stop function"""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and re.match(r"\s*(SELECT|UPDATE|DELETE)", statement, re.I):
+            statements.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", record)
+    return statements, lambda: event.remove(engine, "before_cursor_execute", record)
+
+
+def scanned_tables(engine, statement, parameters):
+    """Tables the plan of a filtered statement reads without an index"""
+    conn = engine.raw_connection()
+    try:
+        cursor = conn.cursor()
+        if engine.dialect.name == "postgresql":
+            cursor.execute("EXPLAIN (FORMAT JSON) " + statement, parameters)
+            nodes, tables = [cursor.fetchone()[0][0]["Plan"]], set()
+            while nodes:
+                node = nodes.pop()
+                if node["Node Type"] == "Seq Scan" and "Filter" in node:
+                    tables.add(node["Relation Name"])
+                nodes.extend(node.get("Plans", []))
+            return tables
+        cursor.execute("EXPLAIN QUERY PLAN " + statement, parameters)
+        if not WHERE.search(statement) or LIVE_ONLY.search(statement):
+            return set()
+        details = [row[-1] for row in cursor.fetchall()]
+        # A scan through a partial index still reads every live row
+        return {d.split()[1] for d in details if d.startswith("SCAN ") and "COVERING" not in d}
+    finally:
+        conn.close()
+
+
+def sorts(engine, statement, parameters):
+    """Whether the plan sorts the rows instead of reading them in index order"""
+    conn = engine.raw_connection()
+    try:
+        cursor = conn.cursor()
+        if engine.dialect.name == "postgresql":
+            cursor.execute("EXPLAIN (FORMAT JSON) " + statement, parameters)
+            nodes = [cursor.fetchone()[0][0]["Plan"]]
+            while nodes:
+                node = nodes.pop()
+                if "Sort" in node["Node Type"]:
+                    return True
+                nodes.extend(node.get("Plans", []))
+            return False
+        cursor.execute("EXPLAIN QUERY PLAN " + statement, parameters)
+        return any("TEMP B-TREE FOR ORDER BY" in row[-1] for row in cursor.fetchall())
+    finally:
+        conn.close()
+
+
+def regressions(engine, statements):
+    found = []
+    for statement, parameters in statements:
+        for table in scanned_tables(engine, statement, parameters):
+            rows = engine.execute(f"SELECT count(*) FROM {table}").scalar()
+            if rows > SCAN_ROWS:
+                found.append(f"{table} ({rows} rows): {' '.join(statement.split())}")
+    return found
+
+
+def test_api_queries_use_indexes(seeded):
+    """Test the queries behind every endpoint reach their rows through an index"""
+    latte = Latte.query.filter(Latte.title == "latte 3").one().id
+    project = Project.query.filter(Project.title == "project 3").one().id
+    latte_auth = {"Authorization": f"Bearer {latte_token}"}
+    project_auth = {"Authorization": f"Bearer {project_token}"}
+
+    statements, stop = capture(db.engine)
+    with seeded.test_client() as client:
+        for url, owner in [
+            ("/api/latte", LATTE_OWNER),
+            (f"/api/latte/{latte}", LATTE_OWNER),
+            ("/api/latte/changes", LATTE_OWNER),
+            ("/api/latte/recipe", LATTE_OWNER),
+            (f"/api/latte/{latte}/recipe", LATTE_OWNER),
+            ("/api/ingredient", LATTE_OWNER),
+            ("/api/ingredient/milk 3/latte", LATTE_OWNER),
+            ("/api/stats", LATTE_OWNER),
+            ("/api/project", PROJECT_OWNER),
+            (f"/api/project/{project}", PROJECT_OWNER),
+            ("/api/project/changes", PROJECT_OWNER),
+        ]:
+            since = f"{time.time() - 60}:0"
+            res = client.get(url, query_string={"owner": owner, "since": since})
+            assert res.status_code == 200, url
+            assert res.get_json(), url
+        for url, owner in [("/api/latte", LATTE_OWNER), ("/api/project", PROJECT_OWNER)]:
+            res = client.get(url, query_string={"owner": owner, "ids": f"{latte},{project}"})
+            assert res.status_code == 200, url
+        for res in [
+            client.patch(f"/api/latte/{latte}", json=valid_payload, headers=latte_auth),
+            client.patch(
+                f"/api/project/{project}", json=project_payload_good, headers=project_auth
+            ),
+            client.delete(f"/api/latte/{latte}", headers=latte_auth),
+            client.delete(f"/api/project/{project}", headers=project_auth),
+        ]:
+            assert res.status_code == 200, res.get_json()
+    stop()
+
+    assert len(statements) > 10
+    assert regressions(db.engine, statements) == []
+
+
+def test_sorted_pages_read_in_index_order(seeded):
+    """Test every sort order of the collections pages through an index, without sorting"""
+    statements, stop = capture(db.engine)
+    with seeded.test_client() as client:
+        for url, owner in [("/api/latte", LATTE_OWNER), ("/api/project", PROJECT_OWNER)]:
+            for sort in ["id", "-id", "title", "-title", "updated_at", "-updated_at"]:
+                query = {"owner": owner, "sort": sort, "limit": 5}
+                res = client.get(url, query_string=query)
+                cursor = res.get_json().get("next") if url == "/api/latte" else None
+                query["cursor"] = cursor or res.headers["X-Next-Cursor"]
+                assert client.get(url, query_string=query).status_code == 200
+    stop()
+
+    pages = [(s, p) for s, p in statements if " LIMIT " in s]
+    assert len(pages) == 24
+    assert [s for s, p in pages if sorts(db.engine, s, p)] == []
+    assert regressions(db.engine, pages) == []
+
+
+def test_task_queue_queries_use_indexes(seeded):
+    """Test the worker finds due tasks through the status index"""
+    seeded.config["TASKS_BACKEND"] = "database"
+    tasks.init_app(seeded)
+    try:
+        for _ in range(SCAN_ROWS + 50):
+            db.session.add(Task(name="images.warm", args="[]", status="failed", run_at=0))
+        db.session.commit()
+
+        statements, stop = capture(db.engine)
+        tasks.run_due()
+        tasks.stats()
+        stop()
+    finally:
+        seeded.config["TASKS_BACKEND"] = "thread"
+        tasks.init_app(seeded)
+        db.session.query(Task).delete()
+        db.session.commit()
+
+    assert regressions(db.engine, statements) == []
+
+
+def test_harness_catches_scans(seeded):
+    """Test the harness flags a filtered query on an unindexed column"""
+    statements, stop = capture(db.engine)
+    Project.query.filter(Project.demo_link == "nowhere").all()
+    stop()
+
+    found = regressions(db.engine, statements)
+    assert len(found) == 1
+    assert found[0].startswith("project (")
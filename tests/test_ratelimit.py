@@ -0,0 +1,150 @@
+"""Tests for the rate limiting middleware"""
+import sys
+from unittest.mock import patch
+
+import pytest
+from flask import Flask
+
+from src.auth.auth import AuthError
+from src.middleware.ratelimit import MemoryStore, RateLimiter, RedisStore, limiter, parse_limit
+from tests.conftest import valid_payload
+from tests.fake_redis import FakeRedis
+
+
+def test_parse_limit():
+    """Test parsing '<count>/<period>' limits"""
+    assert parse_limit("10/minute") == (6, 10)
+    assert parse_limit("2/second") == (0.5, 2)
+
+
+@pytest.mark.parametrize("limit", ["0/minute", "-1/minute", "ten/minute", "10/fortnight"])
+def test_parse_limit_rejects_invalid(limit):
+    """Test limits that can't make a bucket are a configuration error"""
+    with pytest.raises(ValueError, match="Invalid rate limit"):
+        parse_limit(limit)
+
+
+def test_memory_store_burst_and_refill():
+    """Test the bucket allows a burst and refills over time"""
+    store = MemoryStore()
+
+    assert store.consume("k", 1, 2, now=100) == 0
+    assert store.consume("k", 1, 2, now=100) == 0
+    assert store.consume("k", 1, 2, now=100) == 1
+    assert store.consume("k", 1, 2, now=101) == 0
+    assert store.consume("other", 1, 2, now=101) == 0
+
+
+def test_memory_store_drops_refilled_buckets():
+    """Test buckets are forgotten once refilled, the oldest first, without scanning them all"""
+    store = MemoryStore()
+    for i in range(3):
+        store.consume(f"ip{i}", 1, 5, now=100 + i)
+
+    store.consume("ip0", 1, 5, now=102.5)
+    assert list(store._tats) == ["ip2", "ip0"]
+    store.consume("ip3", 1, 5, now=104)
+    assert list(store._tats) == ["ip3"]
+
+
+def test_redis_store_shares_buckets():
+    """Test two stores on the same client share a bucket"""
+    client = FakeRedis()
+    first, second = RedisStore(client), RedisStore(client)
+
+    assert first.consume("k", 60, 1, now=100) == 0
+    assert second.consume("k", 60, 1, now=100) == 60
+    assert second.consume("k", 60, 1, now=160) == 0
+
+
+def test_redis_store_needs_the_client():
+    """Test a redis url without the redis package fails at startup, saying what is missing"""
+    app = Flask(__name__)
+    app.config["RATELIMIT_STORAGE_URL"] = "redis://localhost:6379/0"
+    with patch.dict(sys.modules, {"redis": None}), pytest.raises(RuntimeError, match="redis"):
+        RateLimiter().init_app(app)
+
+
+@patch.object(limiter, "enabled", True)
+@patch.object(limiter, "store", MemoryStore())
+@patch.object(limiter, "rules", {"lattes_bp.get_latte": "2/minute"})
+def test_429_api_latte_get(app, lattes):
+    """Test GET /api/latte/1 is throttled with a Retry-After header"""
+    with app.test_client() as client:
+        statuses = [client.get("/api/latte/1").status_code for _ in range(3)]
+        res = client.get("/api/latte/1")
+    json_data = res.get_json()
+
+    assert statuses == [200, 200, 429]
+    assert json_data["error"] == 429
+    assert json_data["success"] is False
+    assert int(res.headers["Retry-After"]) > 0
+
+
+@patch.object(limiter, "enabled", True)
+@patch.object(limiter, "store", MemoryStore())
+@patch.object(limiter, "rules", {"lattes_bp.get_latte": "1/minute"})
+@patch.object(limiter, "trusted_proxies", 1)
+def test_429_per_client_behind_the_router(app, lattes):
+    """Test clients behind the router, the production setup, get a bucket each"""
+    router = {"REMOTE_ADDR": "10.1.0.1"}
+
+    def get(*forwarded_for):
+        headers = {"X-Forwarded-For": ", ".join(forwarded_for)}
+        return client.get("/api/latte/1", headers=headers, environ_base=router).status_code
+
+    with app.test_client() as client:
+        assert [get("203.0.113.1"), get("203.0.113.2")] == [200, 200]
+        # The router appends the address it saw to the header the client sent
+        assert get("198.51.100.7", "203.0.113.1") == 429
+
+
+@patch("src.auth.auth.verify_decode_jwt")
+@patch.object(limiter, "enabled", True)
+@patch.object(limiter, "store", MemoryStore())
+@patch.object(limiter, "rules", {"post:latte": "1/minute"})
+def test_429_skips_token_verification(verify, app):
+    """Test throttled requests never reach the RSA verification"""
+    verify.return_value = {"permissions": []}
+    with app.test_client() as client:
+        client.post("/api/latte", json=valid_payload, headers={"Authorization": "Bearer a.b.c"})
+        res = client.post(
+            "/api/latte", json=valid_payload, headers={"Authorization": "Bearer a.b.c"}
+        )
+
+    assert res.status_code == 429
+    assert verify.call_count == 1
+
+
+@patch("src.auth.auth.verify_decode_jwt")
+@patch.object(limiter, "enabled", True)
+@patch.object(limiter, "store", MemoryStore())
+@patch.object(limiter, "rules", {"post:latte": "1/minute"})
+def test_429_subject_only_after_verification(verify, app, lattes):
+    """Test forged tokens don't drain the bucket of the subject they claim"""
+    victim = {"permissions": ["post:latte"], "sub": "victim@clients"}
+    verify.side_effect = AuthError("Unable to parse authentication token.", 400)
+    headers = {"Authorization": "Bearer a.b.c"}
+    with app.test_client() as client:
+        forged = [
+            client.post(
+                "/api/latte",
+                json=valid_payload,
+                headers=headers,
+                environ_base={"REMOTE_ADDR": f"10.0.0.{i}"},
+            ).status_code
+            for i in range(3)
+        ]
+        verify.side_effect, verify.return_value = None, victim
+        statuses = [
+            client.post(
+                "/api/latte",
+                json=dict(valid_payload, title=f"latte {i}"),
+                headers=headers,
+                environ_base={"REMOTE_ADDR": f"10.0.1.{i}"},
+            ).status_code
+            for i in range(2)
+        ]
+
+    assert forged == [400, 400, 400]
+    assert statuses == [201, 429]
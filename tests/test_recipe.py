@@ -0,0 +1,74 @@
+"""Tests for the server side recipe layouts"""
+import json
+
+import pytest
+
+from src.database.latte import Latte
+from src.helpers.errors import InvalidPayload
+from src.helpers.recipe import DEFAULT_VOLUME, layers, parse_volume, version
+
+MOCHA = [
+    {"color": "brown", "name": "espresso", "parts": 1},
+    {"color": "white", "name": "milk", "parts": 3},
+]
+
+
+@pytest.fixture
+def lattes(tables):
+    Latte(title="mocha", ingredients=json.dumps(MOCHA)).insert()
+    Latte(title="legacy", ingredients='{"some": "thing"}').insert()
+    yield tables
+
+
+def test_layers_split_the_cup():
+    """Test ratios, volumes and stacking offsets"""
+    espresso, milk = layers(version(MOCHA), 200.0)
+
+    assert (espresso["ratio"], espresso["volume"], espresso["offset"]) == (0.25, 50, 0)
+    assert (milk["percent"], milk["volume"], milk["offset"]) == (75, 150, 25)
+
+
+def test_layers_cached_per_version():
+    """Test the same recipe is computed once and an edit is a new entry"""
+    layers.cache_clear()
+    layers(version(MOCHA), 100.0)
+    layers(version([dict(_) for _ in MOCHA]), 100.0)
+    assert layers.cache_info().hits == 1
+
+    edited = [dict(MOCHA[0], parts=2), MOCHA[1]]
+    assert layers(version(edited), 100.0)[0]["ratio"] == 0.4
+    assert layers.cache_info().misses == 2
+
+
+def test_malformed_parts_take_no_room():
+    """Test missing, negative or unhashable values do not break the layout"""
+    key = version([{"name": "milk", "parts": [1]}, {"name": {}, "parts": -1}, "x"])
+    assert [_["ratio"] for _ in layers(key, 100.0)] == [0, 0]
+    assert version({"some": "thing"}) == ()
+
+
+def test_parse_volume():
+    """Test the volume argument defaults and bounds"""
+    assert parse_volume(None) == DEFAULT_VOLUME
+    assert parse_volume("250") == 250.0
+    for raw in ("0", "-5", "a lot", "nan", "1e9"):
+        with pytest.raises(InvalidPayload):
+            parse_volume(raw)
+
+
+def test_api_recipe_endpoints(lattes):
+    """Test the single and batch recipe endpoints"""
+    latte_id = Latte.query.filter(Latte.title == "mocha").one().id
+    with lattes.test_client() as client:
+        single = client.get(f"/api/latte/{latte_id}/recipe?volume=400").get_json()
+        batch = client.get("/api/latte/recipe").get_json()
+        missing = client.get("/api/latte/999/recipe")
+        invalid = client.get(f"/api/latte/{latte_id}/recipe?volume=-1")
+
+    assert [_["volume"] for _ in single["recipe"]["layers"]] == [100, 300]
+    assert [(_["title"], len(_["layers"])) for _ in batch["recipes"]] == [
+        ("mocha", 2),
+        ("legacy", 0),
+    ]
+    assert missing.status_code == 404
+    assert invalid.get_json()["errors"] == {"volume": "must be a number above 0 and up to 10000"}
@@ -0,0 +1,224 @@
+"""Tests for the storage repositories and the in-memory backend"""
+import json
+import threading
+from unittest.mock import patch
+
+import pytest
+from flask import Flask
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import NoResultFound
+
+from src.database.latte import Latte
+from src.database.memory import MemoryRepository, WriteThroughRepository
+from src.database.pagination import parse_page
+from src.database.persistence import db
+from src.database.repository import Repository, SqlRepository
+from src.database.storage import Storage
+from src.database.tombstone import read_cursor
+from tests.conftest import ESPRESSO, OAT
+
+OWNER = "repository@clients"
+LATTES = {
+    "mocha": [ESPRESSO, {"color": "dark", "name": "chocolate", "parts": 1}],
+    "americano": [ESPRESSO],
+    "oat latte": [ESPRESSO, OAT],
+    "cortado": [dict(ESPRESSO, parts=0.5), OAT],
+}
+
+
+@pytest.fixture
+def tenant(tables):
+    """Request context of OWNER, rows are written and read as that tenant"""
+    with tables.test_request_context(query_string={"owner": OWNER}):
+        yield
+
+
+def seed(repository):
+    for title, ingredients in LATTES.items():
+        repository.add(title=title, ingredients=json.dumps(ingredients))
+    return repository
+
+
+def pages(repository, args):
+    args = dict(args)
+    while True:
+        rows, cursor = repository.list(parse_page(args))
+        yield [row.title for row in rows]
+        if cursor is None:
+            return
+        args["cursor"] = cursor
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        {},
+        {"sort": "title", "limit": "3"},
+        {"sort": "-title", "limit": "1"},
+        {"sort": "-updated_at", "limit": "2"},
+        {"sort": "-id", "limit": "3"},
+    ],
+)
+def test_memory_pages_like_sql(tenant, args):
+    """Test the memory indexes page in the order of the table indexes"""
+    sql, memory = seed(SqlRepository(Latte)), seed(MemoryRepository(Latte))
+
+    assert list(pages(memory, args)) == list(pages(sql, args))
+
+
+@pytest.mark.parametrize("sort", ["title", "-title"])
+def test_memory_pages_null_titles_like_sql(tenant, sort):
+    """Test rows without a title page as '' on both backends, none is skipped"""
+    sql, memory = seed(SqlRepository(Latte)), seed(MemoryRepository(Latte))
+    for repository in (sql, memory):
+        for _ in range(2):
+            repository.add(title=None, ingredients="[]")
+
+    titles = list(pages(memory, {"sort": sort, "limit": "1"}))
+    assert titles == list(pages(sql, {"sort": sort, "limit": "1"}))
+    assert sorted(title or "" for page in titles for title in page) == ["", ""] + sorted(LATTES)
+
+
+def test_memory_ingredients_like_sql(tenant):
+    """Test lattes by ingredient and the usage counts match the normalized rows"""
+    sql, memory = seed(SqlRepository(Latte)), seed(MemoryRepository(Latte))
+    memory.delete(1)
+    sql.delete(1)
+
+    assert memory.usage() == sql.usage()
+    assert [_.long() for _ in memory.by_ingredient("oat milk")] == [
+        _.long() for _ in sql.by_ingredient("oat milk")
+    ]
+
+
+def test_memory_scopes_rows_by_tenant(db_testing):
+    """Test rows of another tenant are missing and titles are unique per tenant"""
+    memory = MemoryRepository(Latte)
+    other = memory.add(owner="other@clients", title="mocha", ingredients="[]")
+    with db_testing.test_request_context(query_string={"owner": OWNER}):
+        mocha = memory.add(title="mocha", ingredients="[]")
+        with pytest.raises(IntegrityError):
+            memory.add(title="mocha", ingredients="[]")
+        with pytest.raises(NoResultFound):
+            memory.get(other.id)
+
+        assert memory.get_many([other.id, mocha.id]) == ([mocha], [other.id])
+        assert memory.list()[0] == [mocha]
+        memory.delete(mocha.id)
+        assert memory.add(title="mocha", ingredients="[]").id == 3
+        live, deleted, last = memory.changes((0.0, 0))
+        assert ([_.id for _ in live], deleted) == ([3], [mocha.id])
+        assert memory.changes(read_cursor(last)) == ([], [], None)
+
+
+@pytest.fixture
+def selects():
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", record)
+    yield statements
+    event.remove(db.engine, "before_cursor_execute", record)
+
+
+def test_write_through_reads_from_memory(tenant, selects):
+    """Test reads skip the database and see their own writes at once"""
+    lattes = WriteThroughRepository(SqlRepository(Latte), refresh=60)
+    seed(lattes)
+    selects.clear()
+
+    assert [_.title for _ in lattes.list(parse_page({"sort": "title"}))[0]] == sorted(LATTES)
+    assert lattes.get(2).title == "americano"
+    assert [_.title for _ in lattes.by_ingredient("oat milk")] == ["oat latte", "cortado"]
+    assert selects == []
+    lattes.update(2, title="long black")
+    lattes.delete(1)
+    assert lattes.get_many([1, 2]) == ([lattes.memory.get(2)], [1])
+    assert lattes.get(2).title == "long black"
+
+
+def test_write_through_syncs_other_writers(tenant):
+    """Test writes of other processes show up once the refresh interval passed"""
+    lattes = WriteThroughRepository(SqlRepository(Latte), refresh=60)
+    seed(lattes)
+    Latte(title="flat white", ingredients=json.dumps([OAT])).insert()
+
+    with pytest.raises(NoResultFound):
+        lattes.get(5)
+    lattes.refresh = 0
+    assert lattes.get(5).ingredients == [OAT]
+    assert {"name": "oat milk", "lattes": 3, "parts": 6} in lattes.usage()
+
+
+def test_write_through_syncs_every_tenant_at_once(tables):
+    """Test owners asked for don't get a sync or a namespace of their own"""
+    lattes = WriteThroughRepository(SqlRepository(Latte), refresh=60)
+    for owner in ("a@clients", "b@clients"):
+        Latte(owner=owner, title="mocha", ingredients="[]").insert()
+
+    with patch.object(lattes.backing, "changes", wraps=lattes.backing.changes) as feed:
+        for owner in ("a@clients", "b@clients", "nobody@clients"):
+            with tables.test_request_context(query_string={"owner": owner}):
+                assert len(lattes.list()[0]) == (owner != "nobody@clients")
+
+    assert feed.call_count == 2
+    assert set(lattes.memory._tenants) == {"a@clients", "b@clients"}
+
+
+def test_write_through_reads_during_a_sync(tables, tenant):
+    """Test a slow sync doesn't hold up the reads of other threads"""
+    lattes = WriteThroughRepository(SqlRepository(Latte), refresh=60)
+    seed(lattes)
+    lattes.refresh = 0
+    paging, resume = threading.Event(), threading.Event()
+    changes = lattes.backing.changes
+
+    def slow_changes(cursor, everyone=False):
+        paging.set()
+        resume.wait(5)
+        return changes(cursor, everyone)
+
+    with patch.object(lattes.backing, "changes", side_effect=slow_changes):
+        synced = []
+
+        def sync():
+            with tables.app_context():
+                lattes.sync()
+                synced.append(lattes.memory.get(2).title)
+
+        syncing = threading.Thread(target=sync)
+        syncing.start()
+        assert paging.wait(5)
+        assert lattes.get(2).title == "americano"
+        resume.set()
+        syncing.join()
+
+    assert synced == ["americano"]
+
+
+def test_repositories_must_implement_the_interface():
+    """Test a repository missing a method fails when built, not on the request using it"""
+
+    class ReadOnly(Repository):
+        def get(self, row_id):
+            return None
+
+    with pytest.raises(TypeError):
+        ReadOnly(Latte)
+
+
+def test_storage_backends():
+    """Test the memory backend wraps the database repositories"""
+    app, storage = Flask(__name__), Storage()
+    app.config.update(STORAGE_BACKEND="memory", STORAGE_REFRESH=5, TOMBSTONE_RETENTION=60)
+    storage.init_app(app)
+    assert isinstance(storage.lattes.backing, SqlRepository)
+    assert storage.projects.refresh == 5
+
+    app.config["STORAGE_BACKEND"] = "disk"
+    with pytest.raises(RuntimeError):
+        storage.init_app(app)
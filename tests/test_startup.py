@@ -0,0 +1,9 @@
+"""Startup regression checks for the app factory"""
+from benchmarks.startup import LAZY_MODULES, loaded_modules
+
+
+def test_create_app_keeps_heavy_modules_lazy():
+    """Test building the app does not import migration or crypto packages"""
+    eager = [m for m in loaded_modules() if m.split(".")[0] in LAZY_MODULES]
+
+    assert eager == []
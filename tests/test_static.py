@@ -0,0 +1,75 @@
+"""Tests for the static snapshot of the public API"""
+import gzip
+import json
+from unittest.mock import patch
+
+import pytest
+
+from src.database.latte import Latte
+from src.database.project import Project
+from src.helpers.static import static_export
+from src.helpers.tasks import tasks
+from tests.auth0_token import latte_token
+from tests.conftest import OAT, valid_payload
+
+
+@pytest.fixture
+def export(tables, tmp_path):
+    Latte(title="flat white", ingredients=json.dumps([OAT])).insert()
+    Latte(owner="other@clients", title="cortado", ingredients=json.dumps([OAT])).insert()
+    Project(title="mothership", meta='["flask"]').insert()
+    tables.config["STATIC_EXPORT_DIR"] = str(tmp_path)
+    static_export.init_app(tables)
+    yield tmp_path
+    tasks.wait()
+    tables.config["STATIC_EXPORT_DIR"] = None
+    static_export.init_app(tables)
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return json.loads(f.read())
+
+
+def test_files_match_the_endpoints(db_testing, export):
+    """Test every public resource is rendered as its endpoint returns it, gzipped too"""
+    static_export.build(full=True)
+    latte = Latte.query.filter(Latte.title == "flat white").one().id
+    project = Project.query.one().id
+
+    with db_testing.test_client() as client:
+        for url in ["/api/latte", f"/api/latte/{latte}", "/api/project", f"/api/project/{project}"]:
+            assert read(export / f"{url[1:]}.json") == client.get(url).get_json(), url
+    with gzip.open(export / "api" / "latte.json.gz") as f:
+        assert json.load(f) == read(export / "api" / "latte.json")
+    assert sorted(p.name for p in (export / "api" / "latte").glob("*.json")) == [f"{latte}.json"]
+
+
+def test_writes_rebuild_what_they_touched(export):
+    """Test a commit queues a build that renders only the rows written since the last one"""
+    assert static_export.build() == {"latte": 1, "project": 1}
+    assert static_export.build() == {"latte": 0, "project": 0}
+
+    latte = Latte(title="cortado", ingredients=json.dumps([OAT]))
+    latte.insert()
+    assert tasks.wait()
+    assert read(export / "api" / "latte" / f"{latte.id}.json")["lattes"]["title"] == "cortado"
+    assert len(read(export / "api" / "latte.json")["lattes"]) == 2
+
+    latte.delete()
+    assert tasks.wait()
+    assert not (export / "api" / "latte" / f"{latte.id}.json").exists()
+    assert len(read(export / "api" / "latte.json")["lattes"]) == 1
+    assert static_export.build() == {"latte": 0, "project": 0}
+
+
+def test_api_writes_are_exported(db_testing, export):
+    """Test a latte created through the API is rendered, it belongs to the exported tenant"""
+    headers = {"Authorization": f"Bearer {latte_token()}"}
+    with patch.dict(db_testing.config, TENANCY_ENABLED=False), db_testing.test_client() as client:
+        res = client.post("/api/latte", json=valid_payload, headers=headers)
+        latte_id = res.get_json()["lattes"][0]["id"]
+        assert tasks.wait()
+
+    assert read(export / "api" / "latte" / f"{latte_id}.json")["lattes"]["id"] == latte_id
+    assert len(read(export / "api" / "latte.json")["lattes"]) == 2
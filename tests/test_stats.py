@@ -0,0 +1,82 @@
+"""Tests for the counters behind /api/stats"""
+import json
+from unittest.mock import MagicMock
+
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from src.database.bulk import TABLES, export_table, import_table
+from src.database.latte import Latte
+from src.database.persistence import db
+from src.database.project import Project
+from src.database.stats import Stat, previous, rebuild
+from tests.conftest import ESPRESSO, OAT, OWNER
+
+
+@pytest.fixture
+def client(tables):
+    Latte(owner=OWNER, title="flat white", ingredients=json.dumps([ESPRESSO, OAT])).insert()
+    Latte(owner=OWNER, title="cortado", ingredients=json.dumps([ESPRESSO])).insert()
+    Project(owner=OWNER, title="mothership", meta='["flask", "api"]').insert()
+    Project(owner="other@clients", title="mothership", meta='["flask"]').insert()
+    with tables.test_client() as client:
+        yield client
+
+
+def stats(client, owner=OWNER):
+    return client.get("/api/stats", query_string={"owner": owner}).get_json()
+
+
+def test_counts_per_tenant(client):
+    """Test the totals, ingredients and tags of a tenant"""
+    assert stats(client) == {
+        "lattes": 2,
+        "projects": 1,
+        "ingredients": [{"name": "espresso", "lattes": 2}, {"name": "oat milk", "lattes": 1}],
+        "tags": [{"name": "api", "projects": 1}, {"name": "flask", "projects": 1}],
+    }
+    assert stats(client, "nobody") == {"lattes": 0, "projects": 0, "ingredients": [], "tags": []}
+
+
+def test_writes_update_counts(client):
+    """Test updates move the counts and deletes take them back"""
+    cortado = Latte.query.filter(Latte.title == "cortado").one()
+    cortado.ingredients = json.dumps([OAT, OAT])
+    cortado.update()
+    project = Project.query.filter(Project.owner == OWNER).one()
+    project.update(project.title, '["api"]', None, None, None, None)
+    Latte.query.filter(Latte.title == "flat white").one().delete()
+
+    assert stats(client) == {
+        "lattes": 1,
+        "projects": 1,
+        "ingredients": [{"name": "oat milk", "lattes": 1}],
+        "tags": [{"name": "api", "projects": 1}],
+    }
+
+
+def test_imports_and_rebuild_match_writes(client, tmp_path):
+    """Test bulk imports count their rows and a rebuild finds the same counts"""
+    expected = stats(client)
+    path = str(tmp_path / "latte.ndjson")
+    export_table(db.engine, TABLES["latte"], path)
+    db.session.query(Latte).delete()
+    db.session.commit()
+    rebuild(db.engine)
+    assert stats(client)["lattes"] == 0
+
+    import_table(db.engine, TABLES["latte"], path)
+    assert stats(client) == expected
+    db.session.query(Stat).delete()
+    db.session.commit()
+    assert rebuild(db.engine) == 8
+    assert stats(client) == expected
+
+
+def test_previous_values_are_locked():
+    """Test the row a delta is computed from stays locked until the commit"""
+    conn = MagicMock()
+    previous(conn, Latte.__table__, 1)
+    query = conn.execute.call_args[0][0]
+
+    assert str(query.compile(dialect=postgresql.dialect())).endswith("FOR UPDATE")
@@ -0,0 +1,167 @@
+"""Tests for the background task queue"""
+import json
+import threading
+import time
+from unittest.mock import PropertyMock, patch
+
+import pytest
+
+from src.database.latte import Latte
+from src.database.persistence import db
+from src.database.project import Project
+from src.database.task import FAILED, QUEUED, RUNNING, Task
+from src.helpers.images import ImagePipeline
+from src.helpers.tasks import tasks
+from tests.auth0_token import project_token
+
+calls = []
+
+
+@tasks.task("tests.record")
+def record(value):
+    calls.append(value)
+
+
+@tasks.task("tests.flaky")
+def flaky(value):
+    calls.append(value)
+    if len(calls) < 3:
+        raise RuntimeError("not yet")
+
+
+@pytest.fixture
+def queue(db_testing, request):
+    db_testing.config.update(
+        TASKS_BACKEND=getattr(request, "param", "thread"),
+        TASKS_RETRY_BACKOFF=0.01,
+        TASKS_MAX_ATTEMPTS=3,
+    )
+    tasks.init_app(db_testing)
+    calls.clear()
+    with db_testing.app_context():
+        yield tasks
+        tasks.wait()
+        db.session.rollback()
+        db.session.query(Task).delete()
+        db.session.query(Latte).delete()
+        db.session.query(Project).delete()
+        db.session.commit()
+    db_testing.config["TASKS_BACKEND"] = "thread"
+    tasks.init_app(db_testing)
+
+
+def test_runs_after_commit_only(queue):
+    """Test tasks wait for the commit and are dropped on rollback"""
+    queue.on_commit(db.session, "tests.record", "rolled back")
+    db.session.rollback()
+    queue.on_commit(db.session, "tests.record", "committed")
+    assert calls == []
+
+    db.session.commit()
+    assert queue.wait()
+    assert calls == ["committed"]
+
+
+def test_thread_backend_retries(queue):
+    """Test a failing task is retried with backoff until it succeeds"""
+    before = queue.stats()
+    queue.enqueue("tests.flaky", "x")
+
+    assert queue.wait()
+    assert calls == ["x", "x", "x"]
+    with queue.app.test_client() as client:
+        assert client.get("/tasks").status_code == 401
+        headers = {"Authorization": f"Bearer {project_token()}"}
+        stats = client.get("/tasks", headers=headers).get_json()
+    assert stats["succeeded"] == before["succeeded"] + 1
+    assert (stats["queued"], stats["running"], stats["retrying"]) == (0, 0, 0)
+
+
+def test_thread_backend_gives_up(queue):
+    """Test a task stops after the max attempts and is counted as failed"""
+    before = queue.stats()["failed"]
+    with patch.dict(tasks.functions, {"tests.flaky": lambda value: 1 / 0}):
+        queue.enqueue("tests.flaky", "x")
+        assert queue.wait()
+
+    assert queue.stats()["failed"] == before + 1
+
+
+def test_unknown_task_is_refused(queue):
+    """Test queueing a name nobody registered fails at the call site"""
+    with pytest.raises(KeyError):
+        queue.on_commit(db.session, "tests.missing")
+
+
+@pytest.mark.parametrize("queue", ["database"], indirect=True)
+def test_database_backend_is_transactional(queue):
+    """Test the task row commits with the change and is deleted once it ran"""
+    queue.on_commit(db.session, "tests.record", "gone")
+    db.session.rollback()
+    Latte(title="queued", ingredients="[]").insert()
+    queue.on_commit(db.session, "tests.record", "kept")
+    db.session.commit()
+
+    assert [json.loads(t.args) for t in Task.query.all()] == [["kept"]]
+    assert queue.stats()["queued"] == 1
+    assert queue.run_due() == 1
+    assert calls == ["kept"]
+    assert Task.query.count() == 0
+
+
+@pytest.mark.parametrize("queue", ["database"], indirect=True)
+def test_database_backend_retries_and_fails(queue):
+    """Test failures are rescheduled with backoff and parked after the max attempts"""
+    with patch.dict(tasks.functions, {"tests.record": lambda value: 1 / 0}):
+        queue.enqueue("tests.record", "x")
+        for _ in range(3):
+            time.sleep(0.05)
+            assert queue.run_due() == 1
+
+    task = Task.query.one()
+    assert (task.status, task.attempts) == (FAILED, 3)
+    assert "division by zero" in task.last_error
+    assert queue.run_due() == 0
+
+
+@pytest.mark.parametrize("queue", ["database"], indirect=True)
+def test_database_backend_reclaims_expired_leases(queue):
+    """Test a task claimed by a worker that died runs again after its lease"""
+    db.session.add(Task(name="tests.record", args='["late"]', status=RUNNING, run_at=0))
+    db.session.add(Task(name="tests.record", args='["later"]', status=QUEUED, run_at=2e9))
+    db.session.commit()
+
+    assert queue.run_due() == 1
+    assert calls == ["late"]
+
+
+@pytest.mark.parametrize("queue", ["database"], indirect=True)
+def test_database_worker_survives_errors(queue):
+    """Test the worker logs and backs off when the table can't be read"""
+    stop, outcomes = threading.Event(), [RuntimeError("db down"), RuntimeError("db down"), 1]
+
+    def run_due():
+        outcome = outcomes.pop(0)
+        if not outcomes:
+            stop.set()
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    with patch.object(queue, "run_due", side_effect=run_due), patch.object(
+        queue.logger, "exception"
+    ) as log:
+        queue.run_worker(stop)
+
+    assert outcomes == []
+    assert log.call_count == 2
+
+
+def test_project_write_warms_image(queue):
+    """Test saving a project queues its image variants after the commit"""
+    with patch.object(ImagePipeline, "enabled", PropertyMock(return_value=True)):
+        with patch.dict(tasks.functions, {"images.warm": record}):
+            Project(title="warm", meta="[]", image="https://cdn.example.com/a.png").insert()
+            assert queue.wait()
+
+    assert calls == ["https://cdn.example.com/a.png"]
@@ -0,0 +1,85 @@
+"""Tests for rows partitioned by tenant"""
+from unittest.mock import patch
+
+import pytest
+from flask import current_app
+
+from src.database.cache import IdentityCache
+from src.database.latte import Latte
+from tests.auth0_token import LIVE_AUTH0, latte_token, local_auth0
+from tests.conftest import OWNER, valid_payload
+
+pytestmark = pytest.mark.skipif(LIVE_AUTH0, reason="needs tokens for a second subject")
+
+latte_token = latte_token()
+
+
+@pytest.fixture
+def client(tables):
+    other = local_auth0.mint("latte", subject="other@clients")
+    with tables.test_client() as client:
+        client.auth = {"Authorization": f"Bearer {latte_token}"}
+        client.other = {"Authorization": f"Bearer {other}"}
+        yield client
+
+
+def test_writes_belong_to_the_subject(client):
+    """Test a new latte is owned by the token subject and listed for that owner only"""
+    res = client.post("/api/latte", json=valid_payload, headers=client.auth)
+    latte_id = res.get_json()["lattes"][0]["id"]
+
+    assert Latte.query.get(latte_id).owner == OWNER
+    assert client.get("/api/latte").get_json()["lattes"] == []
+    assert client.get(f"/api/latte/{latte_id}").status_code == 404
+    lattes = client.get("/api/latte", query_string={"owner": OWNER}).get_json()["lattes"]
+    assert [_["id"] for _ in lattes] == [latte_id]
+    usage = client.get("/api/ingredient", query_string={"owner": "other@clients"})
+    assert usage.get_json()["ingredients"] == []
+
+
+def test_one_tenant_without_tenancy(client):
+    """Test with tenancy off, rows written through the API are the ones anonymous reads see"""
+    with patch.dict(current_app.config, TENANCY_ENABLED=False):
+        res = client.post("/api/latte", json=valid_payload, headers=client.auth)
+        latte_id = res.get_json()["lattes"][0]["id"]
+
+        assert Latte.query.get(latte_id).owner == current_app.config["DEFAULT_TENANT"]
+        assert [_["id"] for _ in client.get("/api/latte").get_json()["lattes"]] == [latte_id]
+        assert client.get(f"/api/latte/{latte_id}").status_code == 200
+        assert client.get("/api/stats").get_json()["lattes"] == 1
+        res = client.patch(f"/api/latte/{latte_id}", json=valid_payload, headers=client.other)
+        assert res.status_code == 200
+
+
+def test_other_tenants_rows_are_not_found(client):
+    """Test a subject can't change or delete the rows of another"""
+    res = client.post("/api/latte", json=valid_payload, headers=client.auth)
+    latte_id = res.get_json()["lattes"][0]["id"]
+    res = client.patch(f"/api/latte/{latte_id}", json=valid_payload, headers=client.other)
+
+    assert res.status_code == 404
+    assert client.delete(f"/api/latte/{latte_id}", headers=client.other).status_code == 404
+    assert client.delete(f"/api/latte/{latte_id}", headers=client.auth).status_code == 200
+
+
+def test_titles_unique_per_tenant(client):
+    """Test two tenants can use the same title, one tenant can't twice"""
+    assert client.post("/api/latte", json=valid_payload, headers=client.auth).status_code == 201
+    assert client.post("/api/latte", json=valid_payload, headers=client.other).status_code == 201
+    assert client.post("/api/latte", json=valid_payload, headers=client.auth).status_code == 409
+
+
+def test_cache_namespaces_per_tenant():
+    """Test a tenant is capped so it can't evict the rows of the others"""
+    cache = IdentityCache(maxsize=4, tenant_size=2)
+    cache.put("latte", 1, "small", tenant="small")
+    for row_id in range(10, 15):
+        cache.put("latte", row_id, "large", tenant="large")
+
+    assert len(cache) == 3
+    assert cache.get("latte", 1, tenant="small") == "small"
+    assert cache.get("latte", 1, tenant="large") is None
+    assert cache.get("latte", 14, tenant="large") == "large"
+    cache.invalidate("latte", 14)
+    assert cache.get("latte", 14, tenant="large") is None
+    assert len(cache) == 2
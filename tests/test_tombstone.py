@@ -0,0 +1,182 @@
+"""Tests for soft deletes, the changes feed and the purge"""
+import json
+import time
+from unittest.mock import MagicMock, patch
+
+import pytest
+from sqlalchemy.dialects import postgresql
+from werkzeug.exceptions import Gone
+
+from src.database.ingredient import LatteIngredient
+from src.database.latte import Latte
+from src.database.persistence import db
+from src.database.tombstone import (
+    changes,
+    commit_time,
+    format_cursor,
+    parse_cursor,
+    purge,
+    purged_through,
+    read_cursor,
+    watermark,
+)
+from tests.auth0_token import latte_token
+from tests.conftest import OAT, OWNER
+
+latte_token = latte_token()
+
+
+@pytest.fixture
+def lattes(tables):
+    for title in ["first", "second", "third"]:
+        Latte(owner=OWNER, title=title, ingredients=json.dumps([OAT])).insert()
+    yield tables
+
+
+def by_title(title):
+    return Latte.with_deleted().filter(Latte.title == title).one()
+
+
+def test_delete_leaves_a_tombstone(lattes):
+    """Test a deleted latte is hidden from queries but kept in the table"""
+    latte = by_title("second")
+    latte_id = latte.id
+    with lattes.test_client() as client:
+        res = client.delete(
+            f"/api/latte/{latte_id}", headers={"Authorization": f"Bearer {latte_token}"}
+        )
+        assert res.status_code == 200
+        assert client.get(f"/api/latte/{latte_id}?owner={OWNER}").status_code == 404
+        lattes = client.get(f"/api/latte?owner={OWNER}").get_json()["lattes"]
+        usage = client.get(f"/api/ingredient?owner={OWNER}").get_json()["ingredients"]
+
+    assert [_["title"] for _ in lattes] == ["first", "third"]
+    assert usage == [{"name": "oat milk", "lattes": 2, "parts": 4}]
+    assert Latte.query.get(latte_id) is None
+    assert by_title("second").deleted_at is not None
+
+
+def test_title_free_after_delete(lattes):
+    """Test a new latte can take the title of a deleted one"""
+    by_title("first").delete()
+    Latte(owner=OWNER, title="first", ingredients="[]").insert()
+
+    assert Latte.with_deleted().filter(Latte.title == "first").count() == 2
+    assert Latte.query.filter(Latte.title == "first").count() == 1
+
+
+def test_changes_include_tombstones(lattes):
+    """Test the feed pages through writes and reports deleted ids"""
+    live, deleted, cursor = changes(Latte, (0.0, 0), limit=2)
+    assert [_.title for _ in live] == ["first", "second"]
+    live, deleted, cursor = changes(Latte, parse_cursor(cursor, "latte"), limit=2)
+    assert [_.title for _ in live] == ["third"]
+
+    second = by_title("second")
+    second.delete()
+    with lattes.test_client() as client:
+        query = {"since": cursor, "owner": OWNER}
+        res = client.get("/api/latte/changes", query_string=query).get_json()
+        assert (res["lattes"], res["deleted"]) == ([], [second.id])
+        query["since"] = res["cursor"]
+        res = client.get("/api/latte/changes", query_string=query).get_json()
+        assert res == {"lattes": [], "deleted": [], "cursor": query["since"]}
+
+        assert client.get("/api/latte/changes?since=bad").status_code == 400
+        assert client.get("/api/latte/changes?since=inf:1").status_code == 400
+
+
+def test_changes_page_through_old_rows(lattes):
+    """Test cursors of rows older than the retention, e.g. stamped 0 by the migration, go on"""
+    db.session.execute(Latte.__table__.update().values(updated_at=0))
+    db.session.commit()
+
+    live, _, cursor = changes(Latte, (0.0, 0), limit=2)
+    assert [_.title for _ in live] == ["first", "second"]
+    live, _, cursor = changes(Latte, parse_cursor(cursor, "latte"), limit=2)
+    assert [_.title for _ in live] == ["third"]
+    with lattes.test_client() as client:
+        res = client.get("/api/latte/changes", query_string={"since": cursor, "owner": OWNER})
+        assert res.status_code == 200
+
+
+def test_rows_are_stamped_at_commit(lattes):
+    """Test a write flushed before a cursor was read but committed after it isn't skipped"""
+    late = by_title("first")
+    late.title = "late"
+    db.session.flush()
+    # Where a reader got to in the writes other transactions committed meanwhile
+    cursor = (time.time(), 0)
+    db.session.commit()
+
+    live, _, last = changes(Latte, cursor)
+    assert [_.title for _ in live] == ["late"]
+    assert read_cursor(last) == (by_title("late").updated_at, late.id)
+
+
+def test_commit_time_on_postgres():
+    """Test Postgres stamps with its clock, without a lock writers would queue on"""
+    conn = MagicMock()
+    conn.dialect = postgresql.dialect()
+    conn.execute.return_value.scalar.return_value = 1.5
+
+    assert commit_time(conn) == 1.5
+    clock, = [str(_[0][0].compile(dialect=conn.dialect)) for _ in conn.execute.call_args_list]
+    assert "EXTRACT(epoch FROM clock_timestamp())" in clock
+
+
+def test_watermark_on_postgres():
+    """Test the feed stops at the oldest transaction still writing, read afresh"""
+    conn = MagicMock()
+    conn.dialect = postgresql.dialect()
+    conn.execute.return_value.scalar.return_value = 2.5
+
+    assert watermark(conn) == 2.5
+    calls = conn.execute.call_args_list
+    clear, oldest = [str(_[0][0].compile(dialect=conn.dialect)) for _ in calls]
+    assert "pg_stat_clear_snapshot()" in clear
+    assert "min(xact_start)" in oldest and "backend_xid IS NOT NULL" in oldest
+
+
+def test_changes_stop_at_the_watermark(lattes):
+    """Test rows stamped after the start of a transaction still writing wait for it"""
+    first = by_title("first")
+    with patch("src.database.tombstone.watermark", return_value=first.updated_at):
+        assert changes(Latte, (0.0, 0)) == ([], [], None)
+    with patch("src.database.tombstone.watermark", return_value=by_title("third").updated_at):
+        assert [_.title for _ in changes(Latte, (0.0, 0))[0]] == ["first", "second"]
+
+
+def test_purge_removes_old_tombstones(lattes):
+    """Test only tombstones past the retention are purged, with their ingredients"""
+    first, second = by_title("first"), by_title("second")
+    first.delete()
+    second.delete()
+    first.deleted_at = time.time() - 3600
+    db.session.commit()
+    first_id = first.id
+
+    purged = purge(db.engine, Latte.__table__, time.time() - 60, batch_size=1, pause=0)
+
+    assert purged == 1
+    assert Latte.with_deleted().count() == 2
+    assert LatteIngredient.query.filter(LatteIngredient.latte_id == first_id).count() == 0
+    assert purge(db.engine, Latte.__table__, time.time(), pause=0, deadline=0) == 0
+
+
+def test_cursors_before_a_purge_are_gone(lattes):
+    """Test only the cursors that could have missed a purged delete are refused"""
+    first = by_title("first")
+    first.delete()
+    first.deleted_at = time.time() - 3600
+    db.session.commit()
+    horizon = (first.updated_at, first.id)
+    purge(db.engine, Latte.__table__, time.time() - 60, pause=0)
+
+    assert purged_through(db.session, "latte") == horizon
+    assert parse_cursor(format_cursor(*horizon), "latte") == horizon
+    with pytest.raises(Gone):
+        parse_cursor(format_cursor(horizon[0], horizon[1] - 1), "latte")
+    with lattes.test_client() as client:
+        assert client.get("/api/latte/changes?since=1:1").status_code == 410
+        assert client.get("/api/project/changes?since=1:1").status_code == 200
@@ -0,0 +1,103 @@
+"""Tests for the payload validation layer"""
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from src.apis.lattes import LATTE
+from src.apis.projects import PROJECT
+from src.database.storage import storage
+from src.helpers.errors import InvalidPayload
+from tests.auth0_token import latte_token, project_token
+from tests.conftest import project_payload_good, valid_payload
+
+latte_token = latte_token()
+project_token = project_token()
+
+
+def test_latte_schema_accepts_valid_payload():
+    """Test a valid payload comes back with only the declared fields"""
+    assert LATTE.validate(dict(valid_payload, extra=1)) == valid_payload
+
+
+def test_latte_schema_reports_every_error():
+    """Test all field errors are collected, nested ones with their path"""
+    payload = {
+        "title": "not-so-good$",
+        "ingredients": [{"color": "black", "name": "milk", "parts": "2"}, {"name": ""}],
+    }
+    with pytest.raises(InvalidPayload) as err:
+        LATTE.validate(payload)
+
+    assert err.value.errors == {
+        "title": "contains invalid characters",
+        "ingredients[0].parts": "must be a number",
+        "ingredients[1].color": "is required",
+        "ingredients[1].name": "must have at least 1 characters or items",
+        "ingredients[1].parts": "is required",
+    }
+
+
+def test_latte_schema_partial():
+    """Test partial payloads validate what is present and need at least one field"""
+    assert LATTE.validate({"title": "flat white"}, partial=True) == {"title": "flat white"}
+
+    with pytest.raises(InvalidPayload) as err:
+        LATTE.validate({"other": 1}, partial=True)
+    assert list(err.value.errors) == ["payload"]
+
+
+def test_schema_rejects_non_objects():
+    """Test a missing or non object body is a single payload error"""
+    for data in (None, [], "latte"):
+        with pytest.raises(InvalidPayload) as err:
+            LATTE.validate(data)
+        assert err.value.errors == {"payload": "must be an object"}
+
+
+def test_project_schema_types_and_lengths():
+    """Test nullable fields, list items and the serialized length limit"""
+    assert PROJECT.validate(dict(project_payload_good, demo_link=None))["demo_link"] is None
+
+    with pytest.raises(InvalidPayload) as err:
+        PROJECT.validate(dict(project_payload_good, meta=["x" * 300], title=3))
+    assert err.value.errors == {
+        "title": "must be a string",
+        "meta": "must serialize to at most 300 characters",
+    }
+
+
+@patch.object(storage, "lattes")
+def test_api_latte_invalid_payload_skips_database(lattes, app):
+    """Test the 400 lists the field errors and no query runs"""
+    with app.test_client() as client:
+        res = client.patch(
+            "/api/latte/1",
+            json={"ingredients": "espresso"},
+            headers={"Authorization": f"Bearer {latte_token}"},
+        )
+    json_data = res.get_json()
+
+    assert res.status_code == 400
+    assert json_data["errors"] == {"ingredients": "must be a list"}
+    assert not lattes.update.called
+
+
+@patch.object(storage, "projects", MagicMock())
+def test_api_project_missing_fields(app):
+    """Test every missing project field is reported at once"""
+    with app.test_client() as client:
+        res = client.post(
+            "/api/project",
+            json={"title": "project"},
+            headers={"Authorization": f"Bearer {project_token}"},
+        )
+    json_data = res.get_json()
+
+    assert res.status_code == 400
+    assert sorted(json_data["errors"]) == [
+        "demo_link",
+        "description",
+        "git_repo",
+        "image",
+        "meta",
+    ]